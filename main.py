@@ -12,9 +12,38 @@ def main():
     
     # Add chunk command
     chunk_parser = subparsers.add_parser("chunk", help="Chunk JSON files")
+    chunk_parser.add_argument("--format", default="json", choices=["json", "jsonl"],
+                              help="One JSON file per chunk, or sharded JSONL files")
+    chunk_parser.add_argument("--workers", type=int, default=1, help="Processes used to chunk files in parallel")
+    chunk_parser.add_argument("--strategy", default="chars", choices=["chars", "tokens"],
+                              help="Fixed character windows, or sentence/section packing to a token budget")
+    chunk_parser.add_argument("--max-tokens", type=int, default=254,
+                              help="Token budget per chunk for --strategy tokens")
     
     # Add embed command
     embed_parser = subparsers.add_parser("embed", help="Create embeddings and FAISS index")
+    embed_parser.add_argument("--index-type", default="flat", choices=["flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "fp16"],
+                              help="FAISS index type (sq8/fp16 store scalar-quantized vectors)")
+    embed_parser.add_argument("--nlist", type=int, default=None, help="IVF list count (default: ~4*sqrt(n))")
+    embed_parser.add_argument("--train-size", type=int, default=None, help="Vectors sampled to train IVF indexes")
+    embed_parser.add_argument("--pq-m", type=int, default=16, help="Sub-quantizers for ivf_pq")
+    embed_parser.add_argument("--hnsw-m", type=int, default=32, help="Graph neighbours per node for hnsw")
+    embed_parser.add_argument("--eval-k", type=int, default=10, help="k used for the recall@k report")
+    embed_parser.add_argument("--eval-queries", type=int, default=200,
+                              help="Queries sampled for the recall/latency report (0 to skip)")
+    embed_parser.add_argument("--full", action="store_true",
+                              help="Re-encode every chunk instead of only new or changed ones")
+    embed_parser.add_argument("--streaming", action="store_true",
+                              help="Stream chunks through the encoder with bounded memory on full rebuilds "
+                                   "(first build or --full; incremental updates ignore it)")
+    embed_parser.add_argument("--workers", type=int, default=1, help="Encoder processes used with --streaming")
+    embed_parser.add_argument("--batch-size", type=int, default=64, help="Chunks per encoder batch with --streaming")
+    embed_parser.add_argument("--quantize-encoder", action="store_true",
+                              help="Also export an int8 ONNX query encoder for QUERY_ENCODER=onnx-int8")
+    embed_parser.add_argument("--quantization", default=None, choices=["avx2", "avx512", "avx512_vnni", "arm64"],
+                              help="CPU preset for --quantize-encoder (default: avx2, or arm64 on ARM)")
+    embed_parser.add_argument("--no-lexical", action="store_true",
+                              help="Skip the BM25 index used for hybrid retrieval")
     
     # Add serve command
     serve_parser = subparsers.add_parser("serve", help="Start the API server")
@@ -26,13 +55,37 @@ def main():
     if args.command == "chunk":
         from src.embedder import chunk_json_files
         print("Chunking JSON files...")
-        chunk_json_files("data/parsed_json", "data/chunked_json")
+        chunk_json_files(
+            "data/parsed_json",
+            "data/chunked_json",
+            output_format=args.format,
+            workers=args.workers,
+            strategy=args.strategy,
+            max_tokens=args.max_tokens,
+        )
         print("Chunking complete.")
         
     elif args.command == "embed":
         from src.vectorizer import embed_and_store
         print("Creating embeddings and FAISS index...")
-        embed_and_store("data/chunked_json", "embeddings/bg3_vectorstore")
+        embed_and_store(
+            "data/chunked_json",
+            "embeddings/bg3_vectorstore",
+            index_type=args.index_type,
+            nlist=args.nlist,
+            train_size=args.train_size,
+            pq_m=args.pq_m,
+            hnsw_m=args.hnsw_m,
+            eval_k=args.eval_k,
+            eval_queries=args.eval_queries,
+            incremental=not args.full,
+            streaming=args.streaming,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            quantize_encoder=args.quantize_encoder,
+            quantization=args.quantization,
+            lexical=not args.no_lexical,
+        )
         print("Embedding complete.")
         
     elif args.command == "serve":
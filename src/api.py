@@ -1,27 +1,215 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, Header, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
-from pydantic import BaseModel
-from typing import Optional
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-import json
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import os
+import json
 import uuid
+import secrets
+import asyncio
+import time
+from datetime import datetime, timedelta
+import numpy as np
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
-from src.rag_pipeline import qa_chain
-from src.db import init_db, add_conversation, get_conversation_history
+from fastapi.responses import RedirectResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from src.rag_pipeline import (load_engine, current_engine, reload_engine, vectorstore_dir, aretrieve,
+                              agenerate_answer, astream_answer, context_assembler)
+from src.retriever import build_in_progress, read_index_version, INDEX_FILE
+from src.db import (init_db, wait_for_database, conversation_writer, get_conversation_history,
+                    add_cached_answer, get_cached_answers, prune_cached_answers)
+from src.cache import SemanticAnswerCache
+from src.startup import StartupStages
+from src.metrics import registry, span, record, current_timings, debug_timing_requested, TimingMiddleware
+
+# Semantic answer cache settings
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+ANSWER_CACHE_PERSIST = os.getenv("ANSWER_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+# Maximum number of queries accepted by one /search/batch call
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "256"))
+# Upper bounds of the per-request search knobs and history page size
+MAX_TOP_K = int(os.getenv("MAX_TOP_K", "100"))
+MAX_NPROBE = 4096
+MAX_EF_SEARCH = 4096
+MAX_HISTORY_LIMIT = 100
+# Maximum LLM requests in flight per worker; further /query calls wait their turn
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# Run an encode and a search before reporting ready, so the first real
+# request does not pay for lazy initialisation and cold index pages
+WARMUP = os.getenv("WARMUP", "false").lower() in ("1", "true", "yes")
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "Who is Karlach?")
+# Retries of a failed startup stage, STARTUP_RETRY_DELAY seconds after the
+# first failure and doubling after each further one; once they are used up
+# /healthz fails so the process is restarted
+STARTUP_RETRIES = int(os.getenv("STARTUP_RETRIES", "5"))
+STARTUP_RETRY_DELAY = float(os.getenv("STARTUP_RETRY_DELAY", "2"))
+# Seconds between checks for a rebuilt vectorstore (0 disables the watcher);
+# a new version is loaded in the background and swapped in atomically
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "30"))
+# POST /admin/reload requires this value in the X-Admin-Token header; when it
+# is not set the endpoint is disabled (404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Stage timings are returned in a Server-Timing header when the request sends
+# X-Debug-Timing: 1, or on every response with DEBUG_TIMING=true
+DEBUG_TIMING = os.getenv("DEBUG_TIMING", "false").lower() in ("1", "true", "yes")
+# Sampling profiler (needs pyinstrument): PROFILE_SAMPLE_RATE of the requests
+# to the comma-separated PROFILE_PATHS are profiled into PROFILE_DIR
+PROFILE_PATHS = [path.strip() for path in os.getenv("PROFILE_PATHS", "").split(",") if path.strip()]
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+answer_cache = SemanticAnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    threshold=ANSWER_CACHE_THRESHOLD,
+)
+
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+llm_calls = {"in_flight": 0, "waiting": 0}
+
+@asynccontextmanager
+async def llm_slot():
+    """Hold one of the LLM_MAX_CONCURRENCY slots, counting waiting and in-flight calls"""
+    llm_calls["waiting"] += 1
+    try:
+        # Waiting on the LLM holds no thread, only a slot in the semaphore
+        with span("llm_wait"):
+            await llm_semaphore.acquire()
+    finally:
+        llm_calls["waiting"] -= 1
+    llm_calls["in_flight"] += 1
+    try:
+        yield
+    finally:
+        llm_calls["in_flight"] -= 1
+        llm_semaphore.release()
+
+startup = StartupStages(retries=STARTUP_RETRIES, retry_delay=STARTUP_RETRY_DELAY)
+# Serialises hot swaps triggered by the watcher and /admin/reload
+reload_lock = asyncio.Lock()
+index_reloads = {"count": 0, "failures": 0, "last_error": None, "last_reload_at": None}
+
+def get_engine():
+    """
+    The active retrieval engine, or 503 while the worker is still starting.
+
+    Handlers take the engine once and use it for the whole request, so a hot
+    swap never changes the index underneath a request in flight.
+    """
+    engine = current_engine()
+    if engine is None or not startup.ready:
+        raise HTTPException(status_code=503, detail="Retrieval engine is still loading; see /healthz")
+    return engine
 
-# Initialize the database on startup
-init_db()
+def init_database():
+    """Wait for PostgreSQL and create tables and indexes"""
+    if not wait_for_database():
+        raise RuntimeError("Database is not reachable")
+    init_db()
 
-MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-VECTORSTORE_DIR = "embeddings/bg3_vectorstore"
+def warm_answer_cache(engine):
+    """
+    Warm the answer cache with answers built on the currently loaded index,
+    after deleting the stored answers of other versions and expired ones
+    """
+    since = datetime.now() - timedelta(seconds=ANSWER_CACHE_TTL)
+    pruned = prune_cached_answers(engine.version, since)
+    if pruned:
+        print(f"Deleted {pruned} stale answer cache entries")
+    for entry in reversed(get_cached_answers(engine.version, since, limit=ANSWER_CACHE_SIZE)):
+        answer_cache.add(
+            entry["query"],
+            np.frombuffer(entry["embedding"], dtype="float32"),
+            entry["answer"],
+            engine.version,
+            created_at=entry["created_at"].timestamp(),
+            sources=entry["sources"],
+        )
 
-app = FastAPI()
+def warmup(engine):
+    """Exercise the encoder (through the batcher) and the FAISS search once"""
+    engine.search(WARMUP_QUERY, top_k=1)
+
+async def load_resources():
+    """
+    Startup: connect to the database and load the retrieval engine
+    concurrently, then warm caches. Stage timings are kept in ``startup``.
+    """
+    stages = ["database", "engine"]
+    if ANSWER_CACHE_PERSIST:
+        stages.append("answer_cache")
+    if WARMUP:
+        stages.append("warmup")
+    startup.pending(*stages)
+    try:
+        _, loaded = await asyncio.gather(
+            startup.run("database", init_database),
+            startup.run("engine", load_engine),
+        )
+        conversation_writer.start()
+        if ANSWER_CACHE_PERSIST:
+            await startup.run("answer_cache", warm_answer_cache, loaded)
+        if WARMUP:
+            await startup.run("warmup", warmup, loaded)
+    except Exception:
+        # Retries are used up; the failed stage and its error are reported by
+        # /healthz (now 503) and /readyz
+        return
+    startup.mark_ready()
+
+async def swap_index():
+    """
+    Load the vectorstore again in a worker thread and make it active.
+
+    Returns:
+        tuple: (previous version, active version)
+    """
+    async with reload_lock:
+        old = current_engine()
+        try:
+            new = await asyncio.to_thread(reload_engine)
+        except Exception as e:
+            index_reloads["failures"] += 1
+            index_reloads["last_error"] = str(e)
+            raise
+        index_reloads["count"] += 1
+        index_reloads["last_error"] = None
+        index_reloads["last_reload_at"] = datetime.now().isoformat()
+        return (old.version if old is not None else None), new.version
+
+async def watch_index():
+    """Swap in a rebuilt vectorstore once embed_and_store has finished it"""
+    while True:
+        await asyncio.sleep(INDEX_WATCH_INTERVAL)
+        engine = current_engine()
+        if engine is None or not startup.ready:
+            continue
+        try:
+            # The info file is written last, so a new version means the
+            # index, metadata and content store are complete
+            version = await asyncio.to_thread(read_index_version, vectorstore_dir)
+            if version != engine.version and not build_in_progress(vectorstore_dir):
+                await swap_index()
+        except Exception as e:
+            print(f"Index reload failed, still serving version {engine.version}: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Loading runs in the background so /healthz answers while it progresses
+    tasks = [asyncio.create_task(load_resources())]
+    if INDEX_WATCH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(watch_index()))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Flush conversations still waiting in the write-behind buffer
+    await asyncio.to_thread(conversation_writer.close)
+
+app = FastAPI(lifespan=lifespan)
 
 # Add root route to redirect to index.html
 @app.get("/", response_class=HTMLResponse)
@@ -57,81 +245,311 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# Load model, index, and metadata at startup
-model = SentenceTransformer(MODEL_NAME)
-index = faiss.read_index(os.path.join(VECTORSTORE_DIR, "bg3_faiss.index"))
-with open(os.path.join(VECTORSTORE_DIR, "bg3_metadata.json"), "r", encoding="utf-8") as f:
-    metadatas = json.load(f)
+# Request latency and per-stage timings for /metrics and the Server-Timing header
+app.add_middleware(
+    TimingMiddleware,
+    always_debug=DEBUG_TIMING,
+    profile_paths=PROFILE_PATHS,
+    profile_rate=PROFILE_SAMPLE_RATE,
+    profile_dir=PROFILE_DIR,
+)
 
 class QueryRequest(BaseModel):
     query: str
-    top_k: int = 3
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+    nprobe: Optional[int] = Field(None, ge=1, le=MAX_NPROBE)  # IVF indexes: inverted lists probed per query
+    ef_search: Optional[int] = Field(None, ge=1, le=MAX_EF_SEARCH)  # HNSW indexes: search beam width
+    hybrid: Optional[bool] = None  # Fuse with BM25; defaults to HYBRID_SEARCH
+    tags: Optional[List[str]] = None  # Only chunks with any of these tags (e.g. "Spells")
     session_id: Optional[str] = None  # Optional session ID for tracking conversations
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+    nprobe: Optional[int] = Field(None, ge=1, le=MAX_NPROBE)
+    ef_search: Optional[int] = Field(None, ge=1, le=MAX_EF_SEARCH)
+    hybrid: Optional[bool] = None
+    tags: Optional[List[str]] = None
+
 class ConversationHistoryRequest(BaseModel):
     session_id: Optional[str] = None
-    limit: int = 10
-    offset: int = 0
+    limit: int = Field(10, ge=1, le=MAX_HISTORY_LIMIT)
+    offset: int = Field(0, ge=0)
+    # Keyset cursor: the next_cursor of the previous page. Unlike offset, the
+    # cost of a page does not grow with how far back it is.
+    before_timestamp: Optional[datetime] = None
+    before_id: Optional[int] = None
 
 @app.post("/search")
 def search(request: QueryRequest):
-    embedding = model.encode([request.query])
-    D, I = index.search(np.array(embedding).astype('float32'), request.top_k)
-    results = []
-    for idx in I[0]:
-        if idx < len(metadatas):
-            result = metadatas[idx].copy()
-            result["score"] = float(D[0][list(I[0]).index(idx)])
-            
-            # Find the content file and retrieve the actual content
-            chunk_id = result["chunk_id"]
-            content_file = os.path.join("data/chunked_json", f"{chunk_id}.json")
-            try:
-                if os.path.exists(content_file):
-                    with open(content_file, "r", encoding="utf-8") as f:
-                        chunk_data = json.load(f)
-                        result["content"] = chunk_data.get("content", "")
-            except Exception as e:
-                print(f"Error loading content for {chunk_id}: {e}")
-                
-            results.append(result)
-    return {"results": results}
+    # The encoder, index and chunk text are shared with the RAG chain
+    engine = get_engine()
+    results = engine.search(
+        request.query,
+        top_k=request.top_k,
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        hybrid=request.hybrid,
+        tags=request.tags,
+    )
+    return {"results": results, "index_version": engine.version}
+
+@app.post("/search/batch")
+def search_batch(request: BatchQueryRequest):
+    """Endpoint to search many queries with one batched encode and FAISS search"""
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_QUERIES} queries per batch, got {len(request.queries)}"
+        )
+    engine = get_engine()
+    results = engine.search_batch(
+        request.queries,
+        top_k=request.top_k,
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        hybrid=request.hybrid,
+        tags=request.tags,
+    )
+    return {
+        "results": [{"query": q, "results": hits} for q, hits in zip(request.queries, results)],
+        "index_version": engine.version,
+    }
 
 class QueryResponse(BaseModel):
     query: str
 
+def doc_sources(docs):
+    """The "sources" payload for the documents an answer is built from"""
+    return [dict(doc.metadata, content=doc.page_content) for doc in docs]
+
+async def remember_answer(query_text, embedding, answer, index_version, sources):
+    """Add a fresh LLM answer and its sources to the semantic cache (and its table, if enabled)"""
+    answer_cache.add(query_text, embedding, answer, index_version, sources=sources)
+    if ANSWER_CACHE_PERSIST:
+        expire_before = datetime.now() - timedelta(seconds=ANSWER_CACHE_TTL)
+        await asyncio.to_thread(add_cached_answer, query_text, answer, embedding.tobytes(), index_version, sources,
+                                expire_before)
+
 @app.post("/query")
-def query(request: QueryRequest):
+async def query(request: QueryRequest):
     """Endpoint to handle queries using the RAG pipeline and store in database"""
     print(f"Request data: {request}")  # Debug logging
     query_text = request.query
-    response = qa_chain.invoke({"query": query_text})
-    answer = response["result"]
+    engine = get_engine()
+
+    # Reuse the answer to a near-identical question on the same index version.
+    # The embedding is cached, so the retriever below does not encode it again.
+    # Tag-filtered questions are answered from other chunks, so they bypass
+    # the answer cache.
+    embedding = (await engine.aencode_queries([query_text]))[0]
+    with span("answer_cache"):
+        cached = None if request.tags else answer_cache.lookup(embedding, engine.version)
+    if cached is not None:
+        answer = cached["answer"]
+    else:
+        docs = await aretrieve(query_text, engine, request.tags)
+        async with llm_slot():
+            with span("llm"):
+                answer = await agenerate_answer(query_text, docs)
+        if not request.tags:
+            await remember_answer(query_text, embedding, answer, engine.version, doc_sources(docs))
     
-    # Store conversation in database
+    # Store conversation in database (written behind, in batches)
     session_id = request.session_id or str(uuid.uuid4())  # Generate a new session ID if not provided
-    add_conversation(
-        query=query_text,
-        response=answer,
-        session_id=session_id
-    )
+    conversation_writer.enqueue(query_text, answer, session_id=session_id)
     
-    return {"answer": answer, "session_id": session_id}
+    return {
+        "answer": answer,
+        "session_id": session_id,
+        "cached": cached is not None,
+        "index_version": engine.version,
+    }
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    Streaming variant of /query using Server-Sent Events.
+
+    Emits a "sources" event with the retrieved chunks, then one "token" event
+    per LLM token, and a final "done" event once the conversation is queued for saving.
+    Failures are reported as an "error" event.
+    """
+    query_text = request.query
+    session_id = request.session_id or str(uuid.uuid4())
+    engine = get_engine()
+
+    async def events():
+        # The 200 and the SSE headers are already sent when the first event is
+        # produced, so every failure (encode, retrieval, context, LLM) has to
+        # reach the client as an "error" event
+        try:
+            embedding = (await engine.aencode_queries([query_text]))[0]
+            with span("answer_cache"):
+                cached = None if request.tags else answer_cache.lookup(embedding, engine.version)
+            if cached is not None:
+                answer = cached["answer"]
+                sources = cached["sources"]
+                if sources is None:
+                    # Persisted before sources were stored with the answer
+                    sources = doc_sources(await aretrieve(query_text, engine, request.tags))
+                yield sse_event("sources", {"sources": sources, "session_id": session_id})
+                yield sse_event("token", {"token": answer})
+            else:
+                docs = await aretrieve(query_text, engine, request.tags)
+                sources = doc_sources(docs)
+                yield sse_event("sources", {"sources": sources, "session_id": session_id})
+                parts = []
+                async with llm_slot():
+                    start = time.perf_counter()
+                    async for token in astream_answer(query_text, docs):
+                        if not parts:
+                            record("llm_first_token", time.perf_counter() - start)
+                        parts.append(token)
+                        yield sse_event("token", {"token": token})
+                    record("llm", time.perf_counter() - start)
+                answer = "".join(parts)
+                if not request.tags:
+                    await remember_answer(query_text, embedding, answer, engine.version, sources)
+
+            conversation_writer.enqueue(query_text, answer, session_id=session_id)
+            done = {
+                "session_id": session_id,
+                "cached": cached is not None,
+                "index_version": engine.version,
+            }
+            if debug_timing_requested():
+                # Headers went out before streaming, so the breakdown comes here
+                done["timings_ms"] = current_timings()
+            yield sse_event("done", done)
+        except Exception as e:
+            print(f"Error streaming answer: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/history")
 def get_history(request: ConversationHistoryRequest):
     """Endpoint to retrieve conversation history"""
-    conversations = get_conversation_history(
-        limit=request.limit,
-        offset=request.offset,
-        session_id=request.session_id
-    )
-    return {"history": conversations}
+    with span("db_history"):
+        conversations = get_conversation_history(
+            limit=request.limit,
+            offset=request.offset,
+            session_id=request.session_id,
+            before_timestamp=request.before_timestamp,
+            before_id=request.before_id
+        )
+    next_cursor = None
+    if conversations and len(conversations) == request.limit:
+        last = conversations[-1]
+        next_cursor = {"before_timestamp": last["timestamp"], "before_id": last["id"]}
+    return {"history": conversations, "next_cursor": next_cursor}
 
 @app.get("/history/latest")
 def get_latest_conversation():
     """Endpoint to get the most recent conversation"""
+    # A single probe of the (timestamp, id) index
     conversations = get_conversation_history(limit=1)
-    return {"conversation": conversations[0] if conversations else None}
\ No newline at end of file
+    return {"conversation": conversations[0] if conversations else None}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Endpoint to report hit rates of the in-process caches"""
+    engine = get_engine()
+    return {
+        "query_embeddings": engine.query_cache.stats(),
+        "encoder_batches": engine.batcher.stats() if engine.batcher is not None else None,
+        "answers": answer_cache.stats(),
+        "conversation_writer": conversation_writer.stats(),
+        "context": context_assembler.stats(),
+        "index": {
+            "version": engine.version,
+            "vectors": engine.index.ntotal,
+            "query_encoder": engine.query_encoder,
+            "reloads": dict(index_reloads),
+        },
+    }
+
+@registry.collector
+def collect_api_metrics():
+    """Gauges and counters read from the caches, engine and writer on each scrape"""
+    yield "bg3_ready", "gauge", "1 once startup finished", [({}, startup.ready)]
+    yield "bg3_llm_in_flight", "gauge", "LLM calls in progress", [({}, llm_calls["in_flight"])]
+    yield "bg3_llm_waiting", "gauge", "LLM calls waiting for a slot", [({}, llm_calls["waiting"])]
+    answers = answer_cache.stats()
+    yield "bg3_answer_cache_hits_total", "counter", "Semantic answer cache hits", [({}, answers["hits"])]
+    yield "bg3_answer_cache_misses_total", "counter", "Semantic answer cache misses", [({}, answers["misses"])]
+    yield "bg3_answer_cache_hit_ratio", "gauge", "Semantic answer cache hit rate", [({}, answers["hit_rate"])]
+    yield "bg3_answer_cache_entries", "gauge", "Answers in the semantic cache", [({}, answers["size"])]
+    writer = conversation_writer.stats()
+    yield "bg3_conversations_pending", "gauge", "Conversations waiting to be written", [({}, writer["pending"])]
+    yield "bg3_conversations_total", "counter", "Conversations by outcome", [
+        ({"outcome": outcome}, writer[outcome]) for outcome in ("written", "dropped", "failed")]
+    context = context_assembler.stats()
+    yield "bg3_context_tokens_total", "counter", "Estimated context tokens before and after assembly", [
+        ({"kind": "retrieved"}, context["input_tokens"]), ({"kind": "prompt"}, context["output_tokens"])]
+    yield "bg3_index_reloads_total", "counter", "Vectorstore hot swaps", [
+        ({"outcome": "success"}, index_reloads["count"]), ({"outcome": "failure"}, index_reloads["failures"])]
+
+    engine = current_engine()
+    if engine is None:
+        return
+    queries = engine.query_cache.stats()
+    yield "bg3_query_cache_hits_total", "counter", "Query embedding cache hits", [({}, queries["hits"])]
+    yield "bg3_query_cache_misses_total", "counter", "Query embedding cache misses", [({}, queries["misses"])]
+    yield "bg3_query_cache_hit_ratio", "gauge", "Query embedding cache hit rate", [({}, queries["hit_rate"])]
+    if engine.batcher is not None:
+        batches = engine.batcher.stats()
+        yield "bg3_encoder_batch_size_avg", "gauge", "Average micro-batch size", [({}, batches["avg_batch_size"])]
+    yield "bg3_index_vectors", "gauge", "Vectors in the FAISS index", [({}, engine.index.ntotal)]
+    index_path = os.path.join(engine.vectorstore_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        yield "bg3_index_size_bytes", "gauge", "Size of the FAISS index file", [({}, os.path.getsize(index_path))]
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of request/stage latency histograms and cache, index and LLM gauges"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness: the process is up; includes startup progress and stage timings.
+    503 once a startup stage has failed all its retries, since the worker
+    would otherwise never become ready.
+    """
+    report = startup.report()
+    engine = current_engine()
+    report["index_version"] = engine.version if engine is not None else None
+    return JSONResponse(status_code=503 if report["failed"] else 200, content=report)
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 once the database and retrieval engine are loaded, else 503"""
+    report = startup.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: Optional[str] = Header(default=None)):
+    """Load the vectorstore from disk again and swap it in without a restart"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    get_engine()
+    try:
+        previous, active = await swap_index()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+    return {"previous_version": previous, "index_version": active}
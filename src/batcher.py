@@ -0,0 +1,135 @@
+"""
+Dynamic micro-batching of query encodes.
+
+Concurrent requests each need a single-sentence embedding. Instead of one
+``model.encode`` call per request, a background thread collects pending
+texts for up to ``max_wait_ms`` (or until ``max_batch_size`` are waiting),
+encodes them as one batch and hands each caller its own vector.
+"""
+import sys
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class BatcherClosed(RuntimeError):
+    """Raised by MicroBatcher.submit() once the batcher has been closed"""
+
+
+class MicroBatcher:
+    """Collects encode requests from many threads into batched encoder calls"""
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0):
+        """
+        Args:
+            encode_fn (callable): Maps a list of texts to an (n x dim) array
+            max_batch_size (int): Largest batch sent to ``encode_fn``
+            max_wait_ms (float): How long the first request in a batch may
+                wait for others to join
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, name="query-encoder-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """Queue one text and return a Future resolving to its embedding"""
+        future = Future()
+        with self._lock:
+            # Nothing would serve requests queued after the stop marker
+            if self.closed:
+                raise BatcherClosed("MicroBatcher is closed")
+            self._queue.put((text, future))
+        return future
+
+    def encode(self, texts):
+        """Encode texts through the batcher, blocking until all are done"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def aencode(self, texts):
+        """Async variant of encode() that does not hold a thread while waiting"""
+        futures = [asyncio.wrap_future(self.submit(text)) for text in texts]
+        return await asyncio.gather(*futures)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = []
+            try:
+                # Requests whose caller gave up (e.g. a cancelled aencode())
+                # are dropped; the others can no longer be cancelled
+                batch = [(text, future) for text, future in self._collect(first)
+                         if future.set_running_or_notify_cancel()]
+                if batch:
+                    self._encode_batch(batch)
+            except Exception as e:
+                # Never let one bad batch end the thread: every later encode would hang
+                print(f"Query encoder batcher error: {e}", file=sys.stderr)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _encode_batch(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = self.encode_fn(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+
+    def close(self):
+        """Stop the background thread after the queued requests are served"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            }
@@ -0,0 +1,210 @@
+"""
+In-process caches shared by the API endpoints.
+"""
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query):
+    """
+    Cache key for a query: case-folded with whitespace collapsed.
+
+    MiniLM's tokenizer is uncased, so queries differing only in case or
+    spacing produce the same embedding.
+    """
+    return " ".join(query.casefold().split())
+
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU cache of query embeddings with hit/miss counters"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query):
+        """Return the cached embedding for ``query``, or None"""
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query, embedding):
+        """Store an embedding, evicting the least recently used entries"""
+        if self.maxsize <= 0:
+            return
+        embedding.setflags(write=False)  # shared between requests
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for monitoring; hit_rate is over all lookups so far"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by query embedding, reused for near-identical questions.
+
+    A cached answer is returned when a new query's cosine similarity to a
+    cached query is at least ``threshold`` and both were answered against the
+    same index version. Entries expire after ``ttl`` seconds and the least
+    recently used entries are evicted beyond ``maxsize``.
+
+    Hits move entries to the end of the LRU order, so expiry follows a
+    second, insertion-ordered map of creation times: expired entries are
+    popped from its head instead of scanning every entry on each lookup.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600, threshold=0.95):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        # key -> created_at, in insertion order
+        self._created = OrderedDict()
+        self._next_key = 0
+        self._matrices = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _expire(self, now):
+        expired = 0
+        while self._created:
+            key, created_at = next(iter(self._created.items()))
+            if now - created_at <= self.ttl:
+                break
+            del self._created[key]
+            del self._entries[key]
+            expired += 1
+        if expired:
+            self.expirations += expired
+            self._matrices.clear()
+
+    def _similarities(self, index_version):
+        """
+        Keys and embedding matrix of the entries for one index version.
+
+        Only these are compared with the query: entries answered on another
+        index may come from a model with another embedding dimension.
+        Rebuilt lazily after inserts and evictions, reused across lookups.
+        """
+        if index_version not in self._matrices:
+            keys = [key for key, entry in self._entries.items() if entry["index_version"] == index_version]
+            matrix = np.vstack([self._entries[key]["embedding"] for key in keys]) if keys else None
+            self._matrices[index_version] = (keys, matrix)
+        return self._matrices[index_version]
+
+    def lookup(self, embedding, index_version):
+        """
+        Find a cached answer for a query embedding.
+
+        Returns:
+            dict or None: The cached entry ("query", "answer", "sources",
+            "index_version", "created_at") plus its "similarity", or None on
+            a miss
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            keys, matrix = self._similarities(index_version)
+            if keys and matrix.shape[1] == query.shape[0]:
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                # Warming may add entries older than ones already cached,
+                # which the head-first expiry only reaches later
+                if scores[best] >= self.threshold and now - self._entries[keys[best]]["created_at"] <= self.ttl:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    result = {k: v for k, v in self._entries[keys[best]].items() if k != "embedding"}
+                    result["similarity"] = float(scores[best])
+                    return result
+            self.misses += 1
+            return None
+
+    def add(self, query, embedding, answer, index_version, created_at=None, sources=None):
+        """
+        Cache an answer; ``created_at`` (epoch seconds) is used when warming
+        from storage. ``sources`` are the chunks the answer was built from,
+        returned with it so cache hits can show them.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            created_at = created_at if created_at is not None else time.time()
+            self._entries[self._next_key] = {
+                "query": query,
+                "answer": answer,
+                "sources": sources,
+                "index_version": index_version,
+                "created_at": created_at,
+                "embedding": self._normalize(embedding),
+            }
+            self._created[self._next_key] = created_at
+            self._next_key += 1
+            while len(self._entries) > self.maxsize:
+                key, _ = self._entries.popitem(last=False)
+                del self._created[key]
+                self.evictions += 1
+            self._matrices.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._created.clear()
+            self._matrices.clear()
+
+    def stats(self):
+        """Counters for monitoring; hit_rate is over all lookups so far"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
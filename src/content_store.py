@@ -0,0 +1,136 @@
+"""
+Packed, memory-mapped storage for chunk text.
+
+Layout of a packed file (all integers little-endian uint64):
+
+    magic (8 bytes) | count | offsets[count + 1] | utf-8 blob
+
+Row ``i`` is ``blob[offsets[i]:offsets[i + 1]]`` and rows are stored in FAISS
+row order, so a search hit can be turned into text with a single slice of the
+mapped file instead of opening one JSON file per chunk.
+"""
+import mmap
+from array import array
+import os
+import shutil
+import numpy as np
+
+CONTENT_STORE_FILE = "bg3_content.bin"
+MAGIC = b"BG3PACK1"
+HEADER_SIZE = len(MAGIC) + 8
+
+
+class ContentStoreWriter:
+    """
+    Append strings one at a time and write them out as a packed file.
+
+    Text is spooled to a side file as it arrives, so only the offsets table
+    (8 bytes per row) is kept in memory while a large corpus streams through.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._blob_path = f"{path}.blob.tmp"
+        self._blob = open(self._blob_path, "wb")
+        self._offsets = array("Q", [0])
+
+    def append(self, text):
+        """Append one row and return its row number"""
+        data = (text or "").encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        return len(self._offsets) - 2
+
+    def close(self):
+        """Write header, offsets and blob to ``path`` and swap it in place"""
+        self._blob.close()
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f, open(self._blob_path, "rb") as blob:
+                f.write(MAGIC)
+                f.write(np.array([len(self._offsets) - 1], dtype="<u8").tobytes())
+                f.write(np.frombuffer(self._offsets, dtype=np.uint64).astype("<u8").tobytes())
+                shutil.copyfileobj(blob, f)
+            # Swap the file in place so readers never see a half-written store
+            os.replace(tmp_path, self.path)
+        finally:
+            os.remove(self._blob_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._blob.close()
+            os.remove(self._blob_path)
+
+
+def write_content_store(path, texts):
+    """
+    Write a list of strings to a packed file.
+
+    Args:
+        path (str): Destination file path
+        texts (list): Strings in FAISS row order (None is stored as "")
+    """
+    with ContentStoreWriter(path) as writer:
+        for text in texts:
+            writer.append(text)
+
+
+class ContentStore:
+    """Read-only, memory-mapped view over a packed content file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses zero-length files; treat them as an empty store
+            self._file.close()
+            raise ValueError(f"Empty content store: {path}")
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a packed content store: {path}")
+        self.count = int(np.frombuffer(self._mm, dtype="<u8", count=1, offset=len(MAGIC))[0])
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=self.count + 1, offset=HEADER_SIZE)
+        self._blob_start = HEADER_SIZE + 8 * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def get(self, row):
+        """Return the text stored at ``row``, or None when out of range."""
+        if row < 0 or row >= self.count:
+            return None
+        start = self._blob_start + int(self._offsets[row])
+        end = self._blob_start + int(self._offsets[row + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def row_lengths(self):
+        """Byte length of every row, as an array."""
+        return np.diff(self._offsets)
+
+    def close(self):
+        """Release the mapping and the underlying file handle."""
+        self._offsets = None
+        self._mm.close()
+        self._file.close()
+
+
+def load_content_store(vectorstore_dir):
+    """
+    Open the packed content store of a vectorstore directory.
+
+    Returns:
+        ContentStore or None: None when the vectorstore predates the packed
+        format, so callers can fall back to reading chunk files.
+    """
+    path = os.path.join(vectorstore_dir, CONTENT_STORE_FILE)
+    if not os.path.exists(path):
+        return None
+    return ContentStore(path)
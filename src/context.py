@@ -0,0 +1,211 @@
+"""
+Context assembly between retrieval and the LLM.
+
+Retrieved chunks are turned into the prompt context by:
+
+1. merging chunks of the same page with consecutive chunk_ids into one
+   passage, removing the text the chunker repeated between them
+2. dropping passages that are near-duplicates of a better-ranked one
+3. packing passages, best first, into a token budget (the last one that
+   does not fit is cut at a sentence boundary)
+"""
+import os
+import re
+import math
+import threading
+from langchain_core.documents import Document
+
+# Token budget of the assembled context; 0 disables the budget
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+# Passages sharing at least this fraction of their word shingles with a
+# kept passage are dropped
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# A passage is only cut to fit the budget if at least this many tokens remain
+CONTEXT_MIN_TOKENS = 64
+# Groq's Llama tokenizers average about 4 characters of English per token
+CHARS_PER_TOKEN = 4
+# Longest chunk overlap searched for when merging (chunk_text uses 50 chars)
+MAX_OVERLAP = 200
+# Shorter suffix/prefix matches are taken as coincidence, not overlap
+MIN_OVERLAP = 16
+SHINGLE_SIZE = 3
+
+CHUNK_ID_RE = re.compile(r"^(?P<page>.+)_chunk_(?P<index>\d+)$")
+SENTENCE_END_RE = re.compile(r"[.!?](?=\s)|\n")
+WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def parse_chunk_id(chunk_id):
+    """Split "<page>_chunk_<i>" into (page, i); (chunk_id, None) if it does not match"""
+    match = CHUNK_ID_RE.match(chunk_id or "")
+    if match is None:
+        return chunk_id, None
+    return match.group("page"), int(match.group("index"))
+
+
+def overlap_length(left, right, max_overlap=MAX_OVERLAP):
+    """Length of the longest suffix of ``left`` that is also a prefix of ``right``"""
+    for size in range(min(len(left), len(right), max_overlap), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def join_chunks(left, right):
+    """Concatenate consecutive chunks, dropping the text they share"""
+    size = overlap_length(left, right)
+    if size:
+        return left + right[size:]
+    # Token chunks do not overlap; they were split at a section or sentence
+    return left.rstrip() + "\n" + right.lstrip()
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = WORD_RE.findall(text.casefold())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut ``text`` to about ``max_tokens``, at the last sentence end that fits if there is one"""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    ends = [match.end() for match in SENTENCE_END_RE.finditer(head)]
+    # Keep a mid-sentence cut when the last sentence end is too early
+    if ends and ends[-1] >= limit // 2:
+        head = head[:ends[-1]]
+    return head.rstrip()
+
+
+class ContextAssembler:
+    """Turns retrieved documents into a deduplicated, budgeted context"""
+
+    def __init__(self, max_tokens=CONTEXT_MAX_TOKENS, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self._lock = threading.Lock()
+        self.assembled = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.merged = 0
+        self.deduplicated = 0
+        self.truncated = 0
+        self.dropped = 0
+
+    def merge_adjacent(self, docs):
+        """
+        Merge documents of the same page with consecutive chunk_ids.
+
+        Returns:
+            list: (rank, Document) tuples, where rank is the best retrieval
+            rank among the merged chunks
+        """
+        pages = {}
+        for rank, doc in enumerate(docs):
+            page, index = parse_chunk_id(doc.metadata.get("chunk_id"))
+            key = page if index is not None else (page, rank)
+            pages.setdefault(key, []).append((index if index is not None else 0, rank, doc))
+
+        passages = []
+        for chunks in pages.values():
+            chunks.sort(key=lambda chunk: chunk[0])
+            run = [chunks[0]]
+            for chunk in chunks[1:]:
+                if chunk[0] == run[-1][0] + 1:
+                    run.append(chunk)
+                elif chunk[0] != run[-1][0]:
+                    passages.append(self._merge_run(run))
+                    run = [chunk]
+            passages.append(self._merge_run(run))
+        passages.sort(key=lambda passage: passage[0])
+        return passages
+
+    def _merge_run(self, run):
+        rank = min(chunk[1] for chunk in run)
+        if len(run) == 1:
+            return rank, run[0][2]
+        text = run[0][2].page_content
+        for _, _, doc in run[1:]:
+            text = join_chunks(text, doc.page_content)
+        best = next(doc for _, r, doc in run if r == rank)
+        metadata = dict(best.metadata)
+        metadata["chunk_ids"] = [doc.metadata.get("chunk_id") for _, _, doc in run]
+        with self._lock:
+            self.merged += len(run) - 1
+        return rank, Document(page_content=text, metadata=metadata)
+
+    def deduplicate(self, passages):
+        """Drop passages mostly contained in a better-ranked kept passage"""
+        kept, kept_shingles = [], []
+        for rank, doc in passages:
+            current = shingles(doc.page_content)
+            duplicate = any(
+                current and len(current & other) >= self.dedup_threshold * len(current)
+                for other in kept_shingles
+            )
+            if duplicate:
+                with self._lock:
+                    self.deduplicated += 1
+                continue
+            kept.append((rank, doc))
+            kept_shingles.append(current)
+        return kept
+
+    def pack(self, passages):
+        """Keep passages, best first, while they fit the token budget"""
+        if self.max_tokens <= 0:
+            return [doc for _, doc in passages]
+        packed, remaining = [], self.max_tokens
+        for _, doc in passages:
+            n_tokens = estimate_tokens(doc.page_content)
+            if n_tokens <= remaining:
+                packed.append(doc)
+                remaining -= n_tokens
+                continue
+            if remaining >= CONTEXT_MIN_TOKENS:
+                text = truncate_to_tokens(doc.page_content, remaining)
+                packed.append(Document(page_content=text, metadata=dict(doc.metadata, truncated=True)))
+                remaining -= estimate_tokens(text)
+                with self._lock:
+                    self.truncated += 1
+            else:
+                with self._lock:
+                    self.dropped += 1
+        return packed
+
+    def assemble(self, docs):
+        """
+        Build the LLM context from retrieved documents (best first).
+
+        Returns:
+            list: Documents to put in the prompt, best first
+        """
+        docs = [doc for doc in docs if doc.page_content]
+        packed = self.pack(self.deduplicate(self.merge_adjacent(docs)))
+        with self._lock:
+            self.assembled += 1
+            self.input_tokens += sum(estimate_tokens(doc.page_content) for doc in docs)
+            self.output_tokens += sum(estimate_tokens(doc.page_content) for doc in packed)
+        return packed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "dedup_threshold": self.dedup_threshold,
+                "assembled": self.assembled,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "token_reduction": 1 - self.output_tokens / self.input_tokens if self.input_tokens else 0.0,
+                "merged_chunks": self.merged,
+                "deduplicated": self.deduplicated,
+                "truncated": self.truncated,
+                "dropped": self.dropped,
+            }
@@ -2,13 +2,18 @@
 Database module for handling PostgreSQL operations
 """
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, inspect, insert, text, tuple_, Column, Index, Integer, String, Text, DateTime, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 import os
+import json
 import time
+import queue
+import threading
 import psycopg2
 from dotenv import load_dotenv
+from src.metrics import span
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,12 +25,22 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 
+# Write-behind conversation logging: rows are inserted in batches of up to
+# CONVERSATION_BATCH_SIZE, at least every CONVERSATION_FLUSH_INTERVAL seconds.
+# Beyond CONVERSATION_QUEUE_SIZE pending rows new conversations are dropped.
+CONVERSATION_BATCH_SIZE = int(os.getenv("CONVERSATION_BATCH_SIZE", "100"))
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "1.0"))
+CONVERSATION_QUEUE_SIZE = int(os.getenv("CONVERSATION_QUEUE_SIZE", "10000"))
+
 # Function to wait for database to be ready
 def wait_for_database(retries=5, delay=2):
     """
     Wait for the PostgreSQL database to be available.
     Retry mechanism for Docker startup sequence.
     """
+    if not DATABASE_URL.startswith("postgresql"):
+        # DATABASE_URL points at another backend (e.g. SQLite for load tests)
+        return True
     print(f"Attempting to connect to PostgreSQL at {DB_HOST}:{DB_PORT}...")
     current_try = 0
 
@@ -51,18 +66,30 @@ def wait_for_database(retries=5, delay=2):
     print("Failed to connect to the database after multiple attempts")
     return False
 
-# Try to connect to the database first
-wait_for_database()
+# wait_for_database() is called by the API's startup rather than at import,
+# so importing this module never blocks on the database
 
-# Construct database URL from environment variables
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Construct database URL from environment variables. DATABASE_URL overrides
+# it, e.g. "sqlite://" (in-memory) or "sqlite:///bg3.db" to run without
+# PostgreSQL in tests and load tests.
+DATABASE_URL = (os.getenv("DATABASE_URL")
+                or f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
-# Create SQLAlchemy engine with extended timeout and retries
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"connect_timeout": 10},
-    pool_pre_ping=True,  # Verify connections before usage
-)
+if DATABASE_URL.startswith("sqlite"):
+    # One shared connection for in-memory databases, used from the API's
+    # threads and the conversation writer
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool if DATABASE_URL in ("sqlite://", "sqlite:///:memory:") else None,
+    )
+else:
+    # Create SQLAlchemy engine with extended timeout and retries
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"connect_timeout": 10},
+        pool_pre_ping=True,  # Verify connections before usage
+    )
 
 # Create a base class for our ORM models
 Base = declarative_base()
@@ -77,6 +104,14 @@ class Conversation(Base):
     response = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.now)
     session_id = Column(String(100), nullable=True)  # To group conversations by session
+
+    # History is read newest first, optionally per session or user; id breaks
+    # timestamp ties so (timestamp, id) is a stable keyset cursor
+    __table_args__ = (
+        Index("ix_conversations_session_id_timestamp", "session_id", "timestamp", "id"),
+        Index("ix_conversations_user_id_timestamp", "user_id", "timestamp", "id"),
+        Index("ix_conversations_timestamp", "timestamp", "id"),
+    )
     
     def to_dict(self):
         """Convert model to dictionary for JSON serialization"""
@@ -89,10 +124,43 @@ class Conversation(Base):
             "session_id": self.session_id
         }
 
+class CachedAnswer(Base):
+    """Model persisting semantic answer cache entries across restarts"""
+    __tablename__ = 'answer_cache'
+
+    id = Column(Integer, primary_key=True)
+    query = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    embedding = Column(LargeBinary, nullable=False)  # float32 query embedding bytes
+    index_version = Column(String(100), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    sources = Column(Text, nullable=True)  # JSON list of the chunks the answer was built from
+
+    # Warming reads one version's newest rows (the composite index also
+    # serves lookups by version alone); pruning deletes by age
+    __table_args__ = (
+        Index("ix_answer_cache_index_version_created_at", "index_version", "created_at"),
+        Index("ix_answer_cache_created_at", "created_at"),
+    )
+
 # Create all tables in the database
 def init_db():
     """Initialize database by creating all tables"""
     Base.metadata.create_all(engine)
+    # create_all() skips tables that already exist, so add indexes introduced
+    # after a table was first created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    # ... and nullable columns introduced the same way
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                      f"{column.type.compile(engine.dialect)}"))
 
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -135,31 +203,276 @@ def add_conversation(query, response, user_id=None, session_id=None):
     finally:
         db.close()
 
+# Add many conversations in one round-trip
+def add_conversations(rows):
+    """
+    Bulk insert conversations
+
+    Args:
+        rows (list): Dicts with query, response, timestamp and optional
+            user_id / session_id
+    """
+    if not rows:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(insert(Conversation), rows)
+        db.commit()
+    finally:
+        db.close()
+
+_STOP = object()
+
+class ConversationWriter:
+    """
+    Write-behind buffer for conversation logging
+
+    Requests enqueue rows and return immediately; a background thread inserts
+    them with add_conversations() when CONVERSATION_BATCH_SIZE rows are
+    pending or CONVERSATION_FLUSH_INTERVAL seconds have passed. Rows are
+    timestamped when enqueued, so history order matches request order even
+    though they reach the table up to one flush interval later.
+    """
+
+    def __init__(self, batch_size=CONVERSATION_BATCH_SIZE, flush_interval=CONVERSATION_FLUSH_INTERVAL,
+                 max_queue=CONVERSATION_QUEUE_SIZE, write=add_conversations):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._write = write
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Start the background flush thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, query, response, user_id=None, session_id=None):
+        """
+        Queue a conversation for insertion
+
+        Returns:
+            bool: False if the queue was full and the row was dropped
+        """
+        row = {
+            "query": query,
+            "response": response,
+            "user_id": user_id,
+            "session_id": session_id,
+            "timestamp": datetime.now(),
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _flush(self, rows):
+        try:
+            with span("db_write"):
+                self._write(rows)
+        except Exception as e:
+            print(f"Failed to write {len(rows)} conversations: {e}")
+            with self._lock:
+                self.failed += len(rows)
+            return
+        with self._lock:
+            self.written += len(rows)
+            self.batches += 1
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            rows = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                rows.append(row)
+            self._flush(rows)
+        # Drain whatever was queued behind the stop marker
+        rows = []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                rows.append(row)
+        for start in range(0, len(rows), self.batch_size):
+            self._flush(rows[start:start + self.batch_size])
+
+    def close(self, timeout=None):
+        """Flush all pending rows and stop the background thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
+
+# Shared by the API; started and drained by its lifespan
+conversation_writer = ConversationWriter()
+
 # Get conversation history
-def get_conversation_history(limit=10, offset=0, user_id=None, session_id=None):
+def get_conversation_history(limit=10, offset=0, user_id=None, session_id=None,
+                             before_timestamp=None, before_id=None):
     """
-    Get conversation history from the database
+    Get conversation history from the database, newest first
     
     Args:
         limit (int): Maximum number of conversations to return
         offset (int): Number of records to skip (for pagination)
         user_id (str, optional): Filter by user_id
         session_id (str, optional): Filter by session_id
+        before_timestamp (datetime, optional): Keyset cursor; only return
+            conversations older than (before_timestamp, before_id)
+        before_id (int, optional): id of the last conversation already seen
     
     Returns:
         list: List of conversation records
     """
     db = SessionLocal()
     try:
-        query = db.query(Conversation).order_by(Conversation.timestamp.desc())
+        query = db.query(Conversation).order_by(Conversation.timestamp.desc(), Conversation.id.desc())
         
         if user_id:
             query = query.filter(Conversation.user_id == user_id)
         
         if session_id:
             query = query.filter(Conversation.session_id == session_id)
+
+        if before_timestamp is not None:
+            # Seeks straight into the (…, timestamp, id) index instead of
+            # scanning and discarding ``offset`` rows
+            if before_id is not None:
+                query = query.filter(tuple_(Conversation.timestamp, Conversation.id) < tuple_(before_timestamp, before_id))
+            else:
+                query = query.filter(Conversation.timestamp < before_timestamp)
         
         conversations = query.offset(offset).limit(limit).all()
         return [conv.to_dict() for conv in conversations]
     finally:
         db.close()
+
+# Persist a semantic answer cache entry
+def add_cached_answer(query, answer, embedding, index_version, sources=None, expire_before=None):
+    """
+    Store an answer cache entry in the database
+
+    Args:
+        query (str): User's question
+        answer (str): LLM's response
+        embedding (bytes): float32 query embedding
+        index_version (str): Vectorstore version the answer was built on
+        sources (list, optional): Chunks the answer was built from
+        expire_before (datetime, optional): Delete entries created before
+            this time in the same transaction, so expired rows do not pile up
+    """
+    db = SessionLocal()
+    try:
+        if expire_before is not None:
+            db.query(CachedAnswer).filter(CachedAnswer.created_at < expire_before).delete(synchronize_session=False)
+        db.add(CachedAnswer(
+            query=query,
+            answer=answer,
+            embedding=embedding,
+            index_version=index_version,
+            sources=json.dumps(sources, ensure_ascii=False) if sources is not None else None
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+# Load persisted semantic answer cache entries
+def get_cached_answers(index_version, since, limit=1000):
+    """
+    Get the newest answer cache entries for an index version
+
+    Args:
+        index_version (str): Vectorstore version to match
+        since (datetime): Ignore entries created before this time
+        limit (int): Maximum number of entries to return
+
+    Returns:
+        list: Dicts with query, answer, embedding (bytes), created_at and
+        sources (None for entries stored without them)
+    """
+    db = SessionLocal()
+    try:
+        entries = (
+            db.query(CachedAnswer)
+            .filter(CachedAnswer.index_version == index_version, CachedAnswer.created_at >= since)
+            .order_by(CachedAnswer.created_at.desc())
+            .limit(limit)
+            .all()
+        )
+        return [
+            {
+                "query": entry.query,
+                "answer": entry.answer,
+                "embedding": entry.embedding,
+                "created_at": entry.created_at,
+                "sources": json.loads(entry.sources) if entry.sources else None,
+            }
+            for entry in entries
+        ]
+    finally:
+        db.close()
+
+# Drop answer cache entries that can no longer be served
+def prune_cached_answers(index_version, since):
+    """
+    Delete answer cache entries of other index versions or created before ``since``
+
+    Args:
+        index_version (str): Vectorstore version whose entries are kept
+        since (datetime): Delete entries created before this time
+
+    Returns:
+        int: Number of deleted entries
+    """
+    db = SessionLocal()
+    try:
+        deleted = (
+            db.query(CachedAnswer)
+            .filter((CachedAnswer.index_version != index_version) | (CachedAnswer.created_at < since))
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+        return deleted
+    finally:
+        db.close()
@@ -1,5 +1,19 @@
 import os
+import re
 import json
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+# Tokenizer of the embedding model, used to measure token-budget chunks
+TOKENIZER_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# MiniLM truncates at 256 word pieces, two of which are [CLS] and [SEP]
+DEFAULT_MAX_TOKENS = 254
+SECTION_RE = re.compile(r"\n\s*\n|\n(?=#+\s)")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Sharded JSONL output: one chunk document per line
+SHARD_PATTERN = "chunks-{:05d}.jsonl"
+SHARD_GLOB = "chunks-*.jsonl"
 
 def chunk_text(text,chunk_size=500, overlap=50):
     """
@@ -15,29 +29,285 @@ def chunk_text(text,chunk_size=500, overlap=50):
         start += chunk_size - overlap
     return chunks
 
-def chunk_json_files(input_dir, output_dir, chunk_size=500, overlap=50):
-    """Reads JSON files, chunks their content, and saves chunked docs."""
-    os.makedirs(output_dir, exist_ok=True)
-    for fname in os.listdir(input_dir):
-        if not fname.endswith('.json'):
+def load_tokenizer(model_name=TOKENIZER_NAME):
+    """Load the (fast) tokenizer of the embedding model."""
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # Only used to count tokens, so silence the "longer than max length" warning
+    tokenizer.model_max_length = int(1e9)
+    return tokenizer
+
+def _split_long(text, tokenizer, max_tokens):
+    """Hard-split text that alone exceeds the budget into token windows."""
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = encoding["offset_mapping"]
+    pieces = []
+    for start in range(0, len(offsets), max_tokens):
+        window = offsets[start:start + max_tokens]
+        piece = text[window[0][0]:window[-1][1]].strip()
+        if piece:
+            pieces.append((piece, len(window)))
+    return pieces
+
+def _text_units(text, tokenizer, max_tokens):
+    """
+    Break text into (text, n_tokens, separator) units that fit the budget.
+
+    Sections (blank lines or markdown headings) are kept whole when they fit,
+    otherwise they fall back to sentences, and only sentences longer than the
+    budget are cut mid-sentence.
+    """
+    def count(piece):
+        return len(tokenizer.encode(piece, add_special_tokens=False))
+
+    units = []
+    for section in SECTION_RE.split(text):
+        section = section.strip()
+        if not section:
             continue
-        with open(os.path.join(input_dir, fname), 'r', encoding='utf-8') as f:
-            doc = json.load(f)
-        chunks = chunk_text(doc['content'], chunk_size, overlap)
-        for i, chunk in enumerate(chunks):
-            chunked_doc = {
-                "title": doc["title"],
-                "url": doc["url"],
-                "tags": doc["tags"],
-                "content": chunk,
-                "chunk_id": f"{fname.replace('.json','')}_chunk_{i}"
-            }
-            out_path = os.path.join(output_dir, f"{fname.replace('.json','')}_chunk_{i}.json")
-            with open(out_path, 'w', encoding='utf-8') as out_f:
-                json.dump(chunked_doc, out_f, ensure_ascii=False, indent=2)
+        separator = "\n\n"
+        n_tokens = count(section)
+        if n_tokens <= max_tokens:
+            units.append((section, n_tokens, separator))
+            continue
+        for sentence in SENTENCE_RE.split(section):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            n_tokens = count(sentence)
+            pieces = [(sentence, n_tokens)] if n_tokens <= max_tokens else _split_long(sentence, tokenizer, max_tokens)
+            for piece, piece_tokens in pieces:
+                units.append((piece, piece_tokens, separator))
+                separator = " "
+    return units
+
+def chunk_text_tokens(text, tokenizer, max_tokens=DEFAULT_MAX_TOKENS):
+    """
+    Splits the text into chunks of at most ``max_tokens`` tokenizer tokens.
+
+    Chunks are packed greedily from whole sections and sentences, with no
+    overlap. A chunk that is already half full is closed at the next section
+    boundary rather than mixing in the start of a new section.
+
+    Returns:
+        list: (chunk text, token count) tuples
+    """
+    chunks, current, current_tokens = [], [], 0
+    for unit, n_tokens, separator in _text_units(text, tokenizer, max_tokens):
+        new_section = separator != " "
+        if current and (current_tokens + n_tokens > max_tokens
+                        or (new_section and current_tokens >= max_tokens // 2)):
+            chunks.append(("".join(current).strip(), current_tokens))
+            current, current_tokens = [], 0
+        current.append(unit if not current else separator + unit)
+        current_tokens += n_tokens
+    if current:
+        chunks.append(("".join(current).strip(), current_tokens))
+    return chunks
+
+# Per-process tokenizer used by the chunking pool
+_tokenizer = None
+
+def _get_tokenizer(model_name):
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = load_tokenizer(model_name)
+    return _tokenizer
+
+def chunk_document(path, chunk_size=500, overlap=50, strategy="chars", max_tokens=DEFAULT_MAX_TOKENS,
+                   tokenizer_name=TOKENIZER_NAME):
+    """
+    Chunk one parsed JSON file into chunk documents with stable chunk_ids.
+
+    ``strategy`` "chars" slices on characters (``chunk_size``/``overlap``);
+    "tokens" packs sections and sentences into ``max_tokens`` and records
+    each chunk's token count as "n_tokens".
+    """
+    fname = os.path.basename(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        doc = json.load(f)
+    if strategy == "tokens":
+        chunks = chunk_text_tokens(doc['content'], _get_tokenizer(tokenizer_name), max_tokens)
+    elif strategy == "chars":
+        chunks = [(chunk, None) for chunk in chunk_text(doc['content'], chunk_size, overlap)]
+    else:
+        raise ValueError(f"Unknown chunking strategy '{strategy}'. Expected 'chars' or 'tokens'.")
+    chunked_docs = []
+    for i, (chunk, n_tokens) in enumerate(chunks):
+        chunked_doc = {
+            "title": doc["title"],
+            "url": doc["url"],
+            "tags": doc["tags"],
+            "content": chunk,
+            "chunk_id": f"{fname.replace('.json','')}_chunk_{i}"
+        }
+        if n_tokens is not None:
+            chunked_doc["n_tokens"] = n_tokens
+        chunked_docs.append(chunked_doc)
+    return chunked_docs
+
+def _chunk_document_args(args):
+    return chunk_document(*args)
+
+class ChunkStats:
+    """Chunk-count, length and token statistics for one chunking run."""
+
+    def __init__(self):
+        self.pages = 0
+        self.chunks = 0
+        self.chars = 0
+        self.tokens = 0
+        self.max_tokens = 0
+
+    def track(self, results):
+        """Pass per-page chunk lists through while counting them."""
+        for chunked_docs in results:
+            self.pages += 1
+            for chunked_doc in chunked_docs:
+                self.chunks += 1
+                self.chars += len(chunked_doc["content"])
+                n_tokens = chunked_doc.get("n_tokens")
+                if n_tokens is not None:
+                    self.tokens += n_tokens
+                    self.max_tokens = max(self.max_tokens, n_tokens)
+            yield chunked_docs
+
+    def as_dict(self):
+        stats = {
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "avg_chars": self.chars / self.chunks if self.chunks else 0.0,
+        }
+        if self.tokens:
+            stats["avg_tokens"] = self.tokens / self.chunks
+            stats["max_tokens"] = self.max_tokens
+        return stats
+
+    def __str__(self):
+        text = f"Chunked {self.pages} pages into {self.chunks} chunks"
+        stats = self.as_dict()
+        text += f" (avg {stats['avg_chars']:.0f} chars"
+        if "avg_tokens" in stats:
+            text += f", avg {stats['avg_tokens']:.1f} tokens, max {stats['max_tokens']} tokens"
+        return text + ")"
+
+def chunk_json_files(input_dir, output_dir, chunk_size=500, overlap=50, output_format="json",
+                     workers=1, shard_size=50000, strategy="chars", max_tokens=DEFAULT_MAX_TOKENS,
+                     tokenizer_name=TOKENIZER_NAME):
+    """
+    Reads JSON files, chunks their content, and saves chunked docs.
+
+    Args:
+        output_format (str): "json" writes one pretty-printed file per chunk;
+            "jsonl" writes shards of ``shard_size`` chunks, one per line
+        workers (int): Processes used to chunk input files in parallel
+        strategy (str): "chars" or "tokens" (see chunk_document)
+        max_tokens (int): Token budget per chunk for the "tokens" strategy
+
+    Files are processed in sorted order, so shard contents and chunk_ids are
+    stable across runs regardless of ``workers``.
+
+    Returns:
+        dict: Page count, chunk count and average chunk length statistics
+    """
+    if output_format not in ("json", "jsonl"):
+        raise ValueError(f"Unknown output format '{output_format}'. Expected 'json' or 'jsonl'.")
+    os.makedirs(output_dir, exist_ok=True)
+    fnames = sorted(f for f in os.listdir(input_dir) if f.endswith('.json'))
+    tasks = [
+        (os.path.join(input_dir, fname), chunk_size, overlap, strategy, max_tokens, tokenizer_name)
+        for fname in fnames
+    ]
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_chunk_document_args, tasks, chunksize=64)
+    else:
+        executor = None
+        results = map(_chunk_document_args, tasks)
+    stats = ChunkStats()
+    results = stats.track(results)
+
+    remove_chunk_files(output_dir)
+    try:
+        if output_format == "jsonl":
+            write_jsonl_shards(results, output_dir, shard_size)
+        else:
+            for chunked_docs in results:
+                for chunked_doc in chunked_docs:
+                    out_path = os.path.join(output_dir, f"{chunked_doc['chunk_id']}.json")
+                    with open(out_path, 'w', encoding='utf-8') as out_f:
+                        json.dump(chunked_doc, out_f, ensure_ascii=False, indent=2)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print(stats)
+    return stats.as_dict()
+
+def chunk_files(chunk_dir):
+    """
+    Chunk files of ``chunk_dir`` in read order: the JSONL shards if there are
+    any, otherwise the per-chunk JSON files. Only one layout is read, so a
+    directory re-chunked in the other format does not yield chunks twice.
+    """
+    shards = sorted(glob.glob(os.path.join(chunk_dir, SHARD_GLOB)))
+    if shards:
+        return shards
+    return sorted(os.path.join(chunk_dir, fname) for fname in os.listdir(chunk_dir) if fname.endswith('.json'))
+
+def remove_chunk_files(output_dir):
+    """
+    Delete the chunk files of a previous run in either layout. Per-chunk
+    files are not just overwritten: a run that yields fewer chunks per page
+    (e.g. switching strategy) would otherwise leave the old high-numbered
+    chunks behind to be embedded alongside the new ones.
+    """
+    for pattern in (SHARD_GLOB, '*.json'):
+        for path in glob.glob(os.path.join(output_dir, pattern)):
+            os.remove(path)
+
+def write_jsonl_shards(results, output_dir, shard_size):
+    """Write lists of chunk documents to sequential JSONL shards."""
+    shard_index, in_shard, out_f = 0, 0, None
+    try:
+        for chunked_docs in results:
+            for chunked_doc in chunked_docs:
+                if out_f is None or in_shard >= shard_size:
+                    if out_f is not None:
+                        out_f.close()
+                        shard_index += 1
+                    out_f = open(os.path.join(output_dir, SHARD_PATTERN.format(shard_index)), 'w', encoding='utf-8')
+                    in_shard = 0
+                out_f.write(json.dumps(chunked_doc, ensure_ascii=False))
+                out_f.write("\n")
+                in_shard += 1
+    finally:
+        if out_f is not None:
+            out_f.close()
+
+def iter_chunk_docs(chunk_dir):
+    """Yield chunk documents from the JSONL shards or per-chunk JSON files in ``chunk_dir``."""
+    for path in chunk_files(chunk_dir):
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield json.load(f)
 
+def count_chunk_docs(chunk_dir):
+    """Count chunk documents without parsing them."""
+    total = 0
+    for path in chunk_files(chunk_dir):
+        if path.endswith('.jsonl'):
+            with open(path, 'rb') as f:
+                total += sum(1 for line in f if line.strip())
+        else:
+            total += 1
+    return total
 
 if __name__ == "__main__":
     input_dir = "data/parsed_json"
     output_dir = "data/chunked_json"
-    chunk_json_files(input_dir, output_dir)  
\ No newline at end of file
+    chunk_json_files(input_dir, output_dir)
@@ -0,0 +1,264 @@
+"""
+FAISS index construction, query-time parameters and offline evaluation.
+
+Supported index types:
+    flat      exact brute-force L2 search (IndexFlatL2)
+    ivf_flat  inverted lists over full vectors (IndexIVFFlat)
+    ivf_pq    inverted lists over product-quantized codes (IndexIVFPQ)
+    hnsw      graph-based search (IndexHNSWFlat)
+    sq8       exact search over 8-bit scalar-quantized vectors (IndexScalarQuantizer)
+    fp16      exact search over float16 vectors (IndexScalarQuantizer)
+
+Indexes are ID-mapped: every vector carries an explicit int64 id (its row
+in the metadata and content store), so single vectors can be replaced or
+removed without renumbering the rest. IVF indexes store ids natively; flat
+HNSW and scalar-quantized indexes are wrapped in IndexIDMap. (IndexIDMap2
+would also allow reconstruct() by id, which nothing here uses, at the cost
+of an id -> position hash map rebuilt in every process that loads it.)
+"""
+import math
+import time
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "fp16")
+SCALAR_QUANTIZERS = {
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+}
+
+DEFAULT_NPROBE = 8
+DEFAULT_PQ_M = 16
+DEFAULT_PQ_NBITS = 8
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+# FAISS warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+# Vectors sampled to fit the per-dimension ranges of a scalar quantizer
+SQ_TRAIN_SIZE = 65536
+
+
+def default_nlist(n):
+    """Number of IVF lists for a corpus of ``n`` vectors (~4 * sqrt(n))"""
+    nlist = int(4 * math.sqrt(max(n, 1)))
+    return max(1, min(nlist, n // MIN_POINTS_PER_CENTROID or 1))
+
+
+def sample_rows(embeddings, size, seed=0):
+    """Return up to ``size`` rows of ``embeddings`` sampled without replacement"""
+    n = len(embeddings)
+    if size is None or size >= n:
+        return embeddings
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n, size=size, replace=False))
+    return embeddings[rows]
+
+
+def base_index(index):
+    """Return the index wrapped by an IndexIDMap/IndexIDMap2, or ``index`` itself"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def supports_removal(index):
+    """Whether ``index.remove_ids`` is implemented for this index type"""
+    return not isinstance(base_index(index), faiss.IndexHNSW)
+
+
+def create_index(dim, index_type="flat", nlist=None, n_hint=None, pq_m=DEFAULT_PQ_M,
+                 pq_nbits=DEFAULT_PQ_NBITS, hnsw_m=DEFAULT_HNSW_M,
+                 ef_construction=DEFAULT_EF_CONSTRUCTION):
+    """
+    Create an empty FAISS index of the requested type.
+
+    Args:
+        dim (int): Vector dimension
+        index_type (str): One of INDEX_TYPES
+        nlist (int, optional): IVF list count; derived from ``n_hint`` if omitted
+        n_hint (int, optional): Expected corpus size, used to size IVF lists
+        pq_m (int): Sub-quantizers for ivf_pq (must divide ``dim``)
+        pq_nbits (int): Bits per PQ code
+        hnsw_m (int): Graph neighbours per node for hnsw
+        ef_construction (int): Build-time beam width for hnsw
+
+    Returns:
+        faiss.Index: The empty, ID-mapped (and for IVF types untrained) index
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap(faiss.IndexFlatL2(dim))
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n_hint or 0)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        index.nprobe = min(DEFAULT_NPROBE, nlist)
+        return index
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+        return faiss.IndexIDMap(index)
+    if index_type in SCALAR_QUANTIZERS:
+        return faiss.IndexIDMap(faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[index_type], faiss.METRIC_L2))
+    raise ValueError(f"Unknown index type '{index_type}'. Expected one of {', '.join(INDEX_TYPES)}")
+
+
+def default_train_size(index):
+    """
+    Training sample size for an index: 256 points per IVF list (and at least
+    enough points for the PQ codebooks), which keeps k-means fast on large
+    corpora. Scalar quantizers only learn per-dimension ranges and use
+    SQ_TRAIN_SIZE.
+    """
+    index = base_index(index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return SQ_TRAIN_SIZE
+    ivf = faiss.try_extract_index_ivf(index)
+    train_size = 256 * (ivf.nlist if ivf is not None else 1)
+    if isinstance(index, faiss.IndexIVFPQ):
+        train_size = max(train_size, 64 * (1 << index.pq.nbits))
+    return train_size
+
+
+def train_index(index, embeddings, train_size=None, seed=0):
+    """
+    Train an index on a sample of ``embeddings`` if it requires training.
+
+    ``train_size`` defaults to default_train_size(index).
+    """
+    if index.is_trained:
+        return
+    base = base_index(index)
+    if train_size is None:
+        train_size = default_train_size(base)
+    if isinstance(base, faiss.IndexIVFPQ) and len(embeddings) < (1 << base.pq.nbits):
+        raise ValueError(f"ivf_pq needs at least {1 << base.pq.nbits} vectors to train, "
+                         f"got {len(embeddings)}; use ivf_flat or lower pq_nbits")
+    sample = sample_rows(embeddings, train_size, seed=seed)
+    print(f"Training {type(base).__name__} on {len(sample)} of {len(embeddings)} vectors...")
+    # Through the IndexIDMap wrapper, which only then reports is_trained
+    index.train(np.ascontiguousarray(sample, dtype="float32"))
+
+
+def build_index(embeddings, index_type="flat", ids=None, train_size=None, **kwargs):
+    """
+    Create, train and fill an index with ``embeddings`` (float32, n x dim).
+
+    ``ids`` defaults to the row numbers 0..n-1.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    if ids is None:
+        ids = np.arange(len(embeddings), dtype="int64")
+    index = create_index(embeddings.shape[1], index_type, n_hint=len(embeddings), **kwargs)
+    train_index(index, embeddings, train_size=train_size)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """
+    Build per-call FAISS search parameters for the query-time knobs.
+
+    Parameters are passed to ``index.search`` instead of mutating the shared
+    index, so concurrent requests with different knobs do not interfere.
+    Knobs that do not apply to the index type are ignored. ``selector`` (a
+    faiss.IDSelector over row ids) restricts the search to the selected rows;
+    the caller must keep it, and any array it points to, alive until the
+    search returns.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    hnsw = base_index(index) if isinstance(base_index(index), faiss.IndexHNSW) else None
+    if ivf is not None and (nprobe is not None or selector is not None):
+        # A selector alone must not reset nprobe to the parameters' default
+        params = faiss.SearchParametersIVF(nprobe=int(ivf.nprobe if nprobe is None else nprobe))
+    elif hnsw is not None and (ef_search is not None or selector is not None):
+        params = faiss.SearchParametersHNSW(efSearch=int(hnsw.hnsw.efSearch if ef_search is None else ef_search))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def describe_index(index):
+    """Return the type and tuning parameters of an index as a dict"""
+    info = {"class": type(index).__name__, "ntotal": int(index.ntotal), "dim": int(index.d)}
+    if base_index(index) is not index:
+        info["wraps"] = type(base_index(index)).__name__
+        index = base_index(index)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        info["nlist"] = int(ivf.nlist)
+        info["nprobe"] = int(ivf.nprobe)
+    if isinstance(index, faiss.IndexIVFPQ):
+        info["pq_m"] = int(index.pq.M)
+        info["pq_nbits"] = int(index.pq.nbits)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        qtype = int(index.sq.qtype)
+        info["sq_type"] = next((name for name, value in SCALAR_QUANTIZERS.items() if value == qtype), qtype)
+    if isinstance(index, faiss.IndexHNSW):
+        info["hnsw_m"] = int(index.hnsw.nb_neighbors(1))
+        info["ef_construction"] = int(index.hnsw.efConstruction)
+        info["ef_search"] = int(index.hnsw.efSearch)
+    return info
+
+
+def evaluate_index(index, embeddings, k=10, n_queries=200, nprobe=None, ef_search=None, seed=1):
+    """
+    Measure recall@k against exact search, and single-query latency.
+
+    Queries are sampled from the corpus itself. Ground truth comes from an
+    IndexFlatL2 over the same vectors, so the index must use row numbers as
+    ids (the build_index default).
+
+    Returns:
+        dict: recall_at_k, p50_ms, p99_ms and the evaluation settings
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    k = min(k, len(embeddings))
+    queries = sample_rows(embeddings, n_queries, seed=seed)
+
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+
+    params = search_parameters(index, nprobe=nprobe, ef_search=ef_search)
+    latencies = np.empty(len(queries))
+    found = np.empty_like(truth)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k, params=params)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        found[i] = I[0]
+
+    hits = sum(len(np.intersect1d(found[i], truth[i])) for i in range(len(queries)))
+    return {
+        "k": int(k),
+        "queries": int(len(queries)),
+        "nprobe": nprobe,
+        "ef_search": ef_search,
+        "recall_at_k": hits / float(len(queries) * k) if len(queries) else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(queries) else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(queries) else 0.0,
+    }
+
+
+def format_report(report):
+    """One-line human readable summary of an evaluate_index() result"""
+    knobs = []
+    if report.get("nprobe") is not None:
+        knobs.append(f"nprobe={report['nprobe']}")
+    if report.get("ef_search") is not None:
+        knobs.append(f"efSearch={report['ef_search']}")
+    knobs = f" ({', '.join(knobs)})" if knobs else ""
+    return (f"recall@{report['k']}={report['recall_at_k']:.3f} "
+            f"p50={report['p50_ms']:.3f}ms p99={report['p99_ms']:.3f}ms "
+            f"over {report['queries']} queries{knobs}")
@@ -0,0 +1,237 @@
+"""
+BM25 inverted index over chunk text, and reciprocal rank fusion.
+
+Built by embed_and_store next to the FAISS index so exact-name queries
+(spells, items, NPCs) can be matched lexically. Files, all in FAISS row order
+and memory-mapped by the API:
+
+    bg3_lexical.terms.bin    sorted vocabulary (packed, see content_store)
+    bg3_lexical.offsets.npy  postings of term i are [offsets[i], offsets[i + 1])
+    bg3_lexical.rows.npy     row of each posting (uint32)
+    bg3_lexical.tf.npy       term frequency of each posting (uint16)
+    bg3_lexical.doclen.npy   token count of every row (uint32)
+    bg3_lexical.json         corpus statistics, written last
+
+The postings of each term are impact-ordered (highest BM25 term score
+first), so a search can read only the best LEXICAL_MAX_POSTINGS of a common
+term. Stopwords and terms in more than LEXICAL_MAX_DF of the documents are
+skipped at query time: their idf is close to zero, but their posting lists
+grow with the corpus.
+"""
+import os
+import re
+import json
+from array import array
+from collections import Counter, defaultdict
+import numpy as np
+from src.content_store import ContentStore, write_content_store
+from src.metadata_store import rows_in_bitmap
+
+LEXICAL_PREFIX = "bg3_lexical"
+TOKEN_RE = re.compile(r"\w+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constant of reciprocal rank fusion; 60 is the value from the original paper
+RRF_K = 60
+# Query terms found in more than this fraction of the documents are skipped
+LEXICAL_MAX_DF = float(os.getenv("LEXICAL_MAX_DF", "0.5"))
+# Postings read per query term, best first
+LEXICAL_MAX_POSTINGS = int(os.getenv("LEXICAL_MAX_POSTINGS", "5000"))
+# Skipped in queries (not at build time, so the list can change without a rebuild)
+STOPWORDS = frozenset("""
+a about an and any are as at be been but by can do does for from had has have how i if in into is it
+its me my of on or so than that the their them then there these they this to was we were what when
+where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    """Case-folded word tokens; no stemming, so names match exactly"""
+    return TOKEN_RE.findall(text.casefold())
+
+
+def lexical_path(vectorstore_dir, part):
+    return os.path.join(vectorstore_dir, f"{LEXICAL_PREFIX}.{part}")
+
+
+def _save_array(path, values):
+    # Swapped in place: a running API may have the previous file mapped
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, values)
+    os.replace(f"{path}.tmp", path)
+
+
+def build_lexical_index(vectorstore_dir, texts):
+    """
+    Build and write the BM25 index.
+
+    Args:
+        vectorstore_dir (str): Destination directory
+        texts (iterable): Text of every FAISS row in order ("" or None for
+            freed rows), typically title plus chunk content
+    """
+    # Only the per-row term counts are collected in Python, as flat arrays
+    # of (term id, tf); the postings are laid out with numpy
+    vocabulary = defaultdict()
+    # A new term gets the next id
+    vocabulary.default_factory = vocabulary.__len__
+    term_ids, tfs, row_terms, doc_lengths = array("I"), array("I"), array("I"), array("I")
+    for text in texts:
+        tokens = tokenize(text or "")
+        counts = Counter(tokens)
+        term_ids.extend(map(vocabulary.__getitem__, counts))
+        tfs.extend(counts.values())
+        row_terms.append(len(counts))
+        doc_lengths.append(len(tokens))
+
+    terms = sorted(vocabulary)
+    # Term ids in order of first appearance -> position in the sorted vocabulary
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[np.fromiter(map(vocabulary.__getitem__, terms), dtype=np.int64, count=len(terms))] = np.arange(len(terms))
+    posting_terms = rank[np.frombuffer(term_ids, dtype=np.uint32)]
+    rows = np.repeat(np.arange(len(doc_lengths), dtype=np.uint32), np.frombuffer(row_terms, dtype=np.uint32))
+    tfs = np.minimum(np.frombuffer(tfs, dtype=np.uint32), np.iinfo(np.uint16).max).astype(np.uint16)
+    doc_lengths = np.frombuffer(doc_lengths, dtype=np.uint32).copy()
+    live = int(np.count_nonzero(doc_lengths))
+    avg_doc_length = float(doc_lengths.sum() / live) if live else 0.0
+
+    # Group postings by term, best BM25 term score first (idf is constant
+    # within a term); ties keep row order
+    impact = tfs / (tfs + BM25_K1 * (1.0 - BM25_B + BM25_B * doc_lengths[rows] / (avg_doc_length or 1.0)))
+    order = np.lexsort((-impact, posting_terms))
+    rows, tfs = rows[order], tfs[order]
+    offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=offsets[1:])
+
+    write_content_store(lexical_path(vectorstore_dir, "terms.bin"), terms)
+    _save_array(lexical_path(vectorstore_dir, "offsets.npy"), offsets)
+    _save_array(lexical_path(vectorstore_dir, "rows.npy"), rows)
+    _save_array(lexical_path(vectorstore_dir, "tf.npy"), tfs)
+    _save_array(lexical_path(vectorstore_dir, "doclen.npy"), doc_lengths)
+    stats = {
+        "terms": len(terms),
+        "postings": int(offsets[-1]),
+        "documents": live,
+        "avg_doc_length": avg_doc_length,
+        "k1": BM25_K1,
+        "b": BM25_B,
+        "impact_ordered": True,
+    }
+    with open(lexical_path(vectorstore_dir, "json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+    print(f"Built BM25 index: {stats['terms']} terms, {stats['postings']} postings over {live} chunks.")
+    return stats
+
+
+class LexicalIndex:
+    """Read-only, memory-mapped BM25 index"""
+
+    def __init__(self, vectorstore_dir):
+        with open(lexical_path(vectorstore_dir, "json"), "r", encoding="utf-8") as f:
+            self.stats = json.load(f)
+        self.terms = ContentStore(lexical_path(vectorstore_dir, "terms.bin"))
+        self.offsets = np.load(lexical_path(vectorstore_dir, "offsets.npy"), mmap_mode="r")
+        self.rows = np.load(lexical_path(vectorstore_dir, "rows.npy"), mmap_mode="r")
+        self.tfs = np.load(lexical_path(vectorstore_dir, "tf.npy"), mmap_mode="r")
+        self.doc_lengths = np.load(lexical_path(vectorstore_dir, "doclen.npy"), mmap_mode="r")
+        self.k1 = self.stats["k1"]
+        self.b = self.stats["b"]
+        self.n_docs = self.stats["documents"]
+        self.avg_doc_length = self.stats["avg_doc_length"] or 1.0
+        # Indexes built before impact ordering keep postings in row order,
+        # where a prefix is not the best postings
+        self.impact_ordered = self.stats.get("impact_ordered", False)
+
+    def term_id(self, term):
+        """Binary search the sorted vocabulary; returns -1 for unknown terms"""
+        lo, hi = 0, len(self.terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.terms.get(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self.terms) and self.terms.get(lo) == term else -1
+
+    def search(self, query, top_k=10, bitmap=None):
+        """
+        Rank rows for a query with BM25.
+
+        ``bitmap`` (see metadata_store.tag_bitmaps) restricts the ranking to
+        the rows whose bit is set.
+
+        Stopwords and terms above LEXICAL_MAX_DF are skipped (if every term
+        is, the rarest one is kept), and at most LEXICAL_MAX_POSTINGS of each
+        term's best postings are scored, so the cost of a query does not
+        grow with the corpus. With a ``bitmap`` a row past that cap is not
+        found through that term.
+
+        Returns:
+            tuple: (rows, scores) arrays, best first, at most ``top_k`` long
+        """
+        spans = []
+        for term in set(tokenize(query)):
+            term_id = self.term_id(term)
+            if term_id >= 0:
+                start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+                spans.append((term, start, end))
+        max_df = LEXICAL_MAX_DF * self.n_docs
+        selected = [span for span in spans if span[0] not in STOPWORDS and span[2] - span[1] <= max_df]
+        if spans and not selected:
+            selected = [min(spans, key=lambda span: span[2] - span[1])]
+
+        all_rows, all_scores = [], []
+        for _, start, end in selected:
+            df = end - start
+            if self.impact_ordered:
+                end = min(end, start + LEXICAL_MAX_POSTINGS)
+            rows = np.asarray(self.rows[start:end], dtype=np.int64)
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[rows] / self.avg_doc_length)
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if bitmap is not None:
+            selected = rows_in_bitmap(bitmap, rows)
+            rows, scores = rows[selected], scores[selected]
+        if len(rows) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def close(self):
+        self.terms.close()
+
+
+def load_lexical_index(vectorstore_dir):
+    """
+    Open the BM25 index of a vectorstore directory.
+
+    Returns:
+        LexicalIndex or None: None when the vectorstore has no BM25 index
+    """
+    if not os.path.exists(lexical_path(vectorstore_dir, "json")):
+        return None
+    return LexicalIndex(vectorstore_dir)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuse ranked lists of rows: score(row) = sum over lists of 1 / (k + rank).
+
+    Args:
+        rankings (list): Ranked sequences of row ids, best first
+
+    Returns:
+        list: (row, fused score) tuples, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -8,14 +8,23 @@ load_dotenv()
 # Get API key from environment variables
 groq_api_key = os.getenv("GROQ_API_KEY")
 
+# Any OpenAI-compatible endpoint can stand in for Groq, e.g. the stub server
+# of src/tests/load_test.py; LLM_API_KEY is used for it when set
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+llm_api_key = os.getenv("LLM_API_KEY") or groq_api_key
+
 # For langchain's ChatOpenAI, we need to set the GROQ_API_KEY env variable
 # This is because older versions of LangChain use this environment variable
-os.environ["GROQ_API_KEY"] = groq_api_key
+if groq_api_key:
+    os.environ["GROQ_API_KEY"] = groq_api_key
+if not llm_api_key:
+    print(f"WARNING: GROQ_API_KEY is not set; requests to {LLM_BASE_URL} will be rejected if it needs a key.")
 
 # Create LLM with explicit configuration for Groq API
 llm = ChatOpenAI(
-    openai_api_key=groq_api_key,
-    base_url="https://api.groq.com/openai/v1",
-    model_name="llama-3.3-70b-versatile",
+    openai_api_key=llm_api_key or "not-set",
+    base_url=LLM_BASE_URL,
+    model_name=LLM_MODEL,
     temperature=0.3,
-)
\ No newline at end of file
+)
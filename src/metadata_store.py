@@ -0,0 +1,214 @@
+"""
+Columnar, memory-mapped chunk metadata.
+
+Each metadata field is stored as its own packed file (see content_store) in
+FAISS row order, so the API maps the files instead of parsing a JSON list of
+dicts into every worker's private memory:
+
+    bg3_metadata.chunk_id.bin | bg3_metadata.title.bin | bg3_metadata.url.bin | bg3_metadata.tags.bin
+
+Rows freed by incremental re-embedding have an empty chunk_id. Tags are
+stored as a JSON array per row.
+
+A tag index maps every tag to a bitmap of the rows that carry it, so tag
+filters can be pushed into FAISS as an ID selector:
+
+    bg3_tags.npy (uint8, one bitmap per tag) | bg3_tags.json (tag names, written last)
+"""
+import os
+import json
+import numpy as np
+from src.content_store import ContentStore, write_content_store
+
+METADATA_COLUMNS = ("chunk_id", "title", "url", "tags")
+METADATA_STORE_PATTERN = "bg3_metadata.{}.bin"
+TAG_BITMAPS_FILE = "bg3_tags.npy"
+TAG_NAMES_FILE = "bg3_tags.json"
+
+
+def column_path(vectorstore_dir, column):
+    return os.path.join(vectorstore_dir, METADATA_STORE_PATTERN.format(column))
+
+
+def _column_values(rows, column):
+    for row in rows:
+        if row is None:
+            yield ""
+        elif column == "tags":
+            yield json.dumps(row.get("tags") or [], ensure_ascii=False)
+        else:
+            yield row.get(column) or ""
+
+
+def write_metadata_store(vectorstore_dir, rows):
+    """
+    Write metadata rows (dicts, or None for free rows) as packed columns.
+
+    Args:
+        vectorstore_dir (str): Destination directory
+        rows (list): Metadata dicts in FAISS row order
+    """
+    for column in METADATA_COLUMNS:
+        write_content_store(column_path(vectorstore_dir, column), _column_values(rows, column))
+
+
+class MetadataStore:
+    """
+    Read-only, list-like view over the metadata columns.
+
+    ``store[row]`` returns the metadata dict of a FAISS row, or None for a
+    freed row, so it can stand in for the JSON list of dicts.
+    """
+
+    def __init__(self, vectorstore_dir):
+        self._columns = {}
+        try:
+            for column in METADATA_COLUMNS:
+                self._columns[column] = ContentStore(column_path(vectorstore_dir, column))
+        except Exception:
+            self.close()
+            raise
+        self.count = len(self._columns["chunk_id"])
+        if any(len(store) != self.count for store in self._columns.values()):
+            self.close()
+            raise ValueError(f"Metadata columns in {vectorstore_dir} have different row counts")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        if row < 0 or row >= self.count:
+            raise IndexError(row)
+        chunk_id = self._columns["chunk_id"].get(row)
+        if not chunk_id:
+            return None
+        return {
+            "title": self._columns["title"].get(row),
+            "url": self._columns["url"].get(row),
+            "tags": json.loads(self._columns["tags"].get(row)),
+            "chunk_id": chunk_id,
+        }
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self[row]
+
+    def live_rows(self):
+        """Number of rows holding metadata (freed rows excluded)"""
+        return int(np.count_nonzero(self._columns["chunk_id"].row_lengths()))
+
+    def close(self):
+        for store in self._columns.values():
+            store.close()
+        self._columns = {}
+
+
+def load_metadata_store(vectorstore_dir):
+    """
+    Open the columnar metadata of a vectorstore directory.
+
+    Returns:
+        MetadataStore or None: None when the vectorstore only has the JSON
+        metadata file, so callers can fall back to it.
+    """
+    if not os.path.exists(column_path(vectorstore_dir, "chunk_id")):
+        return None
+    return MetadataStore(vectorstore_dir)
+
+
+def tag_bitmaps(rows):
+    """
+    Build a row bitmap per tag from metadata rows (dicts, or None for free rows).
+
+    Bit ``row`` of a bitmap is ``(bitmap[row >> 3] >> (row & 7)) & 1``, the
+    layout faiss.IDSelectorBitmap reads.
+
+    Returns:
+        tuple: (sorted tag names, uint8 array of shape (tags, ceil(rows / 8)))
+    """
+    tag_rows = {}
+    n_rows = 0
+    for row, meta in enumerate(rows):
+        n_rows = row + 1
+        for tag in (meta or {}).get("tags") or []:
+            tag_rows.setdefault(tag, []).append(row)
+    tags = sorted(tag_rows)
+    bitmaps = np.zeros((len(tags), (n_rows + 7) // 8), dtype=np.uint8)
+    bits = np.zeros(bitmaps.shape[1] * 8, dtype=bool)
+    for i, tag in enumerate(tags):
+        bits[:] = False
+        bits[tag_rows[tag]] = True
+        bitmaps[i] = np.packbits(bits, bitorder="little")
+    return tags, bitmaps
+
+
+def write_tag_index(vectorstore_dir, rows):
+    """Write the tag -> row bitmap index for metadata rows in FAISS row order"""
+    tags, bitmaps = tag_bitmaps(rows)
+    path = os.path.join(vectorstore_dir, TAG_BITMAPS_FILE)
+    # Swapped in place: a running API may have the previous file mapped
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, bitmaps)
+    os.replace(f"{path}.tmp", path)
+    counts = np.unpackbits(bitmaps, axis=1).sum(axis=1) if len(tags) else []
+    with open(os.path.join(vectorstore_dir, TAG_NAMES_FILE), "w", encoding="utf-8") as f:
+        json.dump({"tags": tags, "rows": {tag: int(n) for tag, n in zip(tags, counts)}}, f, indent=2)
+    print(f"Built tag index: {len(tags)} tags.")
+
+
+class TagIndex:
+    """
+    Tag -> row bitmaps, looked up case-insensitively.
+
+    Memory-mapped from the vectorstore, or built in memory from the metadata
+    of vectorstores written before the tag index existed.
+    """
+
+    def __init__(self, tags, bitmaps):
+        self.tags = list(tags)
+        self.bitmaps = bitmaps
+        # Tags differing only in case ("Companions", "companions") share a key
+        self._ids = {}
+        for i, tag in enumerate(self.tags):
+            self._ids.setdefault(tag.casefold(), []).append(i)
+
+    def bitmap(self, tags):
+        """
+        Bitmap of the rows carrying any of ``tags``; unknown tags match nothing.
+
+        Returns:
+            numpy.ndarray: A fresh uint8 array, safe to hand to faiss.IDSelectorBitmap
+        """
+        ids = sorted({i for tag in tags for i in self._ids.get(tag.casefold(), ())})
+        if not ids:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(np.asarray(self.bitmaps[ids]), axis=0)
+
+
+def load_tag_index(vectorstore_dir, metadatas=None):
+    """
+    Open the tag index of a vectorstore directory.
+
+    Returns:
+        TagIndex or None: Built from ``metadatas`` when the vectorstore has no
+        tag index file; None when neither is available.
+    """
+    names_path = os.path.join(vectorstore_dir, TAG_NAMES_FILE)
+    if os.path.exists(names_path):
+        with open(names_path, "r", encoding="utf-8") as f:
+            tags = json.load(f)["tags"]
+        bitmaps = np.load(os.path.join(vectorstore_dir, TAG_BITMAPS_FILE), mmap_mode="r")
+        return TagIndex(tags, bitmaps)
+    if metadatas is None:
+        return None
+    return TagIndex(*tag_bitmaps(metadatas))
+
+
+def rows_in_bitmap(bitmap, rows):
+    """Boolean mask of the ``rows`` (int array) whose bit is set in ``bitmap``"""
+    rows = np.asarray(rows, dtype=np.int64)
+    inside = (rows >= 0) & (rows < len(bitmap) * 8)
+    mask = np.zeros(len(rows), dtype=bool)
+    kept = rows[inside]
+    mask[inside] = ((bitmap[kept >> 3] >> (kept & 7)) & 1).astype(bool)
+    return mask
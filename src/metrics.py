@@ -0,0 +1,249 @@
+"""
+Latency instrumentation and Prometheus text exposition for the API.
+
+Stages (query encode, FAISS search, hydration, LLM call, ...) are timed with
+``span()``/``record()``. Every timing feeds a process-wide histogram and,
+inside a request, that request's breakdown, which TimingMiddleware returns
+as a ``Server-Timing`` header when the client sends ``X-Debug-Timing: 1``.
+The middleware can also run a sampling profiler (pyinstrument, optional)
+on a fraction of the requests to selected endpoints.
+"""
+import os
+import sys
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Seconds; from sub-millisecond cache lookups to slow LLM answers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the current request, and whether it asked for them
+_timings = contextvars.ContextVar("bg3_timings", default=None)
+_debug = contextvars.ContextVar("bg3_debug_timing", default=False)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Thread-safe cumulative histogram with optional labels"""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _labels(self.labelnames + ("le",), labelvalues + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames + ("le",), labelvalues + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Histograms plus collectors that read gauges and counters on scrape.
+
+    A collector returns (name, type, help, samples) tuples, where samples is
+    a list of (labels dict, value); collectors that fail are skipped.
+    """
+
+    def __init__(self):
+        self._histograms = []
+        self._collectors = []
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, help, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}", file=sys.stderr)
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+request_seconds = registry.histogram(
+    "bg3_request_duration_seconds", "HTTP request latency", ("endpoint", "method", "status"))
+stage_seconds = registry.histogram(
+    "bg3_stage_duration_seconds", "Latency of request stages (encode, search, llm, ...)", ("stage",))
+
+
+def record(stage, seconds):
+    """Add a stage timing to the histogram and to the current request's breakdown"""
+    stage_seconds.observe(seconds, stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as ``stage``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def current_timings():
+    """Stage timings (ms) recorded so far in the current request"""
+    return {stage: round(seconds * 1000, 3) for stage, seconds in (_timings.get() or {}).items()}
+
+
+def debug_timing_requested():
+    return _debug.get()
+
+
+def server_timing(timings, total):
+    """Format a Server-Timing header value (durations in ms)"""
+    parts = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(parts)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: request latency histogram, per-request stage breakdown
+    and optional sampling profiles.
+
+    Args:
+        debug_header (str): Request header that asks for the Server-Timing
+            breakdown; ``always_debug`` adds it to every response
+        profile_paths (iterable): Endpoint paths eligible for profiling
+        profile_rate (float): Fraction of eligible requests to profile
+        profile_dir (str): Directory the pyinstrument HTML reports go to
+    """
+
+    def __init__(self, app, debug_header="x-debug-timing", always_debug=False,
+                 profile_paths=(), profile_rate=0.0, profile_dir="profiles"):
+        self.app = app
+        self.debug_header = debug_header.lower().encode()
+        self.always_debug = always_debug
+        self.profile_paths = set(profile_paths)
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self._profiling = threading.Lock()
+        if self.profile_paths and self.profile_rate > 0:
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                print("PROFILE_PATHS is set but pyinstrument is not installed "
+                      "(`pip install pyinstrument`); profiling is disabled.", file=sys.stderr)
+                self.profile_paths = set()
+
+    def _wants_debug(self, scope):
+        if self.always_debug:
+            return True
+        for name, value in scope.get("headers", []):
+            if name == self.debug_header:
+                return value.strip().lower() not in (b"", b"0", b"false", b"no")
+        return False
+
+    def _start_profiler(self, scope):
+        if scope["path"] not in self.profile_paths or random.random() >= self.profile_rate:
+            return None
+        # pyinstrument profiles one request at a time per process
+        if not self._profiling.acquire(blocking=False):
+            return None
+        from pyinstrument import Profiler
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        return profiler
+
+    def _save_profile(self, profiler, scope):
+        try:
+            profiler.stop()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = scope["path"].strip("/").replace("/", "_") or "root"
+            path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%dT%H%M%S')}_{name}_{os.getpid()}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        except Exception as e:
+            print(f"Could not save profile: {e}", file=sys.stderr)
+        finally:
+            self._profiling.release()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = {}
+        timings_token = _timings.set(timings)
+        debug = self._wants_debug(scope)
+        debug_token = _debug.set(debug)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if debug:
+                    value = server_timing(timings, time.perf_counter() - start)
+                    message = dict(message, headers=list(message.get("headers", [])) + [
+                        (b"server-timing", value.encode("latin-1"))])
+            await send(message)
+
+        profiler = self._start_profiler(scope)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profiler is not None:
+                self._save_profile(profiler, scope)
+            # Label by route template so the series count stays bounded
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            request_seconds.observe(time.perf_counter() - start, endpoint, scope["method"], str(status))
+            _debug.reset(debug_token)
+            _timings.reset(timings_token)
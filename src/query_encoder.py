@@ -0,0 +1,74 @@
+"""
+Query encoders: the float32 PyTorch model, or an int8-quantized ONNX export.
+
+The int8 encoder is exported next to the index by embed_and_store (into
+``<vectorstore>/query_encoder``) and recorded in the index info file, so the
+API can load it without re-exporting. Documents are always encoded with the
+float32 model; only query-time inference is quantized.
+
+The ONNX backend needs sentence-transformers 3.2 or later with
+``optimum[onnxruntime]`` (``pip install "sentence-transformers[onnx]>=3.2"``);
+it is imported only when used.
+"""
+import os
+import sys
+import glob
+import platform
+from sentence_transformers import SentenceTransformer
+
+QUERY_ENCODERS = ("float32", "onnx-int8")
+QUERY_ENCODER_DIR = "query_encoder"
+
+
+def default_quantization():
+    """onnxruntime dynamic-quantization preset for this CPU architecture"""
+    return "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+
+
+def export_int8_encoder(model_name, output_dir, quantization=None):
+    """
+    Export ``model_name`` to ONNX with dynamically int8-quantized weights.
+
+    Args:
+        model_name (str): Sentence-transformers model name or path
+        output_dir (str): Directory the ONNX model and tokenizer are saved to
+        quantization (str, optional): "avx2", "avx512", "avx512_vnni" or
+            "arm64"; defaults to default_quantization()
+
+    Returns:
+        str: Path of the quantized model file relative to ``output_dir``
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    quantization = quantization or default_quantization()
+    print(f"Exporting {model_name} to ONNX with int8 ({quantization}) weights in {output_dir}...")
+    model = SentenceTransformer(model_name, backend="onnx")
+    model.save_pretrained(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization, output_dir)
+    matches = glob.glob(os.path.join(output_dir, "onnx", f"model_*int8_{quantization}.onnx"))
+    if not matches:
+        raise FileNotFoundError(f"No quantized ONNX model was written to {output_dir}")
+    return os.path.relpath(matches[0], output_dir)
+
+
+def load_query_encoder(model_name, kind="float32", vectorstore_dir=None, info=None):
+    """
+    Load the query encoder selected by ``kind``.
+
+    For "onnx-int8" the export recorded in the vectorstore's index info is
+    used; when the vectorstore has none, the float32 model is loaded instead.
+
+    Returns:
+        tuple: (SentenceTransformer, kind actually loaded)
+    """
+    if kind not in QUERY_ENCODERS:
+        raise ValueError(f"Unknown query encoder '{kind}'. Expected one of {', '.join(QUERY_ENCODERS)}")
+    if kind == "onnx-int8":
+        export = (info or {}).get("query_encoder")
+        if export and vectorstore_dir is not None:
+            path = os.path.join(vectorstore_dir, export["path"])
+            model = SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": export["file_name"]})
+            return model, kind
+        print("No int8 query encoder in the vectorstore; using the float32 model. "
+              "Re-run `python main.py embed --quantize-encoder` to export it.", file=sys.stderr)
+    return SentenceTransformer(model_name), "float32"
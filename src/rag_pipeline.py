@@ -1,115 +1,126 @@
 from langchain.prompts import PromptTemplate
 from langchain.chains import RetrievalQA
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.docstore import InMemoryDocstore
-from langchain_core.documents import Document
 from src.llm import llm
+from src.retriever import (RetrievalEngine, EngineRetriever, VECTORSTORE_DIR, build_in_progress, read_index_info,
+                           read_index_version)
+from src.context import ContextAssembler
+from src.metrics import span
 import os
 import sys
-import json
-import faiss
-
-# Check if the vectorstore directory exists
-vectorstore_dir = "embeddings/bg3_vectorstore"
-if not os.path.exists(vectorstore_dir):
-    print(f"Error: Directory not found: {vectorstore_dir}", file=sys.stderr)
-    print("Current directory:", os.getcwd(), file=sys.stderr)
-    print("Available directories:", os.listdir(), file=sys.stderr)
-    raise FileNotFoundError(f"Directory not found: {vectorstore_dir}")
-
-# Check if the index file exists
-index_path = os.path.join(vectorstore_dir, "bg3_faiss.index")
-metadata_path = os.path.join(vectorstore_dir, "bg3_metadata.json")
-
-if not os.path.exists(index_path):
-    print(f"Error: Index file not found at {index_path}", file=sys.stderr)
-    print("Available files in directory:", os.listdir(vectorstore_dir), file=sys.stderr)
-    raise FileNotFoundError(f"Index file not found at {index_path}")
-
-if not os.path.exists(metadata_path):
-    print(f"Error: Metadata file not found at {metadata_path}", file=sys.stderr)
-    print("Available files in directory:", os.listdir(vectorstore_dir), file=sys.stderr)
-    raise FileNotFoundError(f"Metadata file not found at {metadata_path}")
-
-# Initialize the embedding model - same one used to create the embeddings
-print("Initializing embedding model...", file=sys.stderr)
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-print("Loading FAISS vectorstore using direct method...", file=sys.stderr)
-try:
-    # Method 3: Direct FAISS library loading
-    print(f"Reading FAISS index directly from {index_path}", file=sys.stderr)
-    faiss_index_obj = faiss.read_index(index_path)
-    print(f"Successfully read FAISS index. Index has {faiss_index_obj.ntotal} vectors.", file=sys.stderr)
-
-    print(f"Loading and processing metadata from {metadata_path}", file=sys.stderr)
-    with open(metadata_path, 'r', encoding='utf-8') as f:
-        raw_metadata = json.load(f)
-
-    docstore_reconstruction = {}
-    index_to_docstore_id_reconstruction = {}
-
-    if isinstance(raw_metadata, list):
-        print(f"Metadata is a list with {len(raw_metadata)} items. Reconstructing...", file=sys.stderr)
-        for i, item in enumerate(raw_metadata):
-            doc_id = f"doc_{i}"
-            if isinstance(item, dict):
-                # Assuming item is a dict where the whole item is metadata, and page_content is not in this file
-                doc = Document(page_content="", metadata=item)
-            else:
-                print(f"Warning: Could not interpret item {i} in metadata list: {item}", file=sys.stderr)
-                continue 
-            
-            docstore_reconstruction[doc_id] = doc
-            index_to_docstore_id_reconstruction[i] = doc_id
-        
-        if not docstore_reconstruction:
-            raise ValueError("Could not reconstruct any documents from list in metadata.")
-        print(f"Reconstructed from list: {len(docstore_reconstruction)} docs.", file=sys.stderr)
+import threading
+
+vectorstore_dir = VECTORSTORE_DIR
+# Chunks retrieved per question, before context assembly
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "4"))
+
+# One engine per process: the encoder, FAISS index, metadata and chunk text
+# are shared by the RAG chain below and by the /search endpoint in src/api.py.
+# It is loaded on first use (or by the API's startup) rather than at import.
+_engine = None
+_retriever = None
+_qa_chain = None
+_lock = threading.Lock()
+
+def load_engine():
+    """Load the shared retrieval engine, once per process"""
+    global _engine, _retriever
+    with _lock:
+        if _engine is not None:
+            return _engine
+        # Check if the vectorstore directory exists
+        if not os.path.exists(vectorstore_dir):
+            print(f"Error: Directory not found: {vectorstore_dir}", file=sys.stderr)
+            print("Current directory:", os.getcwd(), file=sys.stderr)
+            print("Available directories:", os.listdir(), file=sys.stderr)
+            raise FileNotFoundError(f"Directory not found: {vectorstore_dir}")
+
+        print("Loading retrieval engine...", file=sys.stderr)
+        try:
+            _engine = RetrievalEngine(vectorstore_dir)
+        except Exception as e:
+            print(f"Error loading vectorstore: {e}", file=sys.stderr)
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+            raise
+        _retriever = EngineRetriever(engine=_engine, k=RETRIEVER_K)
+        return _engine
+
+def current_engine():
+    """The active engine, or None if it has not been loaded yet"""
+    return _engine
+
+def reload_engine():
+    """
+    Load the vectorstore again and swap it in as the active engine.
+
+    The new engine is built next to the old one and replaced in a single
+    assignment, so requests that already hold the old engine finish on it.
+    The query encoder is reused unless the new index was built with a
+    different model; then the old engine's micro-batcher is stopped (its
+    remaining requests encode without batching).
+
+    Refused while embed_and_store is rewriting the files: the version in the
+    info file only changes once they are all written, so a version check
+    alone cannot tell a half-written vectorstore from the old one.
+
+    Returns:
+        RetrievalEngine: The new active engine
+    """
+    global _engine, _retriever, _qa_chain
+    old = load_engine()
+    if build_in_progress(vectorstore_dir):
+        raise RuntimeError("Vectorstore is being rebuilt; reload once embed has finished")
+    new_model = read_index_info(vectorstore_dir).get("model_name")
+    shared = old if new_model in (None, old.info.get("model_name")) else None
+    print(f"Reloading retrieval engine from {vectorstore_dir} "
+          f"(version {old.version} -> {read_index_version(vectorstore_dir)})...", file=sys.stderr)
+    if shared is not None:
+        new = RetrievalEngine(vectorstore_dir, model_name=old.model_name, encoder=shared)
     else:
-        # If your metadata is structured differently (e.g., a dict with "docstore" and "index_to_docstore_id" keys)
-        # you would add that logic here, similar to test_embeddings.py.
-        # For now, sticking to the list-of-dicts structure observed in bg3_metadata.json
-        raise ValueError(f"Unsupported metadata format in {metadata_path}. Expected a list of metadata dictionaries.")
-
-    final_docstore = InMemoryDocstore(docstore_reconstruction)
-    final_index_to_docstore_id = {int(k): v for k, v in index_to_docstore_id_reconstruction.items()}
-
-    if faiss_index_obj.ntotal != len(final_index_to_docstore_id):
-        print(f"WARNING: FAISS index has {faiss_index_obj.ntotal} vectors, "
-              f"but reconstructed index_to_docstore_id has {len(final_index_to_docstore_id)} entries.", file=sys.stderr)
-        # Adjusting final_index_to_docstore_id to match faiss_index_obj.ntotal
-        # This ensures that every vector in the FAISS index has a corresponding entry in index_to_docstore_id,
-        # and vice-versa, preventing potential errors during FAISS object construction or querying.
-        
-        # Option 1: If metadata is more than vectors, trim metadata mapping
-        if len(final_index_to_docstore_id) > faiss_index_obj.ntotal:
-            print(f"Adjusting index_to_docstore_id: Trimming to first {faiss_index_obj.ntotal} items.", file=sys.stderr)
-            final_index_to_docstore_id = {
-                i: final_index_to_docstore_id[i] 
-                for i in range(faiss_index_obj.ntotal) 
-                if i in final_index_to_docstore_id # Ensure key exists before trying to access
-            }
-        # Option 2: If vectors are more than metadata (less common if metadata was generated with index)
-        # This case might mean some vectors won't have retrievable documents.
-        # The FAISS constructor might handle this, or it might error if a vector ID is requested that's not in index_to_docstore_id.
-        # For safety, ensure all referred doc_ids in final_index_to_docstore_id exist in final_docstore.
-        # The current loop structure for building docstore and index_to_docstore_id ensures this for 0..N-1 mapping.
-
-    vectorstore = FAISS(
-        embedding_function=embeddings,  # Pass the HuggingFaceEmbeddings instance directly
-        index=faiss_index_obj,
-        docstore=final_docstore,
-        index_to_docstore_id=final_index_to_docstore_id
-    )
-    print("FAISS vectorstore loaded successfully using direct method!", file=sys.stderr)
-
-except Exception as e:
-    print(f"Error loading vectorstore: {e}", file=sys.stderr)
-    import traceback
-    traceback.print_exc(file=sys.stderr)
-    raise
+        new = RetrievalEngine(vectorstore_dir, model_name=new_model)
+    if build_in_progress(vectorstore_dir) or read_index_version(vectorstore_dir) != new.version:
+        # Files were being rewritten while they were read; keep the old engine
+        if shared is None:
+            # Stop the batcher thread the discarded engine started
+            new.close()
+        raise RuntimeError("Vectorstore changed while it was being loaded")
+    with _lock:
+        _engine, _retriever, _qa_chain = new, EngineRetriever(engine=new, k=RETRIEVER_K), None
+    if shared is None:
+        old.close()
+    return new
+
+def get_retriever(engine=None, tags=None):
+    """Retriever over ``engine`` (or the active engine), optionally filtered by tags"""
+    load_engine()
+    retriever = _retriever
+    if tags or (engine is not None and retriever.engine is not engine):
+        retriever = EngineRetriever(engine=engine or retriever.engine, k=RETRIEVER_K, tags=tags or None)
+    return retriever
+
+def get_qa_chain():
+    """The RetrievalQA chain over the shared engine, built on first use"""
+    global _qa_chain
+    retriever = get_retriever()
+    with _lock:
+        if _qa_chain is None:
+            # Create RAG pipeline
+            _qa_chain = RetrievalQA.from_chain_type(
+                llm=llm,
+                retriever=retriever,
+                chain_type_kwargs={"prompt": prompt}
+            )
+        return _qa_chain
+
+def __getattr__(name):
+    # Keep `from src.rag_pipeline import engine / retriever / qa_chain` working
+    if name == "engine":
+        return load_engine()
+    if name == "retriever":
+        return get_retriever()
+    if name == "qa_chain":
+        return get_qa_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Define prompt template
 prompt_template = """
@@ -118,7 +129,7 @@ You are an expert assistant for Baldur's Gate 3. Use the following context to an
 Context:
 {context}
 
-Question: 
+Question:
 {question}
 
 Answer:
@@ -129,9 +140,38 @@ prompt = PromptTemplate(
     input_variables=["context", "question"]
 )
 
-# Create RAG pipeline
-qa_chain = RetrievalQA.from_chain_type(
-    llm=llm,
-    retriever=vectorstore.as_retriever(),
-    chain_type_kwargs={"prompt": prompt}
-)
+# The steps of qa_chain, exposed separately so the API can run retrieval and
+# the LLM call as independent (async) stages
+
+def format_context(docs):
+    """Join retrieved documents the same way the "stuff" chain does"""
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def build_prompt(question, docs):
+    return prompt.format(context=format_context(docs), question=question)
+
+# Merges, dedupes and budgets retrieved chunks before they reach the prompt
+context_assembler = ContextAssembler()
+
+def assemble_context(docs):
+    with span("context"):
+        return context_assembler.assemble(docs)
+
+def retrieve(question, engine=None, tags=None):
+    return assemble_context(get_retriever(engine, tags).invoke(question))
+
+async def aretrieve(question, engine=None, tags=None):
+    return assemble_context(await get_retriever(engine, tags).ainvoke(question))
+
+def generate_answer(question, docs):
+    return llm.invoke(build_prompt(question, docs)).content
+
+async def agenerate_answer(question, docs):
+    response = await llm.ainvoke(build_prompt(question, docs))
+    return response.content
+
+async def astream_answer(question, docs):
+    """Yield the LLM answer piece by piece as tokens arrive"""
+    async for chunk in llm.astream(build_prompt(question, docs)):
+        if chunk.content:
+            yield chunk.content
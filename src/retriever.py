@@ -0,0 +1,421 @@
+"""
+Shared retrieval engine used by both the /search endpoint and the RAG chain.
+
+One RetrievalEngine owns the query encoder, the FAISS index, the chunk
+metadata and the packed chunk text, so a worker process holds a single copy
+of each instead of one per consumer.
+"""
+import os
+import sys
+import json
+import glob
+import socket
+import time
+import asyncio
+import functools
+from typing import Any, List, Optional
+import numpy as np
+import faiss
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.batcher import BatcherClosed, MicroBatcher
+from src.cache import QueryEmbeddingCache
+from src.content_store import load_content_store
+from src.metadata_store import load_metadata_store, load_tag_index
+from src.lexical import load_lexical_index, reciprocal_rank_fusion
+from src.metrics import record, span
+from src.query_encoder import load_query_encoder
+from src.embedder import iter_chunk_docs, SHARD_GLOB
+from src.faiss_index import base_index, search_parameters
+
+# Overridable so tests and load tests can point the API at another vectorstore
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", "embeddings/bg3_vectorstore")
+CHUNKED_DIR = os.getenv("CHUNKED_DIR", "data/chunked_json")
+INDEX_FILE = "bg3_faiss.index"
+METADATA_FILE = "bg3_metadata.json"
+INDEX_INFO_FILE = "bg3_index_info.json"
+# Written by embed_and_store while it rewrites the vectorstore files
+BUILD_MARKER_FILE = "bg3_build.lock"
+# Query embeddings kept in the LRU cache shared by /search and /query
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+# Concurrent query encodes are merged into one batch of up to ENCODER_BATCH_SIZE
+# texts, waiting at most ENCODER_MAX_WAIT_MS for others to join (0 disables)
+ENCODER_BATCH_SIZE = int(os.getenv("ENCODER_BATCH_SIZE", "32"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+# Memory-map the FAISS index instead of reading it into private memory, so
+# worker processes share one page-cache copy (see read_faiss_index)
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() in ("1", "true", "yes")
+# "float32" (PyTorch) or "onnx-int8" (quantized export from `embed --quantize-encoder`)
+QUERY_ENCODER = os.getenv("QUERY_ENCODER", "float32")
+# Fuse vector and BM25 rankings when the vectorstore has a BM25 index; each
+# ranking contributes its best HYBRID_CANDIDATES rows to the fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+
+
+def read_index_info(vectorstore_dir):
+    """Contents of the index info file written by embed_and_store, or {}"""
+    info_path = os.path.join(vectorstore_dir, INDEX_INFO_FILE)
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_in_progress(vectorstore_dir):
+    """
+    Whether embed_and_store is rewriting the vectorstore files.
+
+    A marker left behind by a build process that died on this host is
+    ignored; one from another host (e.g. a separate embed container) counts
+    until it is removed.
+    """
+    marker_path = os.path.join(vectorstore_dir, BUILD_MARKER_FILE)
+    try:
+        with open(marker_path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        # Caught between creation and the first write
+        return True
+    if marker.get("host") == socket.gethostname():
+        try:
+            os.kill(int(marker["pid"]), 0)
+        except ProcessLookupError:
+            print(f"Ignoring stale build marker {marker_path} of process {marker['pid']}", file=sys.stderr)
+            return False
+        except (KeyError, ValueError, PermissionError):
+            pass
+    return True
+
+
+def read_index_version(vectorstore_dir):
+    """
+    Version string of a vectorstore, written by embed_and_store.
+
+    Vectorstores built before versioning fall back to the index file's
+    modification time, which still changes on every rebuild.
+    """
+    version = read_index_info(vectorstore_dir).get("version")
+    if version:
+        return version
+    return f"mtime-{int(os.path.getmtime(os.path.join(vectorstore_dir, INDEX_FILE)))}"
+
+
+def read_faiss_index(path, mmap=INDEX_MMAP):
+    """
+    Open a FAISS index, memory-mapped and read-only when ``mmap`` is set.
+
+    Mapped indexes are paged in from the OS page cache on demand and shared
+    by every process that maps the same file. IO_FLAG_MMAP_IFC maps the
+    vector codes of every index type we build; older FAISS versions only
+    have IO_FLAG_MMAP, which maps IVF inverted lists and reads flat, HNSW and
+    scalar-quantized codes into private memory. Indexes FAISS cannot map
+    are read into memory as before.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    try:
+        index = faiss.read_index(path, (mmap_ifc or faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        print(f"Cannot memory-map {path} ({e}); reading it into memory.", file=sys.stderr)
+        return faiss.read_index(path)
+    if mmap_ifc is None and faiss.try_extract_index_ivf(index) is None:
+        print(f"WARNING: FAISS {faiss.__version__} cannot memory-map {type(base_index(index)).__name__} "
+              f"codes; {path} is held in private memory by every worker. "
+              "Upgrade faiss-cpu (IO_FLAG_MMAP_IFC) to share it.", file=sys.stderr)
+    return index
+
+
+def encode_texts(model, texts):
+    """Encode texts with a sentence-transformers model into a float32 matrix"""
+    return np.asarray(model.encode(texts), dtype="float32")
+
+
+class RetrievalEngine:
+    """Encoder, FAISS index, metadata and chunk text behind one search API"""
+
+    def __init__(self, vectorstore_dir=VECTORSTORE_DIR, model_name=MODEL_NAME, chunked_dir=CHUNKED_DIR,
+                 query_cache_size=QUERY_CACHE_SIZE, encoder_batch_size=ENCODER_BATCH_SIZE,
+                 encoder_max_wait_ms=ENCODER_MAX_WAIT_MS, encoder=None, query_encoder=QUERY_ENCODER):
+        """
+        Args:
+            encoder (RetrievalEngine, optional): Engine whose query encoder,
+                micro-batcher and query embedding cache are reused instead of
+                loading the model again (used when hot-swapping the index)
+            query_encoder (str): "float32" or "onnx-int8" (see src.query_encoder)
+        """
+        self.vectorstore_dir = vectorstore_dir
+        self.chunked_dir = chunked_dir
+        self.model_name = model_name
+        self._shard_contents = None
+
+        index_path = os.path.join(vectorstore_dir, INDEX_FILE)
+        metadata_path = os.path.join(vectorstore_dir, METADATA_FILE)
+        self.metadatas = load_metadata_store(vectorstore_dir)
+        # The JSON metadata is only needed for vectorstores without the columnar copy
+        required = [index_path] if self.metadatas is not None else [index_path, metadata_path]
+        for path in required:
+            if not os.path.exists(path):
+                print(f"Error: File not found at {path}", file=sys.stderr)
+                if os.path.isdir(vectorstore_dir):
+                    print("Available files in directory:", os.listdir(vectorstore_dir), file=sys.stderr)
+                raise FileNotFoundError(f"File not found at {path}")
+
+        self.info = read_index_info(vectorstore_dir)
+        if encoder is not None:
+            self.model = encoder.model
+            self.query_encoder = encoder.query_encoder
+            self.batcher = encoder.batcher
+            self.query_cache = encoder.query_cache
+        else:
+            print("Initializing embedding model...", file=sys.stderr)
+            self.model, self.query_encoder = load_query_encoder(model_name, query_encoder, vectorstore_dir, self.info)
+            self.query_cache = QueryEmbeddingCache(query_cache_size)
+            self.batcher = None
+            if encoder_max_wait_ms > 0 and encoder_batch_size > 1:
+                # Bound to the model rather than to this engine: engines that
+                # reuse the batcher after a hot swap must not keep this one
+                # (and its index) alive
+                self.batcher = MicroBatcher(functools.partial(encode_texts, self.model),
+                                            encoder_batch_size, encoder_max_wait_ms)
+
+        print(f"Reading FAISS index from {index_path}", file=sys.stderr)
+        self.index = read_faiss_index(index_path)
+
+        if self.metadatas is not None:
+            live_rows = self.metadatas.live_rows()
+        else:
+            print(f"No columnar metadata in {vectorstore_dir}; parsing {METADATA_FILE}. "
+                  "Re-run `python main.py embed` to build it.", file=sys.stderr)
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                self.metadatas = json.load(f)
+            if not isinstance(self.metadatas, list):
+                raise ValueError(f"Unsupported metadata format in {metadata_path}. Expected a list of metadata dictionaries.")
+            # Rows freed by incremental re-embedding are stored as null
+            live_rows = sum(1 for meta in self.metadatas if meta is not None)
+        if self.index.ntotal != live_rows:
+            print(f"WARNING: FAISS index has {self.index.ntotal} vectors, "
+                  f"but metadata has {live_rows} entries.", file=sys.stderr)
+
+        self.content_store = load_content_store(vectorstore_dir)
+        if self.content_store is None:
+            print(f"No packed content store in {vectorstore_dir}; falling back to per-chunk files. "
+                  "Re-run `python main.py embed` to build it.", file=sys.stderr)
+        self.tag_index = load_tag_index(vectorstore_dir, self.metadatas)
+        self.lexical = load_lexical_index(vectorstore_dir)
+        if self.lexical is None and HYBRID_SEARCH:
+            print(f"No BM25 index in {vectorstore_dir}; using vector search only. "
+                  "Re-run `python main.py embed` to build it.", file=sys.stderr)
+        self.version = read_index_version(vectorstore_dir)
+        print(f"Retrieval engine ready: {self.index.ntotal} vectors, index version {self.version}.", file=sys.stderr)
+
+    def _encode(self, texts):
+        return encode_texts(self.model, texts)
+
+    def _batched_encode(self, texts):
+        try:
+            return self.batcher.encode(texts)
+        except BatcherClosed:
+            # Closed by a concurrent reload_engine() that changed the model
+            return self._encode(texts)
+
+    async def _abatched_encode(self, texts):
+        try:
+            return await self.batcher.aencode(texts)
+        except BatcherClosed:
+            return await asyncio.to_thread(self._encode, texts)
+
+    def close(self):
+        """Stop the micro-batcher; later encodes on this engine are not batched"""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def _cached(self, queries):
+        embeddings = [self.query_cache.get(query) for query in queries]
+        return embeddings, [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    def _fill(self, queries, embeddings, missing, encoded):
+        for i, embedding in zip(missing, encoded):
+            embedding = np.array(embedding, dtype="float32")
+            self.query_cache.put(queries[i], embedding)
+            embeddings[i] = embedding
+        return np.vstack(embeddings)
+
+    def encode_queries(self, queries):
+        """
+        Encode a list of query strings into a float32 matrix.
+
+        Repeated queries are served from the LRU cache. A single miss goes
+        through the micro-batcher, so encodes from concurrent requests share
+        one model call. Several misses (an explicit batch, e.g. /search/batch)
+        are already a batch and are encoded directly in one model call.
+        """
+        embeddings, missing = self._cached(queries)
+        if missing:
+            texts = [queries[i] for i in missing]
+            # Includes the wait for the micro-batch to fill
+            with span("encode"):
+                if self.batcher is not None and len(texts) == 1:
+                    encoded = self._batched_encode(texts)
+                else:
+                    encoded = self._encode(texts)
+            return self._fill(queries, embeddings, missing, encoded)
+        return np.vstack(embeddings)
+
+    async def aencode_queries(self, queries):
+        """Async encode_queries(); waits on the batcher without holding a thread"""
+        embeddings, missing = self._cached(queries)
+        if missing:
+            texts = [queries[i] for i in missing]
+            with span("encode"):
+                if self.batcher is not None and len(texts) == 1:
+                    encoded = await self._abatched_encode(texts)
+                else:
+                    encoded = await asyncio.to_thread(self._encode, texts)
+            return self._fill(queries, embeddings, missing, encoded)
+        return np.vstack(embeddings)
+
+    def load_content(self, row, chunk_id):
+        """Return chunk text for a FAISS row, from the packed store when available"""
+        if self.content_store is not None:
+            return self.content_store.get(row)
+        try:
+            # Shards take precedence over per-chunk files, as in iter_chunk_docs
+            shard_contents = self.shard_contents()
+            if shard_contents:
+                return shard_contents.get(chunk_id)
+            content_file = os.path.join(self.chunked_dir, f"{chunk_id}.json")
+            if os.path.exists(content_file):
+                with open(content_file, "r", encoding="utf-8") as f:
+                    return json.load(f).get("content", "")
+        except Exception as e:
+            print(f"Error loading content for {chunk_id}: {e}", file=sys.stderr)
+        return None
+
+    def shard_contents(self):
+        """chunk_id -> content for JSONL chunk shards, read once on first use"""
+        if self._shard_contents is None:
+            self._shard_contents = {}
+            if os.path.isdir(self.chunked_dir) and glob.glob(os.path.join(self.chunked_dir, SHARD_GLOB)):
+                for doc in iter_chunk_docs(self.chunked_dir):
+                    self._shard_contents[doc["chunk_id"]] = doc.get("content", "")
+        return self._shard_contents
+
+    def search(self, query, top_k=3, nprobe=None, ef_search=None, hybrid=None, tags=None):
+        """
+        Search the index for a single query.
+
+        ``nprobe`` (IVF indexes) and ``ef_search`` (HNSW) trade accuracy for
+        speed on this call only; they are ignored by other index types.
+        ``hybrid`` fuses the vector ranking with BM25 (defaults to
+        HYBRID_SEARCH when the vectorstore has a BM25 index). ``tags`` keeps
+        only chunks carrying any of the given tags; the filter is applied
+        inside the FAISS search, so it costs the same as an unfiltered one.
+
+        Returns:
+            list: Hit dicts holding the chunk metadata plus "score" (L2
+            distance, None for hits found only by BM25), "row" (FAISS row id),
+            "content" when available and "fusion_score" for hybrid searches
+        """
+        return self.search_batch([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search,
+                                 hybrid=hybrid, tags=tags)[0]
+
+    def _hit(self, row, score):
+        metadata = self.metadatas[row]
+        if metadata is None:
+            return None
+        result = dict(metadata)
+        result["score"] = score
+        result["row"] = row
+        content = self.load_content(row, result["chunk_id"])
+        if content is not None:
+            result["content"] = content
+        return result
+
+    def search_batch(self, queries, top_k=3, nprobe=None, ef_search=None, hybrid=None, tags=None):
+        """
+        Search the index for many queries with one encode and one FAISS call.
+
+        Returns:
+            list: One list of hit dicts (see search()) per query, in order
+        """
+        if not queries:
+            return []
+        # top_k < 1 would never fill a result list and return every candidate
+        top_k = max(1, int(top_k))
+        hybrid = (HYBRID_SEARCH if hybrid is None else hybrid) and self.lexical is not None
+        # Both rankings go deeper than top_k so fusion can promote chunks that
+        # only one of them ranks highly
+        depth = max(top_k, HYBRID_CANDIDATES) if hybrid else top_k
+        embeddings = self.encode_queries(list(queries))
+        bitmap = selector = None
+        if tags:
+            # The selector points into bitmap; both stay referenced until the
+            # search below returns
+            bitmap = self.tag_index.bitmap(tags)
+            selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        params = search_parameters(self.index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+        with span("faiss_search"):
+            D, I = self.index.search(embeddings, depth, params=params)
+
+        # FAISS pads with -1 when fewer than top_k vectors match; mask those and
+        # out-of-range rows for the whole matrix at once, then convert to
+        # Python scalars in bulk instead of per hit
+        valid = (I >= 0) & (I < len(self.metadatas))
+        rows, scores, valid = I.tolist(), D.tolist(), valid.tolist()
+        results = []
+        lexical_seconds = hydrate_seconds = 0.0
+        for query, query_rows, query_scores, query_valid in zip(queries, rows, scores, valid):
+            ranked = [(idx, score) for idx, score, ok in zip(query_rows, query_scores, query_valid) if ok]
+            fusion = None
+            start = time.perf_counter()
+            if hybrid:
+                lexical_rows, _ = self.lexical.search(query, depth, bitmap=bitmap)
+                fusion = reciprocal_rank_fusion([[idx for idx, _ in ranked], lexical_rows.tolist()])
+                distances = dict(ranked)
+                ranked = [(idx, distances.get(idx)) for idx, _ in fusion]
+                fusion = dict(fusion)
+                lexical_seconds += time.perf_counter() - start
+                start = time.perf_counter()
+            hits = []
+            for idx, score in ranked:
+                result = self._hit(idx, score)
+                if result is None:
+                    continue
+                if fusion is not None:
+                    result["fusion_score"] = fusion[idx]
+                hits.append(result)
+                if len(hits) == top_k:
+                    break
+            hydrate_seconds += time.perf_counter() - start
+            results.append(hits)
+        if hybrid:
+            record("lexical_search", lexical_seconds)
+        # Metadata and chunk text lookups of the returned hits
+        record("hydrate", hydrate_seconds)
+        return results
+
+
+class EngineRetriever(BaseRetriever):
+    """LangChain retriever that serves documents from a shared RetrievalEngine"""
+
+    engine: Any
+    k: int = 4
+    tags: Optional[List[str]] = None  # Only retrieve chunks with any of these tags
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents = []
+        for hit in self.engine.search(query, top_k=self.k, tags=self.tags):
+            content = hit.pop("content", "") or ""
+            documents.append(Document(page_content=content, metadata=hit))
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # Encoding and FAISS search are CPU-bound; keep them off the event loop
+        return await asyncio.to_thread(self._get_relevant_documents, query, run_manager=run_manager.get_sync())
@@ -0,0 +1,93 @@
+"""
+Startup stage tracking for the API's lifespan.
+
+Each stage (database, retrieval engine, cache warm-up, ...) runs in a worker
+thread and records its status and wall time, so /healthz can show loading
+progress and /readyz can tell when the worker is able to serve queries.
+
+A failing stage is retried with exponential backoff (a database that comes
+up late, a vectorstore still being built). Once its retries are exhausted
+the stages are marked failed for good, which /healthz reports as a liveness
+failure so the process gets restarted instead of never becoming ready.
+"""
+import sys
+import time
+import asyncio
+import threading
+
+
+class StartupStages:
+    """
+    Status and timings of named startup stages.
+
+    A stage is attempted up to ``retries + 1`` times, waiting ``retry_delay``
+    seconds after the first failure and twice as long after each further
+    one, at most ``max_retry_delay``.
+    """
+
+    def __init__(self, retries=0, retry_delay=1.0, max_retry_delay=60.0):
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._stages = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.ready = False
+        self.failed = False
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._stages.setdefault(name, {"status": "pending"}).update(fields)
+
+    def pending(self, *names):
+        """Register stages that have not started yet"""
+        for name in names:
+            self._update(name, status="pending")
+
+    async def run(self, name, fn, *args, **kwargs):
+        """
+        Run a blocking stage in a thread and record how long it took.
+
+        Failed attempts are retried as configured; the error of the last
+        attempt is recorded on the stage and re-raised.
+        """
+        start = time.perf_counter()
+        delay = self.retry_delay
+        for attempt in range(1, self.retries + 2):
+            self._update(name, status="running", attempts=attempt)
+            try:
+                result = await asyncio.to_thread(fn, *args, **kwargs)
+                break
+            except Exception as e:
+                seconds = round(time.perf_counter() - start, 3)
+                if attempt > self.retries:
+                    self._update(name, status="failed", seconds=seconds, error=str(e))
+                    self.failed = True
+                    print(f"Startup stage '{name}' failed after {attempt} attempt(s): {e}", file=sys.stderr)
+                    raise
+                self._update(name, status="retrying", seconds=seconds, error=str(e))
+                print(f"Startup stage '{name}' failed (attempt {attempt}/{self.retries + 1}), "
+                      f"retrying in {delay:.1f}s: {e}", file=sys.stderr)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+        seconds = time.perf_counter() - start
+        self._update(name, status="done", seconds=round(seconds, 3))
+        with self._lock:
+            # Only a retried stage has one: drop its earlier failure
+            self._stages[name].pop("error", None)
+        print(f"Startup stage '{name}' done in {seconds:.2f}s", file=sys.stderr)
+        return result
+
+    def mark_ready(self):
+        self.ready = True
+        print(f"Ready to serve after {time.time() - self.started_at:.2f}s", file=sys.stderr)
+
+    def report(self):
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self._stages.items()}
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "stages": stages,
+        }
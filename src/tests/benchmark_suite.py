@@ -0,0 +1,347 @@
+"""
+Offline component benchmarks: chunking, embedding, search, hydration and
+context assembly on a synthetic BG3-like corpus.
+
+The corpus is generated from a seed, so runs with the same options measure
+the same work; results are written as JSON and can be compared between
+commits with --compare. Everything runs on CPU without network access: the
+embedding model is loaded from the local cache (or a local path), and a
+hashing stub encoder is used when it is not available or with --stub.
+
+Usage:
+    python src/tests/benchmark_suite.py --pages 500 --output bench.json
+    python src/tests/benchmark_suite.py --pages 500 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from types import SimpleNamespace
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.embedder import chunk_text, chunk_json_files
+from src.vectorizer import embed_and_store
+from src.retriever import RetrievalEngine, MODEL_NAME
+from src.cache import QueryEmbeddingCache
+from src.context import ContextAssembler
+from langchain_core.documents import Document
+from helpers import HashingEncoder
+
+TAGS = ["Spells", "Items", "Companions", "Locations", "Quests", "Classes", "Creatures"]
+NAMES = ["Karlach", "Shadowheart", "Astarion", "Gale", "Lae'zel", "Wyll", "Halsin", "Minthara", "Jaheira",
+         "Minsc", "Withers", "Volo", "Raphael", "Orin", "Gortash", "Ketheric"]
+PLACES = ["Moonrise Towers", "the Underdark", "the Emerald Grove", "Baldur's Gate", "the Shadow-Cursed Lands",
+          "Grymforge", "the Goblin Camp", "the Nautiloid", "Last Light Inn", "the Lower City"]
+WORDS = ["fire", "frost", "radiant", "necrotic", "shield", "blade", "arcane", "divine", "cursed", "ancient",
+         "storm", "shadow", "silver", "iron", "blood", "moon", "sun", "illithid", "tadpole", "astral"]
+NOUNS = ["Bolt", "Ward", "Strike", "Amulet", "Ring", "Gloves", "Armour", "Staff", "Bow", "Elixir", "Scroll",
+         "Wraith", "Hag", "Dragon", "Golem", "Ritual", "Pact", "Oath", "Circle", "Path"]
+SECTIONS = ["Overview", "Description", "Properties", "Where to find", "Notes", "Trivia", "Related quests"]
+SENTENCES = [
+    "{name} can be found near {place} after the events of Act {act}.",
+    "This {word} effect deals {dice} {word2} damage on a successful hit.",
+    "The {title} grants advantage on saving throws against {word} spells.",
+    "Casting {title} costs a level {act} spell slot and requires concentration.",
+    "Speak to {name} at {place} to start the quest.",
+    "{name} approves if you use the {title} to protect the party.",
+    "Enemies within 3m take {dice} {word} damage and are knocked prone.",
+    "The {title} is sold by a trader in {place} for {gold} gold.",
+    "Long resting at camp restores all charges of the {title}.",
+    "A DC {dc} {stat} check reveals a hidden {word} cache in {place}.",
+]
+
+
+def load_encoder(model_name, stub=False):
+    """The local sentence-transformers model, or the hashing stub when offline"""
+    if not stub:
+        try:
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(model_name, device="cpu", local_files_only=True), model_name
+        except Exception as e:
+            print(f"Could not load {model_name} offline ({e}); using the hashing stub encoder.")
+    return HashingEncoder(dim=384, record_calls=False), "stub-hashing-384"
+
+
+def make_page(rng, i):
+    title = f"{rng.choice(WORDS).title()} {rng.choice(NOUNS)}" if i % 3 else rng.choice(NAMES)
+    title = f"{title} {i}"
+
+    def sentence():
+        return rng.choice(SENTENCES).format(
+            name=rng.choice(NAMES), place=rng.choice(PLACES), act=rng.randint(1, 3), word=rng.choice(WORDS),
+            word2=rng.choice(WORDS), dice=f"{rng.randint(1, 4)}d{rng.choice([4, 6, 8, 10, 12])}", title=title,
+            gold=rng.randint(10, 5000), dc=rng.randint(8, 22), stat=rng.choice(["Perception", "Arcana", "History"]),
+        )
+
+    sections = []
+    for heading in rng.sample(SECTIONS, rng.randint(2, 5)):
+        paragraph = " ".join(sentence() for _ in range(rng.randint(3, 12)))
+        sections.append(f"## {heading}\n\n{paragraph}")
+    return {
+        "title": title,
+        "url": f"https://bg3.wiki/wiki/{title.replace(' ', '_')}",
+        "content": "\n\n".join(sections),
+        "tags": rng.sample(TAGS, rng.randint(1, 2)),
+    }
+
+
+def write_corpus(parsed_dir, n_pages, seed):
+    """Write synthetic parsed pages (title, url, content, tags) as the scraper would"""
+    os.makedirs(parsed_dir, exist_ok=True)
+    rng = random.Random(seed)
+    pages = []
+    for i in range(n_pages):
+        page = make_page(rng, i)
+        with open(os.path.join(parsed_dir, f"page_{i:06d}.json"), "w", encoding="utf-8") as f:
+            json.dump(page, f, ensure_ascii=False)
+        pages.append(page)
+    return pages
+
+
+def make_queries(rng, pages, n_queries):
+    queries = []
+    for _ in range(n_queries):
+        page = rng.choice(pages)
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(f"What does {page['title']} do?")
+        elif kind < 0.7:
+            queries.append(f"Where can I find {rng.choice(NAMES)} in {rng.choice(PLACES)}?")
+        else:
+            queries.append(f"best {rng.choice(WORDS)} {rng.choice(NOUNS).lower()} for a {rng.choice(TAGS).lower()} build")
+    return queries
+
+
+def percentiles(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms)
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def each_timed(fn, items):
+    """Call fn on every item; returns per-call latencies in ms"""
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def dir_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 2**20
+
+
+def bench_chunking(pages, parsed_dir, chunked_dir, workers):
+    contents = [page["content"] for page in pages]
+    chunks, seconds = timed(lambda: [chunk for text in contents for chunk in chunk_text(text)])
+    n_chars = sum(len(text) for text in contents)
+    stats, files_seconds = timed(chunk_json_files, parsed_dir, chunked_dir, output_format="jsonl", workers=workers)
+    return {
+        "chunk_text": {
+            "chunks": len(chunks),
+            "seconds": seconds,
+            "mb_per_s": n_chars / 2**20 / seconds if seconds else None,
+        },
+        "chunk_json_files": {
+            "workers": workers,
+            "seconds": files_seconds,
+            "pages_per_s": len(pages) / files_seconds if files_seconds else None,
+            "stats": stats,
+        },
+    }
+
+
+def bench_embedding(model, model_label, chunked_dir, vectorstore_dir, index_type, n_chunks):
+    _, seconds = timed(embed_and_store, chunked_dir, vectorstore_dir, model_name=model_label, model=model,
+                       index_type=index_type, incremental=False, eval_queries=50)
+    # Nothing changed, so this measures manifest diffing and rewriting the stores
+    _, noop_seconds = timed(embed_and_store, chunked_dir, vectorstore_dir, model_name=model_label, model=model,
+                            index_type=index_type, incremental=True, eval_queries=50)
+    return {
+        "index_type": index_type,
+        "full_build_seconds": seconds,
+        "chunks_per_s": n_chunks / seconds if seconds else None,
+        "incremental_noop_seconds": noop_seconds,
+        "vectorstore_mb": dir_size_mb(vectorstore_dir),
+    }
+
+
+def bench_search(engine, model, queries, top_ks):
+    vectors = np.asarray(model.encode(queries), dtype="float32")
+    results = {}
+    for top_k in top_ks:
+        latencies = []
+        for i in range(len(vectors)):
+            start = time.perf_counter()
+            engine.index.search(vectors[i:i + 1], top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        _, batch_seconds = timed(engine.index.search, vectors, top_k)
+        entry = {
+            "faiss_single": percentiles(latencies),
+            "faiss_batch_qps": len(vectors) / batch_seconds if batch_seconds else None,
+            # Encode + search + metadata and content hydration, query cache off
+            "engine_vector": percentiles(each_timed(lambda q: engine.search(q, top_k=top_k, hybrid=False), queries)),
+        }
+        if engine.lexical is not None:
+            entry["engine_hybrid"] = percentiles(
+                each_timed(lambda q: engine.search(q, top_k=top_k, hybrid=True), queries))
+        results[str(top_k)] = entry
+    return results
+
+
+def bench_hydration(engine, n_lookups, seed):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(engine.metadatas), size=n_lookups).tolist()
+    metadata_ms = each_timed(lambda row: engine.metadatas[row], rows)
+    content_ms = each_timed(lambda row: engine.load_content(row, None), rows)
+    hit_ms = each_timed(lambda row: engine._hit(row, 0.0), rows)
+    return {
+        "lookups": n_lookups,
+        "metadata_us": float(np.mean(metadata_ms) * 1000),
+        "content_us": float(np.mean(content_ms) * 1000),
+        "hit_us": float(np.mean(hit_ms) * 1000),
+    }
+
+
+def bench_context(engine, queries, top_k, max_tokens):
+    assembler = ContextAssembler(max_tokens=max_tokens)
+    hits = engine.search_batch(queries, top_k=top_k, hybrid=False)
+    retrieved = [
+        [Document(page_content=hit.pop("content", "") or "", metadata=hit) for hit in query_hits]
+        for query_hits in hits
+    ]
+    latencies = each_timed(assembler.assemble, retrieved)
+    return dict(percentiles(latencies), top_k=top_k, **assembler.stats())
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bg3_bench_")
+    parsed_dir = os.path.join(workdir, "parsed")
+    chunked_dir = os.path.join(workdir, "chunked")
+    vectorstore_dir = os.path.join(workdir, "vectorstore")
+    for path in (parsed_dir, chunked_dir, vectorstore_dir):
+        shutil.rmtree(path, ignore_errors=True)
+
+    model, model_label = load_encoder(args.model, args.stub)
+    rng = random.Random(args.seed)
+    pages = write_corpus(parsed_dir, args.pages, args.seed)
+    queries = make_queries(rng, pages, args.queries)
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": faiss.__version__,
+            "encoder": model_label,
+            "options": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "corpus": {"pages": len(pages), "chars": sum(len(page["content"]) for page in pages)},
+    }
+
+    print(f"Chunking {len(pages)} pages...")
+    results["chunk"] = bench_chunking(pages, parsed_dir, chunked_dir, args.workers)
+    n_chunks = results["chunk"]["chunk_json_files"]["stats"]["chunks"]
+    results["corpus"]["chunks"] = n_chunks
+
+    print(f"Embedding {n_chunks} chunks with {model_label}...")
+    results["embed"] = bench_embedding(model, model_label, chunked_dir, vectorstore_dir, args.index_type, n_chunks)
+
+    # Share the benchmark's encoder with the engine; the query cache is off
+    # so every search pays for its encode
+    encoder = SimpleNamespace(model=model, query_encoder=model_label, batcher=None,
+                              query_cache=QueryEmbeddingCache(0))
+    engine = RetrievalEngine(vectorstore_dir, model_name=model_label, chunked_dir=chunked_dir, encoder=encoder)
+    print(f"Searching {len(queries)} queries at top_k {args.top_k}...")
+    results["search"] = bench_search(engine, model, queries, args.top_k)
+    results["hydration"] = bench_hydration(engine, args.hydration_lookups, args.seed)
+    results["context"] = bench_context(engine, queries, max(args.top_k), args.context_tokens)
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def print_report(results, baseline=None):
+    flat = flatten({key: value for key, value in results.items() if key != "meta"})
+    old = flatten({key: value for key, value in baseline.items() if key != "meta"}) if baseline else {}
+    print(f"\nEncoder: {results['meta']['encoder']}, commit {results['meta']['commit']}")
+    if baseline:
+        print(f"Compared with commit {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    for name, value in flat.items():
+        line = f"  {name:<55} {value:>14.4f}"
+        if name in old and old[name]:
+            line += f"   x{value / old[name]:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline chunk/embed/search/context benchmarks")
+    parser.add_argument("--pages", type=int, default=500, help="Synthetic wiki pages to generate")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 5, 10, 50])
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--workers", type=int, default=1, help="Chunking processes")
+    parser.add_argument("--hydration-lookups", type=int, default=5000)
+    parser.add_argument("--context-tokens", type=int, default=1500, help="Token budget for context assembly")
+    parser.add_argument("--model", default=MODEL_NAME, help="Model name (from the local cache) or path")
+    parser.add_argument("--stub", action="store_true", help="Use the hashing stub encoder")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", default=None, help="Keep the corpus and vectorstore in this directory")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the temporary work directory")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path")
+    parser.add_argument("--compare", default=None, help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
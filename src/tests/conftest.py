@@ -0,0 +1,90 @@
+"""
+pytest configuration and fixtures for the unit tests in this directory.
+
+The tests import the application as ``src.<module>``, like main.py does, so
+the repository root goes on sys.path. The scripts whose names match
+pytest's test patterns (debug helpers for a built vectorstore and the load
+test) are not pytest modules.
+
+Vectorstores are built from the synthetic chunks of helpers.py with its
+HashingEncoder, so the tests run offline and without downloading the
+embedding model.
+"""
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from helpers import HashingEncoder, write_chunks
+
+# Read when src.db and src.api are imported: never touch a real database,
+# and do not poll the vectorstore for rebuilds
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["INDEX_WATCH_INTERVAL"] = "0"
+
+collect_ignore = ["test_embeddings.py", "run_test.py", "query_test.py", "load_test.py"]
+
+
+@pytest.fixture
+def encoder():
+    return HashingEncoder()
+
+
+@pytest.fixture
+def vectorstore(tmp_path, encoder):
+    """Directory of a flat vectorstore over helpers.CHUNKS, built with ``encoder``"""
+    from src.vectorizer import embed_and_store
+
+    chunk_dir, vectorstore_dir = str(tmp_path / "chunks"), str(tmp_path / "vectorstore")
+    write_chunks(chunk_dir)
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", incremental=False, model=encoder)
+    return vectorstore_dir
+
+
+@pytest.fixture
+def load_encoder(monkeypatch, encoder):
+    """Make RetrievalEngine load ``encoder`` instead of a sentence-transformers model"""
+    monkeypatch.setattr("src.retriever.load_query_encoder", lambda *args, **kwargs: (encoder, "float32"))
+    return encoder
+
+
+@pytest.fixture
+def engine(vectorstore, load_encoder):
+    from src.retriever import RetrievalEngine
+
+    engine = RetrievalEngine(vectorstore, model_name="hashing")
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def api(monkeypatch, vectorstore, load_encoder):
+    """
+    src.api serving the test vectorstore, with an in-memory SQLite database
+    and a fake LLM. Yields (module, TestClient) once the API is ready.
+    """
+    from fastapi.testclient import TestClient
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from src import api, rag_pipeline
+    from src.cache import SemanticAnswerCache
+    from src.startup import StartupStages
+
+    monkeypatch.setattr(rag_pipeline, "vectorstore_dir", vectorstore)
+    monkeypatch.setattr(rag_pipeline, "_engine", None)
+    monkeypatch.setattr(rag_pipeline, "_retriever", None)
+    monkeypatch.setattr(rag_pipeline, "_qa_chain", None)
+    monkeypatch.setattr(rag_pipeline, "llm", FakeListChatModel(responses=["Karlach is a tiefling barbarian."]))
+    monkeypatch.setattr(api, "answer_cache", SemanticAnswerCache(maxsize=100, ttl=3600, threshold=0.95))
+    # A previous test's stages would report ready before this engine is loaded
+    monkeypatch.setattr(api, "startup", StartupStages())
+    with TestClient(api.app) as client:
+        for _ in range(500):
+            if client.get("/readyz").status_code == 200:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail(f"API did not become ready: {client.get('/healthz').json()}")
+        yield api, client
+    rag_pipeline.current_engine().close()
@@ -0,0 +1,59 @@
+"""
+Offline stand-ins shared by the unit tests (through conftest.py) and the
+benchmark scripts: a hashing encoder in place of the sentence-transformers
+model, and a few synthetic chunks.
+"""
+import os
+import json
+import zlib
+import numpy as np
+
+CHUNKS = [
+    ("Fireball", ["Spells", "Evocation"], "Fireball is a third level evocation spell dealing fire damage in a sphere."),
+    ("Fireball", ["Spells", "Evocation"], "The fire damage of Fireball increases when cast with a higher level slot."),
+    ("Shadowheart", ["Companions"], "Shadowheart is a half-elf cleric of Shar and an origin companion."),
+    ("Karlach", ["Companions"], "Karlach is a tiefling barbarian with an infernal engine in her chest."),
+    ("Grymforge", ["Locations"], "Grymforge is a duergar forge in the Underdark reached by boat."),
+    ("Everburn Blade", ["Items"], "The Everburn Blade is a greatsword that deals extra fire damage."),
+]
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for the sentence-transformers model.
+
+    Hashes words into ``dim`` buckets and L2-normalizes the counts, so texts
+    sharing words get close vectors. With ``record_calls`` the texts of each
+    encode() call are kept in ``calls``; benchmarks turn that off so the
+    corpus is not held in memory.
+    """
+
+    def __init__(self, dim=64, record_calls=True):
+        self.dim = dim
+        self.record_calls = record_calls
+        self.calls = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, **kwargs):
+        if self.record_calls:
+            self.calls.append(list(texts))
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            for word in text.casefold().split():
+                vectors[i, zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def write_chunks(chunk_dir, chunks=CHUNKS):
+    """Write (title, tags, content) chunks as chunk JSON files, numbered per page"""
+    os.makedirs(chunk_dir, exist_ok=True)
+    counts = {}
+    for title, tags, content in chunks:
+        page = title.replace(" ", "_")
+        index = counts[page] = counts.get(page, -1) + 1
+        doc = {"title": title, "url": f"https://bg3.wiki/wiki/{page}", "tags": tags,
+               "chunk_id": f"{page}_chunk_{index}", "content": content}
+        with open(os.path.join(chunk_dir, f"{doc['chunk_id']}.json"), "w", encoding="utf-8") as f:
+            json.dump(doc, f)
@@ -0,0 +1,332 @@
+"""
+End-to-end load test of the API without Groq or PostgreSQL.
+
+Starts three things:
+
+- a stub OpenAI-compatible LLM server (POST /v1/chat/completions, plain and
+  streamed) that answers after --llm-latency-ms and then emits tokens at
+  --llm-tokens-per-s
+- the API (uvicorn src.api:app) with LLM_BASE_URL pointing at the stub and
+  DATABASE_URL at a SQLite file
+- --users concurrent simulated users sending a weighted mix of /search,
+  /query and /history requests for --duration seconds
+
+and reports throughput and p50/p95/p99 latency per endpoint. The API needs
+a built vectorstore (--vectorstore) and its embedding model available
+locally (--embedding-model).
+
+Usage:
+    python src/tests/load_test.py --users 200 --duration 60 --output load.json
+    python src/tests/load_test.py --api-url http://localhost:8000 --users 50   # existing API
+    python src/tests/load_test.py stub-llm --port 8100                          # stub LLM only
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+STUB_ANSWER = ("Karlach is a tiefling barbarian whose infernal engine was installed in Avernus. "
+               "She joins the party at the Risen Road and her quest continues through all three acts. ")
+
+
+def stub_llm_app(latency_ms, tokens_per_s, answer_tokens):
+    """FastAPI app mimicking the chat completions endpoint of an OpenAI-compatible server"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    words = STUB_ANSWER.split()
+    tokens = [words[i % len(words)] + " " for i in range(answer_tokens)]
+    token_delay = 1.0 / tokens_per_s if tokens_per_s > 0 else 0.0
+    stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def usage(body):
+        prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+        return {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(tokens),
+                "total_tokens": prompt_chars // 4 + len(tokens)}
+
+    def chunk(body, completion_id, delta, finish_reason=None):
+        return {
+            "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        if not body.get("stream"):
+            try:
+                await asyncio.sleep(latency_ms / 1000 + token_delay * len(tokens))
+            finally:
+                stats["in_flight"] -= 1
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage(body),
+            }
+
+        async def events():
+            try:
+                await asyncio.sleep(latency_ms / 1000)
+                yield f"data: {json.dumps(chunk(body, completion_id, {'role': 'assistant', 'content': ''}))}\n\n"
+                for token in tokens:
+                    await asyncio.sleep(token_delay)
+                    yield f"data: {json.dumps(chunk(body, completion_id, {'content': token}))}\n\n"
+                yield f"data: {json.dumps(chunk(body, completion_id, {}, 'stop'))}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+
+def serve_stub_llm(args):
+    import uvicorn
+    app = stub_llm_app(args.llm_latency_ms, args.llm_tokens_per_s, args.llm_answer_tokens)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def spawn(cmd, env, log_path):
+    log = open(log_path, "w")
+    return subprocess.Popen(cmd, env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until(url, timeout, proc=None):
+    """Poll url until it answers 200; fail early if the process died"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f"Process for {url} exited with code {proc.returncode}")
+            try:
+                if (await client.get(url, timeout=2)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"{url} was not ready after {timeout}s")
+
+
+def load_queries(vectorstore_dir, n_queries, seed):
+    """Questions about page titles of the vectorstore, with some generic ones mixed in"""
+    from src.metadata_store import load_metadata_store
+    rng = random.Random(seed)
+    titles = []
+    metadatas = load_metadata_store(vectorstore_dir) if vectorstore_dir else None
+    if metadatas is not None:
+        titles = sorted({meta["title"] for meta in metadatas if meta is not None})
+    titles = titles or ["Karlach", "Fire Bolt", "Moonrise Towers", "Shadowheart", "Githyanki Egg"]
+    templates = ["Who is {}?", "Where do I find {}?", "What does {} do?", "Tell me about {}", "{} build tips"]
+    return [rng.choice(templates).format(rng.choice(titles)) for _ in range(n_queries)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, endpoint, seconds, ok):
+        self.latencies.setdefault(endpoint, []).append(seconds * 1000)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = np.asarray(latencies)
+            report[endpoint] = {
+                "requests": int(len(latencies)),
+                "errors": self.errors.get(endpoint, 0),
+                "rps": len(latencies) / elapsed,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "max_ms": float(latencies.max()),
+            }
+        return report
+
+
+async def user(client, rng, queries, mix, deadline, recorder, top_k):
+    """One simulated user: pick an endpoint by weight, send, repeat until the deadline"""
+    session_id = str(uuid.uuid4())
+    endpoints, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == "search":
+            request = ("/search", {"query": rng.choice(queries), "top_k": top_k})
+        elif endpoint == "query":
+            request = ("/query", {"query": rng.choice(queries), "session_id": session_id})
+        elif endpoint == "stream":
+            request = ("/query/stream", {"query": rng.choice(queries), "session_id": session_id})
+        else:
+            request = ("/history", {"session_id": session_id, "limit": 10})
+        start = time.perf_counter()
+        try:
+            response = await client.post(request[0], json=request[1])
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        recorder.add(request[0], time.perf_counter() - start, ok)
+
+
+async def drive(api_url, args, queries):
+    mix = {name: weight for name, weight in (part.split("=") for part in args.mix.split(","))}
+    mix = {name: float(weight) for name, weight in mix.items() if float(weight) > 0}
+    unknown = set(mix) - {"search", "query", "stream", "history"}
+    if unknown:
+        raise ValueError(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=api_url, timeout=args.timeout, limits=limits) as client:
+        if args.warmup:
+            await asyncio.gather(*(client.post("/search", json={"query": q}) for q in queries[:args.warmup]))
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            user(client, random.Random(args.seed + i), queries, mix, deadline, recorder, args.top_k)
+            for i in range(args.users)
+        ))
+        elapsed = time.monotonic() - start
+        cache_stats = (await client.get("/cache/stats")).json()
+    return recorder.report(elapsed), elapsed, cache_stats
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bg3_load_")
+    procs = []
+    try:
+        api_url = args.api_url
+        if api_url is None:
+            llm_port, api_port = args.llm_port, args.api_port
+            llm = spawn([sys.executable, os.path.abspath(__file__), "stub-llm", "--port", str(llm_port),
+                         "--llm-latency-ms", str(args.llm_latency_ms),
+                         "--llm-tokens-per-s", str(args.llm_tokens_per_s),
+                         "--llm-answer-tokens", str(args.llm_answer_tokens)],
+                        dict(os.environ), os.path.join(workdir, "stub_llm.log"))
+            procs.append(llm)
+            await wait_until(f"http://127.0.0.1:{llm_port}/v1/models", 30, llm)
+
+            env = dict(os.environ)
+            env.update({
+                "LLM_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+                "LLM_API_KEY": "stub",
+                "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'load_test.db')}",
+                "VECTORSTORE_DIR": os.path.abspath(args.vectorstore),
+                "INDEX_WATCH_INTERVAL": "0",
+            })
+            if args.embedding_model:
+                env["EMBEDDING_MODEL"] = args.embedding_model
+            api = spawn([sys.executable, "-m", "uvicorn", "src.api:app", "--host", "127.0.0.1",
+                         "--port", str(api_port), "--workers", str(args.api_workers), "--log-level", "warning"],
+                        env, os.path.join(workdir, "api.log"))
+            procs.append(api)
+            api_url = f"http://127.0.0.1:{api_port}"
+            print(f"Waiting for the API (logs in {workdir})...")
+            await wait_until(f"{api_url}/readyz", args.startup_timeout, api)
+
+        queries = load_queries(args.vectorstore, args.query_pool, args.seed)
+        print(f"Driving {args.users} users for {args.duration}s with mix {args.mix}...")
+        report, elapsed, cache_stats = await drive(api_url, args, queries)
+        llm_stats = None
+        if args.api_url is None:
+            async with httpx.AsyncClient() as client:
+                llm_stats = (await client.get(f"http://127.0.0.1:{args.llm_port}/stats")).json()
+        return {
+            "options": {key: value for key, value in vars(args).items() if key not in ("command", "output")},
+            "elapsed_seconds": elapsed,
+            "total_rps": sum(r["requests"] for r in report.values()) / elapsed,
+            "endpoints": report,
+            "cache_stats": cache_stats,
+            "stub_llm": llm_stats,
+        }
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def print_report(results):
+    print(f"\n{results['total_rps']:.1f} requests/s over {results['elapsed_seconds']:.1f}s")
+    print("Endpoint          requests  errors      rps   p50 ms   p95 ms   p99 ms")
+    for endpoint, r in results["endpoints"].items():
+        print(f"  {endpoint:<15} {r['requests']:>8} {r['errors']:>7} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    if results["stub_llm"]:
+        print(f"Stub LLM: {results['stub_llm']['requests']} completions, "
+              f"at most {results['stub_llm']['max_in_flight']} in flight")
+
+
+def add_llm_arguments(parser):
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Stub LLM time to first token")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=200, help="Stub LLM token rate (0: instant)")
+    parser.add_argument("--llm-answer-tokens", type=int, default=60, help="Tokens per stub answer")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "stub-llm":
+        parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM server")
+        parser.add_argument("command")
+        parser.add_argument("--port", type=int, default=8100)
+        add_llm_arguments(parser)
+        serve_stub_llm(parser.parse_args())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Load test the API with a stub LLM and SQLite")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--mix", default="search=5,query=3,history=2",
+                        help="Endpoint weights: search, query, stream, history")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--query-pool", type=int, default=500, help="Distinct questions to draw from")
+    parser.add_argument("--warmup", type=int, default=20, help="Searches sent before measuring")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-url", default=None, help="Load an already running API instead of starting one")
+    parser.add_argument("--api-port", type=int, default=8099)
+    parser.add_argument("--api-workers", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--vectorstore", default="embeddings/bg3_vectorstore")
+    parser.add_argument("--embedding-model", default=None, help="EMBEDDING_MODEL for the API (name or local path)")
+    parser.add_argument("--database-url", default=None, help="Default: a SQLite file in a temporary directory")
+    parser.add_argument("--llm-port", type=int, default=8100)
+    add_llm_arguments(parser)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
@@ -0,0 +1,196 @@
+"""
+Benchmark the quantized retrieval path against the float32 setup.
+
+Compares, on a sample of the chunks in a built vectorstore:
+
+- query encoders: float32 PyTorch model vs the int8 ONNX export
+  (single-query latency and size of the weights)
+- indexes: IndexFlatL2 vs sq8 / fp16 scalar quantizers
+  (search latency, serialized size, and the private memory a worker
+  needs to load and search the index with and without memory mapping)
+- retrieval overlap@k of every encoder/index combination with the
+  float32 encoder + flat index baseline
+
+Usage:
+    python src/tests/quantization_benchmark.py --corpus-size 5000 --output quantization.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import faiss
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+from sentence_transformers import SentenceTransformer
+from src.content_store import load_content_store
+from src.metadata_store import load_metadata_store
+from src.faiss_index import build_index
+from src.query_encoder import export_int8_encoder, load_query_encoder
+from src.retriever import MODEL_NAME, VECTORSTORE_DIR, METADATA_FILE, read_index_info
+
+
+def load_sample(vectorstore_dir, corpus_size, n_queries):
+    """Chunk texts and distinct page titles (used as queries) from a vectorstore"""
+    contents = load_content_store(vectorstore_dir)
+    if contents is None:
+        raise FileNotFoundError(f"No packed content store in {vectorstore_dir}; run `python main.py embed` first")
+    metadatas = load_metadata_store(vectorstore_dir)
+    if metadatas is None:
+        with open(os.path.join(vectorstore_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+            metadatas = json.load(f)
+    texts, titles = [], []
+    for row in range(len(contents)):
+        meta = metadatas[row]
+        if meta is None:
+            continue
+        texts.append(contents.get(row))
+        if meta["title"] not in titles and len(titles) < n_queries:
+            titles.append(meta["title"])
+        if len(texts) >= corpus_size:
+            break
+    return texts, titles
+
+
+def time_encoder(model, queries):
+    """Encode queries one at a time, as the API does; returns embeddings and latencies (ms)"""
+    model.encode(queries[:1])  # warm up
+    latencies, embeddings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        embeddings.append(model.encode([query])[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.asarray(embeddings, dtype="float32"), np.asarray(latencies)
+
+
+def time_search(index, queries, k):
+    latencies, found = [], []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(I[0])
+    return np.asarray(found), np.asarray(latencies)
+
+
+# Loads an index the way the API does in a fresh process and prints how much
+# its anonymous (unshared) memory grew; mapped pages are shared page cache
+PRIVATE_MEMORY_SCRIPT = """
+import sys, numpy as np
+from src.retriever import read_faiss_index
+def anon_kb():
+    with open("/proc/self/status") as f:
+        return int(f.read().split("RssAnon:")[1].split()[0])
+before = anon_kb()
+index = read_faiss_index(sys.argv[1], mmap=sys.argv[2] == "1")
+index.search(np.zeros((1, index.d), dtype="float32"), 1)
+print(anon_kb() - before)
+"""
+
+
+def private_memory_mb(index_path, mmap):
+    """Private memory (MB) of a worker that loads the index; None where /proc is unavailable"""
+    if not os.path.exists("/proc/self/status"):
+        return None
+    result = subprocess.run([sys.executable, "-c", PRIVATE_MEMORY_SCRIPT, index_path, "1" if mmap else "0"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Could not measure the memory of {index_path}: {result.stderr.strip()}", file=sys.stderr)
+        return None
+    return int(result.stdout.split()[-1]) / 1024
+
+
+def overlap(found, reference):
+    k = reference.shape[1]
+    return float(np.mean([len(np.intersect1d(f, r)) / k for f, r in zip(found, reference)]))
+
+
+def percentiles(latencies):
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95))}
+
+
+def run(vectorstore_dir, model_name, corpus_size, n_queries, k, quantization=None):
+    texts, queries = load_sample(vectorstore_dir, corpus_size, n_queries)
+    print(f"Corpus: {len(texts)} chunks, {len(queries)} queries, k={k}")
+
+    float_model = SentenceTransformer(model_name)
+    corpus = np.asarray(float_model.encode(texts, batch_size=64, show_progress_bar=True), dtype="float32")
+
+    float_mb = sum(p.numel() * p.element_size() for p in float_model.parameters()) / 2**20
+    encoders = {"float32": (float_model, float_mb)}
+    info = read_index_info(vectorstore_dir)
+    if "query_encoder" in info:
+        int8_model, _ = load_query_encoder(model_name, "onnx-int8", vectorstore_dir, info)
+        int8_dir = os.path.join(vectorstore_dir, info["query_encoder"]["path"])
+        int8_file = os.path.join(int8_dir, info["query_encoder"]["file_name"])
+    else:
+        int8_dir = tempfile.mkdtemp(prefix="bg3_query_encoder_")
+        file_name = export_int8_encoder(model_name, int8_dir, quantization)
+        int8_model = SentenceTransformer(int8_dir, backend="onnx", model_kwargs={"file_name": file_name})
+        int8_file = os.path.join(int8_dir, file_name)
+    encoders["onnx-int8"] = (int8_model, os.path.getsize(int8_file) / 2**20)
+
+    results = {"corpus": len(texts), "queries": len(queries), "k": k, "encoders": {}, "indexes": {}, "overlap": {}}
+    query_vectors = {}
+    for name, (model, size_mb) in encoders.items():
+        query_vectors[name], latencies = time_encoder(model, queries)
+        results["encoders"][name] = dict(percentiles(latencies), weights_mb=size_mb)
+
+    reference = None
+    index_dir = tempfile.mkdtemp(prefix="bg3_quantization_")
+    for index_type in ("flat", "sq8", "fp16"):
+        index = build_index(corpus, index_type)
+        index_path = os.path.join(index_dir, f"{index_type}.index")
+        faiss.write_index(index, index_path)
+        size_mb = os.path.getsize(index_path) / 2**20
+        memory = {"private_mb": private_memory_mb(index_path, mmap=False),
+                  "private_mmap_mb": private_memory_mb(index_path, mmap=True)}
+        search_latencies = None
+        for encoder_name, vectors in query_vectors.items():
+            found, latencies = time_search(index, vectors, k)
+            if reference is None:
+                reference = found
+            if encoder_name == "float32":
+                search_latencies = latencies
+            results["overlap"][f"{index_type}+{encoder_name}"] = overlap(found, reference)
+        results["indexes"][index_type] = dict(percentiles(search_latencies), index_mb=size_mb, **memory)
+    return results
+
+
+def print_report(results):
+    print("\nQuery encoder      p50 ms   p95 ms   weights MB")
+    for name, r in results["encoders"].items():
+        print(f"  {name:<15} {r['p50_ms']:>7.2f}  {r['p95_ms']:>7.2f}  {r['weights_mb']:>11.1f}")
+    print(f"\nIndex              p50 ms   p95 ms   index MB{'private MB':>13}{'mmap priv MB':>13}")
+    for name, r in results["indexes"].items():
+        memory = "".join(f"{r[key]:>13.2f}" if r[key] is not None else f"{'n/a':>13}"
+                         for key in ("private_mb", "private_mmap_mb"))
+        print(f"  {name:<15} {r['p50_ms']:>7.3f}  {r['p95_ms']:>7.3f}  {r['index_mb']:>9.2f}{memory}")
+    print("  (private MB: memory each API worker needs for the index, without and with INDEX_MMAP)")
+    print(f"\nOverlap@{results['k']} with flat+float32")
+    for name, value in results["overlap"].items():
+        print(f"  {name:<22} {value:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantized vs float32 retrieval benchmark")
+    parser.add_argument("--vectorstore", default=VECTORSTORE_DIR)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--corpus-size", type=int, default=5000, help="Chunks sampled from the vectorstore")
+    parser.add_argument("--queries", type=int, default=200, help="Distinct page titles used as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--quantization", default=None, help="ONNX quantization preset if an export is needed")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run(args.vectorstore, args.model, args.corpus_size, args.queries, args.k, args.quantization)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
@@ -0,0 +1,93 @@
+"""Request handling of src/api.py, against a small vectorstore and a fake LLM"""
+import json
+import pytest
+
+
+@pytest.mark.parametrize("body", [
+    {"query": "fire", "top_k": 0},
+    {"query": "fire", "top_k": -1},
+    {"query": "fire", "top_k": 100000},
+    {"query": "fire", "nprobe": 0},
+    {"query": "fire", "ef_search": -5},
+])
+def test_search_rejects_out_of_range_knobs(api, body):
+    _, client = api
+    assert client.post("/search", json=body).status_code == 422
+    batch = dict(body, queries=[body.pop("query")])
+    assert client.post("/search/batch", json=batch).status_code == 422
+
+
+@pytest.mark.parametrize("body", [{"limit": 0}, {"limit": 100000}, {"offset": -1}])
+def test_history_rejects_out_of_range_pages(api, body):
+    _, client = api
+    assert client.post("/history", json=body).status_code == 422
+
+
+def test_search_returns_top_k_hits(api):
+    _, client = api
+    for hybrid in (True, False):
+        response = client.post("/search", json={"query": "fire damage", "top_k": 2, "hybrid": hybrid})
+        assert response.status_code == 200
+        assert len(response.json()["results"]) == 2
+
+
+def stream_events(client, body):
+    response = client.post("/query/stream", json=body)
+    assert response.status_code == 200
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        name, data = block.split("\n", 1)
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_cached_stream_answers_carry_the_same_sources(api):
+    _, client = api
+    first = dict(stream_events(client, {"query": "Who is Karlach?"}))
+    second = dict(stream_events(client, {"query": "who is karlach?"}))
+    assert not first["done"]["cached"] and second["done"]["cached"]
+    assert first["sources"]["sources"]
+    assert second["sources"]["sources"] == first["sources"]["sources"]
+
+
+@pytest.mark.parametrize("stage", ["encode", "retrieve"])
+def test_stream_failures_before_the_answer_are_error_events(api, monkeypatch, stage):
+    module, client = api
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError(f"{stage} failed")
+
+    if stage == "encode":
+        monkeypatch.setattr(module.current_engine(), "aencode_queries", fail)
+    else:
+        monkeypatch.setattr(module, "aretrieve", fail)
+    events = stream_events(client, {"query": "Who is Karlach?"})
+    assert events[-1] == ("error", {"detail": f"{stage} failed"})
+    assert "done" not in dict(events)
+
+
+def test_persisted_answers_keep_their_sources(api):
+    from datetime import datetime, timedelta
+    from src.db import add_cached_answer, get_cached_answers
+
+    sources = [{"chunk_id": "Karlach_chunk_0", "content": "Karlach is a tiefling barbarian."}]
+    add_cached_answer("Who is Karlach?", "A tiefling.", b"\0" * 16, "persisted-version", sources)
+    entries = get_cached_answers("persisted-version", datetime.now() - timedelta(minutes=1))
+    assert entries[0]["sources"] == sources
+
+
+def test_admin_reload_is_disabled_without_a_token(api, monkeypatch):
+    module, client = api
+    monkeypatch.setattr(module, "ADMIN_TOKEN", None)
+    assert client.post("/admin/reload").status_code == 404
+    assert client.post("/admin/reload", headers={"X-Admin-Token": ""}).status_code == 404
+
+
+def test_admin_reload_requires_the_token(api, monkeypatch):
+    module, client = api
+    monkeypatch.setattr(module, "ADMIN_TOKEN", "secret")
+    assert client.post("/admin/reload").status_code == 403
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.post("/admin/reload", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["index_version"] == module.current_engine().version
@@ -0,0 +1,74 @@
+"""Unit tests for the query encode micro-batcher (src/batcher.py)"""
+import asyncio
+import threading
+import numpy as np
+import pytest
+
+from src.batcher import MicroBatcher
+
+
+def fake_encode(texts):
+    return np.array([[float(len(text)), 1.0] for text in texts], dtype="float32")
+
+
+@pytest.fixture
+def batcher():
+    batcher = MicroBatcher(fake_encode, max_batch_size=8, max_wait_ms=50)
+    yield batcher
+    batcher.close()
+
+
+def test_encode_returns_one_vector_per_text(batcher):
+    embeddings = batcher.encode(["a", "bbb"])
+    assert [embedding[0] for embedding in embeddings] == [1.0, 3.0]
+
+
+def test_concurrent_encodes_share_a_batch(batcher):
+    results = {}
+
+    def worker(text):
+        results[text] = batcher.encode([text])[0]
+
+    threads = [threading.Thread(target=worker, args=("x" * n,)) for n in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {text: embedding[0] for text, embedding in results.items()} == {"x": 1, "xx": 2, "xxx": 3, "xxxx": 4}
+    assert batcher.stats()["batches"] < 4
+
+
+def test_cancelled_aencode_does_not_stop_the_batcher(batcher):
+    async def cancel_mid_window():
+        task = asyncio.create_task(batcher.aencode(["cancelled"]))
+        # Let the request reach the queue, then cancel it while the batcher
+        # is still waiting for the window to fill
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_mid_window())
+    # Wait past the batch window, so the cancelled request has been handled
+    threading.Event().wait(0.1)
+    assert batcher._thread.is_alive()
+    assert batcher.encode(["after"])[0][0] == 5.0
+    assert asyncio.run(batcher.aencode(["again"]))[0][0] == 5.0
+
+
+def test_encoder_errors_reach_the_caller_and_batcher_keeps_running():
+    calls = []
+
+    def flaky_encode(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            raise ValueError("boom")
+        return fake_encode(texts)
+
+    batcher = MicroBatcher(flaky_encode, max_batch_size=8, max_wait_ms=1)
+    try:
+        with pytest.raises(ValueError):
+            batcher.encode(["first"])
+        assert batcher.encode(["second"])[0][0] == 6.0
+    finally:
+        batcher.close()
@@ -0,0 +1,73 @@
+"""In-process caches of src/cache.py"""
+import numpy as np
+
+from src.cache import QueryEmbeddingCache, SemanticAnswerCache
+
+
+def vector(*values):
+    return np.array(values, dtype="float32")
+
+
+def test_query_embedding_cache_normalizes_keys_and_evicts_lru():
+    cache = QueryEmbeddingCache(maxsize=2)
+    cache.put("Who is  Karlach?", vector(1, 0))
+    cache.put("fireball", vector(0, 1))
+    assert cache.get("who is karlach?") is not None
+    cache.put("grymforge", vector(1, 1))
+    assert cache.get("fireball") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_answer_cache_hits_similar_queries_on_the_same_version():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.add("Who is Karlach?", vector(1, 0, 0), "A tiefling.", "v1")
+    hit = cache.lookup(vector(1, 0.05, 0), "v1")
+    assert hit["answer"] == "A tiefling." and hit["similarity"] > 0.95
+    assert cache.lookup(vector(0, 1, 0), "v1") is None
+    assert cache.lookup(vector(1, 0, 0), "v2") is None
+
+
+def test_answer_cache_ignores_entries_of_a_model_with_another_dimension():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.add("Who is Karlach?", vector(1, 0, 0), "A tiefling.", "old-model")
+    # After a reload to a model with a different dimension
+    assert cache.lookup(vector(1, 0, 0, 0, 0), "new-model") is None
+    cache.add("Who is Karlach?", vector(1, 0, 0, 0, 0), "A barbarian.", "new-model")
+    assert cache.lookup(vector(1, 0, 0, 0, 0), "new-model")["answer"] == "A barbarian."
+    assert cache.lookup(vector(1, 0, 0), "old-model")["answer"] == "A tiefling."
+
+
+def test_answer_cache_expires_and_evicts():
+    cache = SemanticAnswerCache(maxsize=1, ttl=60)
+    cache.add("old", vector(1, 0), "old answer", "v1", created_at=0)
+    assert cache.lookup(vector(1, 0), "v1") is None
+    assert cache.stats()["expirations"] == 1
+    cache.add("a", vector(1, 0), "a", "v1")
+    cache.add("b", vector(0, 1), "b", "v1")
+    assert cache.lookup(vector(1, 0), "v1") is None
+    assert cache.lookup(vector(0, 1), "v1")["answer"] == "b"
+
+
+def test_answer_cache_expires_entries_moved_by_hits(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.cache.time.time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    cache.add("first", vector(1, 0, 0), "first answer", "v1")
+    now[0] += 30
+    cache.add("second", vector(0, 1, 0), "second answer", "v1")
+    # The hit makes "first" the most recently used entry, but not the newest
+    assert cache.lookup(vector(1, 0, 0), "v1")["answer"] == "first answer"
+    now[0] += 45
+    assert cache.lookup(vector(1, 0, 0), "v1") is None
+    assert cache.lookup(vector(0, 1, 0), "v1")["answer"] == "second answer"
+    assert cache.stats()["expirations"] == 1 and cache.stats()["size"] == 1
+
+
+def test_answer_cache_does_not_serve_expired_entries_warmed_late(monkeypatch):
+    monkeypatch.setattr("src.cache.time.time", lambda: 1000.0)
+    cache = SemanticAnswerCache(ttl=60)
+    cache.add("live", vector(0, 1, 0), "live answer", "v1")
+    # Warmed after a live entry, with an older creation time
+    cache.add("stored", vector(1, 0, 0), "stored answer", "v1", created_at=900.0)
+    assert cache.lookup(vector(1, 0, 0), "v1") is None
+    assert cache.lookup(vector(0, 1, 0), "v1")["answer"] == "live answer"
@@ -0,0 +1,70 @@
+"""Context assembly of src/context.py"""
+from langchain_core.documents import Document
+
+from src.context import (ContextAssembler, estimate_tokens, join_chunks, parse_chunk_id, truncate_to_tokens,
+                         CHARS_PER_TOKEN)
+
+PAGE = ("Karlach was a soldier of Avernus who escaped with an infernal engine in her chest. "
+        "She joins the party near the beach after the nautiloid crash, hunted by paladins of Tyr. "
+        "Her engine burns hotter as the story goes on, and only a rare metal can keep it in check.")
+
+
+def doc(chunk_id, text):
+    return Document(page_content=text, metadata={"chunk_id": chunk_id, "title": chunk_id.split("_chunk_")[0]})
+
+
+def distinct_text(i, words):
+    """Text with no shingles in common with distinct_text(j) for j != i"""
+    return " ".join(f"p{i}w{j}" for j in range(words))
+
+
+def test_parse_chunk_id():
+    assert parse_chunk_id("Lae'zel_chunk_12") == ("Lae'zel", 12)
+    assert parse_chunk_id("no-index") == ("no-index", None)
+
+
+def test_join_chunks_removes_the_overlap():
+    left, right = PAGE[:120], PAGE[70:200]
+    assert join_chunks(left, right) == PAGE[:200]
+    # No real overlap: the chunks are joined on a new line
+    assert join_chunks("First part.", "Second part.") == "First part.\nSecond part."
+
+
+def test_consecutive_chunks_of_a_page_are_merged():
+    docs = [doc("Karlach_chunk_1", PAGE[70:200]), doc("Fireball_chunk_0", "Fireball is a spell."),
+            doc("Karlach_chunk_0", PAGE[:120])]
+    passages = ContextAssembler(max_tokens=0).merge_adjacent(docs)
+    assert [(rank, d.page_content) for rank, d in passages] == [(0, PAGE[:200]), (1, "Fireball is a spell.")]
+    assert passages[0][1].metadata["chunk_ids"] == ["Karlach_chunk_0", "Karlach_chunk_1"]
+
+
+def test_near_duplicates_are_dropped():
+    assembler = ContextAssembler(max_tokens=0, dedup_threshold=0.8)
+    docs = [doc("Karlach_chunk_0", PAGE), doc("Karlach_copy_chunk_0", PAGE.replace("soldier", "warrior")),
+            doc("Fireball_chunk_0", "Fireball is a third level evocation spell.")]
+    assert [d.metadata["chunk_id"] for d in assembler.assemble(docs)] == ["Karlach_chunk_0", "Fireball_chunk_0"]
+    assert assembler.stats()["deduplicated"] == 1
+
+
+def test_passages_are_packed_into_the_token_budget():
+    passages = [doc(f"Page{i}_chunk_0", distinct_text(i, 150)) for i in range(4)]
+    assembler = ContextAssembler(max_tokens=400)
+    packed = assembler.assemble(passages)
+    assert sum(estimate_tokens(d.page_content) for d in packed) <= 400
+    # Best-ranked passages first; the one that did not fit is cut, the rest dropped
+    assert [d.metadata["chunk_id"] for d in packed] == ["Page0_chunk_0", "Page1_chunk_0"]
+    assert packed[-1].metadata["truncated"] and not packed[0].metadata.get("truncated")
+    stats = assembler.stats()
+    assert (stats["truncated"], stats["dropped"]) == (1, 2)
+    assert stats["output_tokens"] < stats["input_tokens"]
+
+
+def test_zero_budget_keeps_everything():
+    passages = [doc(f"Page{i}_chunk_0", distinct_text(i, 500)) for i in range(3)]
+    assert len(ContextAssembler(max_tokens=0).assemble(passages)) == 3
+
+
+def test_truncation_prefers_a_sentence_end():
+    text = "First sentence here. Second sentence is a lot longer than the first one."
+    cut = truncate_to_tokens(text, 35 // CHARS_PER_TOKEN)
+    assert cut == "First sentence here."
@@ -0,0 +1,61 @@
+"""Write-behind conversation logging (src/db.py ConversationWriter)"""
+import threading
+
+from src.db import ConversationWriter
+
+
+class RecordingWrite:
+    def __init__(self, fail_first=False):
+        self.batches = []
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            if self.fail_first:
+                self.fail_first = False
+                raise RuntimeError("database is down")
+            self.batches.append([row["query"] for row in rows])
+
+
+def test_rows_are_written_in_batches_and_flushed_on_close():
+    write = RecordingWrite()
+    writer = ConversationWriter(batch_size=3, flush_interval=5.0, write=write)
+    writer.start()
+    for i in range(7):
+        assert writer.enqueue(f"q{i}", "answer", session_id="s")
+    writer.close()
+    assert [query for batch in write.batches for query in batch] == [f"q{i}" for i in range(7)]
+    assert all(len(batch) <= 3 for batch in write.batches)
+    stats = writer.stats()
+    assert (stats["written"], stats["dropped"], stats["failed"]) == (7, 0, 0)
+
+
+def test_partial_batches_are_flushed_after_the_interval():
+    write = RecordingWrite()
+    writer = ConversationWriter(batch_size=100, flush_interval=0.05, write=write)
+    writer.start()
+    writer.enqueue("q", "answer")
+    try:
+        for _ in range(100):
+            if write.batches:
+                break
+            threading.Event().wait(0.01)
+        assert write.batches == [["q"]]
+    finally:
+        writer.close()
+
+
+def test_full_queue_drops_and_failed_writes_are_counted():
+    write = RecordingWrite(fail_first=True)
+    writer = ConversationWriter(batch_size=10, flush_interval=0.01, max_queue=2, write=write)
+    assert writer.enqueue("a", "answer") and writer.enqueue("b", "answer")
+    assert not writer.enqueue("c", "answer")
+    writer.start()
+    writer.close()
+    writer.enqueue("d", "answer")
+    writer.start()
+    writer.close()
+    stats = writer.stats()
+    assert (stats["dropped"], stats["failed"], stats["written"]) == (1, 2, 1)
+    assert write.batches == [["d"]]
@@ -0,0 +1,110 @@
+"""Database helpers of src/db.py, against in-memory SQLite"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import inspect, text
+
+from src import db
+
+
+@pytest.fixture
+def database():
+    db.init_db()
+    yield db
+    session = db.SessionLocal()
+    try:
+        session.query(db.CachedAnswer).delete()
+        session.query(db.Conversation).delete()
+        session.commit()
+    finally:
+        session.close()
+
+
+def cached_queries(index_version, since=datetime.min):
+    return sorted(entry["query"] for entry in db.get_cached_answers(index_version, since))
+
+
+def add_answer(query, index_version, created_at):
+    db.add_cached_answer(query, "answer", b"\0" * 16, index_version)
+    session = db.SessionLocal()
+    try:
+        session.query(db.CachedAnswer).filter(db.CachedAnswer.query == query).update({"created_at": created_at})
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_answer_cache_table_is_indexed_by_version_and_age(database):
+    indexes = {index["name"]: index["column_names"] for index in inspect(db.engine).get_indexes("answer_cache")}
+    assert indexes["ix_answer_cache_index_version_created_at"] == ["index_version", "created_at"]
+    assert indexes["ix_answer_cache_created_at"] == ["created_at"]
+
+
+def test_inserting_an_answer_deletes_expired_ones(database):
+    now = datetime.now()
+    add_answer("expired", "v1", now - timedelta(hours=2))
+    add_answer("expired other version", "v0", now - timedelta(hours=2))
+    add_answer("live", "v1", now - timedelta(minutes=5))
+    db.add_cached_answer("new", "answer", b"\0" * 16, "v1", expire_before=now - timedelta(hours=1))
+    assert cached_queries("v1") == ["live", "new"]
+    assert cached_queries("v0") == []
+
+
+def test_pruning_keeps_only_live_answers_of_the_current_version(database):
+    now = datetime.now()
+    add_answer("old version", "v1", now)
+    add_answer("expired", "v2", now - timedelta(hours=2))
+    add_answer("live", "v2", now)
+    assert db.prune_cached_answers("v2", now - timedelta(hours=1)) == 2
+    assert cached_queries("v1") == []
+    assert cached_queries("v2") == ["live"]
+
+
+def add_conversations_at(timestamp, count, session_id="s1"):
+    db.add_conversations([{"query": f"q{i}", "response": "r", "timestamp": timestamp, "session_id": session_id}
+                          for i in range(count)])
+
+
+def test_history_pages_through_equal_timestamps_without_gaps(database, api):
+    _, client = api
+    now = datetime(2026, 1, 1, 12)
+    add_conversations_at(now, 7)
+    add_conversations_at(now - timedelta(minutes=1), 3)
+    add_conversations_at(now, 4, session_id="other")
+    seen, body = [], {"session_id": "s1", "limit": 3}
+    while True:
+        page = client.post("/history", json=body).json()
+        seen.extend(page["history"])
+        if page["next_cursor"] is None:
+            break
+        body = {"session_id": "s1", "limit": 3, **page["next_cursor"]}
+    ids = [conv["id"] for conv in seen]
+    assert len(ids) == len(set(ids)) == 10
+    assert {conv["session_id"] for conv in seen} == {"s1"}
+    assert [(conv["timestamp"], conv["id"]) for conv in seen] == sorted(
+        ((conv["timestamp"], conv["id"]) for conv in seen), reverse=True)
+
+
+def test_timestamp_only_cursor_returns_strictly_older_rows(database):
+    now = datetime(2026, 1, 1, 12)
+    add_conversations_at(now, 2)
+    add_conversations_at(now - timedelta(minutes=1), 2)
+    history = db.get_conversation_history(limit=10, before_timestamp=now)
+    assert len(history) == 2
+    assert all(conv["timestamp"] == (now - timedelta(minutes=1)).isoformat() for conv in history)
+
+
+@pytest.mark.parametrize("column, index", [
+    ("session_id", "ix_conversations_session_id_timestamp"),
+    ("user_id", "ix_conversations_user_id_timestamp"),
+])
+def test_keyset_pages_seek_the_composite_indexes(database, column, index):
+    indexes = {index["name"]: index["column_names"] for index in inspect(db.engine).get_indexes("conversations")}
+    assert indexes[index] == [column, "timestamp", "id"]
+    assert indexes["ix_conversations_timestamp"] == ["timestamp", "id"]
+    with db.engine.connect() as conn:
+        plan = conn.execute(text(
+            f"EXPLAIN QUERY PLAN SELECT * FROM conversations WHERE {column} = :value "
+            "AND (timestamp, id) < (:timestamp, :id) ORDER BY timestamp DESC, id DESC LIMIT 10"
+        ), {"value": "s1", "timestamp": datetime(2026, 1, 1), "id": 5}).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert index in details and "TEMP B-TREE" not in details
@@ -0,0 +1,64 @@
+"""Chunk output layouts of src/embedder.py"""
+import os
+import re
+import json
+import pytest
+
+from src.embedder import chunk_json_files, iter_chunk_docs, count_chunk_docs, SHARD_PATTERN
+
+
+@pytest.fixture
+def parsed_dir(tmp_path):
+    parsed = tmp_path / "parsed"
+    parsed.mkdir()
+    for name in ("Fireball", "Karlach", "Grymforge"):
+        doc = {"title": name, "url": f"https://bg3.wiki/wiki/{name}", "tags": ["Test"],
+               "content": f"{name} " * 150}
+        (parsed / f"{name}.json").write_text(json.dumps(doc), encoding="utf-8")
+    return str(parsed)
+
+
+def chunk_ids(chunk_dir):
+    return [doc["chunk_id"] for doc in iter_chunk_docs(chunk_dir)]
+
+
+@pytest.mark.parametrize("first, second", [("json", "jsonl"), ("jsonl", "json")])
+def test_rechunking_in_another_format_does_not_duplicate_chunks(tmp_path, parsed_dir, first, second):
+    out = str(tmp_path / "chunked")
+    expected = chunk_json_files(parsed_dir, out, output_format=first, shard_size=2)["chunks"]
+    chunk_json_files(parsed_dir, out, output_format=second, shard_size=2)
+    ids = chunk_ids(out)
+    assert len(ids) == len(set(ids)) == expected == count_chunk_docs(out)
+    has_shards = os.path.exists(os.path.join(out, SHARD_PATTERN.format(0)))
+    assert has_shards == (second == "jsonl")
+
+
+def test_shards_take_precedence_over_per_chunk_files(tmp_path, parsed_dir):
+    out = str(tmp_path / "chunked")
+    chunk_json_files(parsed_dir, out, output_format="jsonl")
+    # A stray per-chunk file, e.g. copied in by hand
+    with open(os.path.join(out, "Stray_chunk_0.json"), "w", encoding="utf-8") as f:
+        json.dump({"chunk_id": "Stray_chunk_0", "content": "stray"}, f)
+    assert "Stray_chunk_0" not in chunk_ids(out)
+
+
+class WordTokenizer:
+    """Whitespace stand-in for the MiniLM tokenizer: one token per word"""
+
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False):
+        return {"offset_mapping": [match.span() for match in re.finditer(r"\S+", text)]}
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl"])
+def test_rechunking_with_fewer_chunks_leaves_no_stale_chunks(monkeypatch, tmp_path, parsed_dir, output_format):
+    monkeypatch.setattr("src.embedder._tokenizer", WordTokenizer())
+    out = str(tmp_path / "chunked")
+    chars = chunk_json_files(parsed_dir, out, output_format=output_format, strategy="chars")
+    tokens = chunk_json_files(parsed_dir, out, output_format=output_format, strategy="tokens")
+    # 150 words fit one token-budget chunk per page, where chars made several
+    assert tokens["chunks"] == tokens["pages"] == 3 < chars["chunks"]
+    assert sorted(chunk_ids(out)) == ["Fireball_chunk_0", "Grymforge_chunk_0", "Karlach_chunk_0"]
+    assert count_chunk_docs(out) == 3
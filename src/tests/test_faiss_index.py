@@ -0,0 +1,125 @@
+"""FAISS index types, per-call search parameters and evaluation (src/faiss_index.py)"""
+import numpy as np
+import faiss
+import pytest
+
+from src.faiss_index import (
+    INDEX_TYPES, base_index, build_index, create_index, describe_index, evaluate_index, format_report,
+    search_parameters, supports_removal,
+)
+
+DIM = 32
+# Recall@10 of each type against exact search, probing every IVF list
+MIN_RECALL = {"flat": 1.0, "ivf_flat": 1.0, "ivf_pq": 0.5, "hnsw": 0.95, "sq8": 0.95, "fp16": 0.99}
+# 16 PQ centroids per sub-quantizer train quickly on the small corpus
+INDEX_KWARGS = {"ivf_pq": {"pq_nbits": 4}}
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    return np.random.default_rng(0).standard_normal((1000, DIM)).astype("float32")
+
+
+@pytest.fixture(scope="module")
+def indexes(embeddings):
+    return {index_type: build_index(embeddings, index_type, **INDEX_KWARGS.get(index_type, {}))
+            for index_type in INDEX_TYPES}
+
+
+def nprobe_all(index):
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf.nlist if ivf is not None else None
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_every_index_type_finds_the_nearest_vectors(indexes, embeddings, index_type):
+    index = indexes[index_type]
+    assert index.is_trained and index.ntotal == len(embeddings)
+    report = evaluate_index(index, embeddings, k=10, n_queries=100, nprobe=nprobe_all(index))
+    assert report["recall_at_k"] >= MIN_RECALL[index_type]
+    assert report["queries"] == 100 and report["k"] == 10
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_indexes_return_the_given_ids(embeddings, index_type):
+    ids = np.arange(len(embeddings), dtype="int64") * 3 + 1000
+    index = build_index(embeddings, index_type, ids=ids, **INDEX_KWARGS.get(index_type, {}))
+    _, found = index.search(embeddings[:20], 1, params=search_parameters(index, nprobe=nprobe_all(index)))
+    assert set(found[:, 0]) <= set(ids)
+    if index_type != "ivf_pq":
+        assert np.array_equal(found[:, 0], ids[:20])
+
+
+def test_describe_index_reports_the_tuning_parameters(indexes):
+    assert describe_index(indexes["flat"])["wraps"] == "IndexFlatL2"
+    assert describe_index(indexes["ivf_flat"])["nprobe"] == 8
+    assert describe_index(indexes["ivf_pq"])["pq_nbits"] == 4
+    assert describe_index(indexes["hnsw"])["ef_search"] == 64
+    assert describe_index(indexes["sq8"])["sq_type"] == "sq8"
+    assert describe_index(indexes["fp16"])["sq_type"] == "fp16"
+
+
+@pytest.mark.parametrize("index_type", ["flat", "sq8", "fp16"])
+def test_search_parameters_without_knobs_for_exact_indexes(indexes, index_type):
+    index = indexes[index_type]
+    assert search_parameters(index, nprobe=4, ef_search=16) is None
+    selector = faiss.IDSelectorRange(0, 10)
+    params = search_parameters(index, nprobe=4, selector=selector)
+    assert type(params) is faiss.SearchParameters
+    _, found = index.search(np.zeros((1, DIM), dtype="float32"), 20, params=params)
+    assert set(found[0]) == set(range(10)) | {-1}
+
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "ivf_pq"])
+def test_search_parameters_set_nprobe_per_call(indexes, index_type):
+    index = indexes[index_type]
+    assert search_parameters(index, ef_search=16) is None
+    params = search_parameters(index, nprobe=3)
+    assert isinstance(params, faiss.SearchParametersIVF) and params.nprobe == 3
+    # A selector alone keeps the index's nprobe
+    params = search_parameters(index, selector=faiss.IDSelectorRange(0, 10))
+    assert params.nprobe == faiss.try_extract_index_ivf(index).nprobe == 8
+    _, found = index.search(np.zeros((1, DIM), dtype="float32"), 5, params=params)
+    assert all(0 <= row < 10 or row == -1 for row in found[0])
+
+
+def test_search_parameters_set_ef_search_per_call(indexes):
+    index = indexes["hnsw"]
+    assert search_parameters(index, nprobe=4) is None
+    params = search_parameters(index, ef_search=16)
+    assert isinstance(params, faiss.SearchParametersHNSW) and params.efSearch == 16
+    params = search_parameters(index, selector=faiss.IDSelectorRange(0, 10))
+    assert params.efSearch == base_index(index).hnsw.efSearch == 64
+    _, found = index.search(np.zeros((1, DIM), dtype="float32"), 5, params=params)
+    assert all(0 <= row < 10 or row == -1 for row in found[0])
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_supports_removal_matches_remove_ids(embeddings, index_type):
+    index = build_index(embeddings, index_type, **INDEX_KWARGS.get(index_type, {}))
+    removed = np.arange(10, dtype="int64")
+    if index_type == "hnsw":
+        assert not supports_removal(index)
+        with pytest.raises(RuntimeError):
+            index.remove_ids(faiss.IDSelectorBatch(removed))
+        return
+    assert supports_removal(index)
+    assert index.remove_ids(faiss.IDSelectorBatch(removed)) == len(removed)
+    assert index.ntotal == len(embeddings) - len(removed)
+    _, found = index.search(embeddings[:10], 5, params=search_parameters(index, nprobe=nprobe_all(index)))
+    assert not set(found.ravel()) & set(removed)
+
+
+def test_invalid_index_settings_are_rejected(embeddings):
+    with pytest.raises(ValueError, match="Unknown index type"):
+        create_index(DIM, "lsh")
+    with pytest.raises(ValueError, match="must divide"):
+        create_index(DIM, "ivf_pq", pq_m=7)
+    with pytest.raises(ValueError, match="at least 256 vectors"):
+        build_index(embeddings[:100], "ivf_pq")
+
+
+def test_format_report():
+    report = {"k": 10, "queries": 200, "nprobe": 4, "ef_search": None,
+              "recall_at_k": 0.9876, "p50_ms": 0.1234, "p99_ms": 1.5}
+    assert format_report(report) == "recall@10=0.988 p50=0.123ms p99=1.500ms over 200 queries (nprobe=4)"
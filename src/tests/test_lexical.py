@@ -0,0 +1,92 @@
+"""BM25 inverted index (src/lexical.py)"""
+import math
+from collections import Counter
+import numpy as np
+import pytest
+
+from src import lexical
+from src.lexical import build_lexical_index, load_lexical_index, tokenize
+
+TEXTS = [
+    "How to recruit Karlach in Avernus",
+    "Karlach Karlach is a tiefling barbarian",
+    None,  # freed row
+    "How to get to the Underdark and Grymforge",
+    "Fireball is a spell to deal fire damage",
+    "The Everburn Blade deals fire damage and fire damage to the undead",
+    "How to find the Everburn Blade",
+]
+
+
+def bm25(texts, query):
+    """Reference BM25 scores over every row"""
+    docs = [tokenize(text or "") for text in texts]
+    live = [doc for doc in docs if doc]
+    avg = sum(map(len, live)) / len(live)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(term in doc for doc in docs)
+        if not df:
+            continue
+        idf = math.log(1 + (len(live) - df + 0.5) / (df + 0.5))
+        for row, doc in enumerate(docs):
+            tf = Counter(doc)[term]
+            if tf:
+                norm = lexical.BM25_K1 * (1 - lexical.BM25_B + lexical.BM25_B * len(doc) / avg)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (lexical.BM25_K1 + 1) / (tf + norm)
+    return scores
+
+
+@pytest.fixture
+def index(tmp_path):
+    build_lexical_index(str(tmp_path), TEXTS)
+    index = load_lexical_index(str(tmp_path))
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize("query", ["Karlach", "fire damage", "Everburn Blade Grymforge"])
+def test_scores_match_bm25(index, query):
+    rows, scores = index.search(query, top_k=10)
+    expected = bm25(TEXTS, query)
+    assert dict(zip(rows.tolist(), scores.tolist())) == pytest.approx(expected)
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_postings_are_impact_ordered(index):
+    term_id = index.term_id("fire")
+    start, end = int(index.offsets[term_id]), int(index.offsets[term_id + 1])
+    # Row 5 has "fire" twice, row 4 once
+    assert index.rows[start:end].tolist() == [5, 4]
+    assert index.tfs[start:end].tolist() == [2, 1]
+
+
+def test_stopwords_and_common_terms_are_skipped(index, monkeypatch):
+    rows, scores = index.search("how to recruit Karlach", top_k=10)
+    expected_rows, expected_scores = index.search("recruit Karlach", top_k=10)
+    assert rows.tolist() == expected_rows.tolist()
+    assert scores == pytest.approx(expected_scores)
+
+    # "everburn" and "blade" are in 2 of 6 documents
+    monkeypatch.setattr(lexical, "LEXICAL_MAX_DF", 0.3)
+    assert index.search("Everburn blade Grymforge", top_k=10)[0].tolist() == [3]
+
+
+def test_query_of_only_skipped_terms_keeps_the_rarest(index):
+    # "how" is in 3 documents, "to" in 5
+    assert sorted(index.search("how to", top_k=10)[0].tolist()) == [0, 3, 6]
+
+
+def test_postings_per_term_are_capped_best_first(index, monkeypatch):
+    monkeypatch.setattr(lexical, "LEXICAL_MAX_POSTINGS", 1)
+    assert index.search("fire", top_k=10)[0].tolist() == [5]
+    assert index.search("Karlach", top_k=10)[0].tolist() == [1]
+
+
+def test_empty_corpus(tmp_path):
+    build_lexical_index(str(tmp_path), [])
+    index = load_lexical_index(str(tmp_path))
+    rows, scores = index.search("Karlach")
+    assert len(rows) == len(scores) == 0
+    assert isinstance(rows, np.ndarray)
+    index.close()
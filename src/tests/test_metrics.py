@@ -0,0 +1,87 @@
+"""Stage timings, TimingMiddleware and the Prometheus exposition (src/metrics.py)"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.metrics import Histogram, MetricsRegistry, TimingMiddleware, record, span, current_timings
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "encode")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="encode",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="encode",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="encode",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="encode"} 3' in lines
+
+
+def test_failing_collectors_are_skipped():
+    registry = MetricsRegistry()
+    registry.collector(lambda: [("test_gauge", "gauge", "A gauge", [({"kind": "a"}, 2)])])
+
+    @registry.collector
+    def broken():
+        raise RuntimeError("unavailable")
+
+    assert 'test_gauge{kind="a"} 2.0' in registry.render()
+
+
+def test_timings_outside_a_request_only_feed_the_histograms():
+    with span("encode"):
+        pass
+    assert current_timings() == {}
+
+
+def app_with_middleware(**kwargs):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        with span("encode"):
+            pass
+        record("faiss_search", 0.002)
+        return {"timings": current_timings()}
+
+    app.add_middleware(TimingMiddleware, **kwargs)
+    return app
+
+
+def test_server_timing_header_only_when_requested():
+    client = TestClient(app_with_middleware())
+    response = client.get("/items/1")
+    assert "server-timing" not in response.headers
+    # The handler sees its own stages, and nothing leaks between requests
+    assert set(response.json()["timings"]) == {"encode", "faiss_search"}
+
+    response = client.get("/items/2", headers={"X-Debug-Timing": "1"})
+    header = response.headers["server-timing"]
+    assert header.startswith("encode;dur=") and "faiss_search;dur=2.000" in header and "total;dur=" in header
+    assert "server-timing" not in client.get("/items/3", headers={"X-Debug-Timing": "0"}).headers
+
+
+def request_count(endpoint, status):
+    from src.metrics import request_seconds
+
+    prefix = f'bg3_request_duration_seconds_count{{endpoint="{endpoint}",method="GET",status="{status}"}} '
+    return next((int(line[len(prefix):]) for line in request_seconds.render() if line.startswith(prefix)), 0)
+
+
+def test_request_histogram_is_labelled_by_route_template():
+    # The histogram is process-wide, so compare counts before and after
+    before = request_count("/items/{item_id}", 200), request_count("unmatched", 404)
+    client = TestClient(app_with_middleware())
+    client.get("/items/41")
+    client.get("/items/42")
+    client.get("/missing")
+    assert request_count("/items/{item_id}", 200) == before[0] + 2
+    assert request_count("unmatched", 404) == before[1] + 1
+
+
+def test_metrics_endpoint_and_debug_timing(api):
+    _, client = api
+    response = client.post("/search", json={"query": "Karlach", "top_k": 2}, headers={"X-Debug-Timing": "1"})
+    assert "faiss_search;dur=" in response.headers["server-timing"]
+    text = client.get("/metrics").text
+    assert 'bg3_stage_duration_seconds_count{stage="faiss_search"}' in text
+    assert 'endpoint="/search",method="POST",status="200"' in text
@@ -0,0 +1,86 @@
+"""Scalar-quantized indexes and query encoder selection (src/query_encoder.py)"""
+import os
+import faiss
+import pytest
+
+from src import query_encoder
+from src.faiss_index import base_index, build_index
+from src.query_encoder import QUERY_ENCODER_DIR, load_query_encoder
+from src.retriever import RetrievalEngine, read_index_info
+from src.vectorizer import INDEX_FILE, embed_and_store, streaming_build
+
+from helpers import CHUNKS, HashingEncoder, write_chunks
+
+
+@pytest.mark.parametrize("index_type, code_size", [("sq8", 1), ("fp16", 2)])
+def test_scalar_quantized_vectorstores_are_searchable(tmp_path, encoder, load_encoder, index_type, code_size):
+    chunk_dir, vectorstore_dir = str(tmp_path / "chunks"), str(tmp_path / "vectorstore")
+    write_chunks(chunk_dir)
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", index_type=index_type, model=encoder,
+                    eval_queries=0)
+    assert read_index_info(vectorstore_dir)["index"]["sq_type"] == index_type
+    index = base_index(faiss.read_index(os.path.join(vectorstore_dir, INDEX_FILE)))
+    assert isinstance(index, faiss.IndexScalarQuantizer)
+    assert index.code_size == code_size * encoder.dim
+
+    engine = RetrievalEngine(vectorstore_dir, model_name="hashing")
+    try:
+        for title, _, content in CHUNKS:
+            hits = engine.search(content, top_k=1, hybrid=False)
+            assert hits[0]["title"] == title and hits[0]["content"] == content
+    finally:
+        engine.close()
+
+
+def test_trained_sq8_indexes_report_it_through_the_id_map(encoder):
+    index = build_index(encoder.encode([content for _, _, content in CHUNKS]), "sq8")
+    assert index.is_trained and base_index(index).is_trained
+
+
+def test_streaming_sq8_builds_train_once(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr("src.vectorizer.SentenceTransformer", lambda name: HashingEncoder())
+    write_chunks(str(tmp_path / "chunks"))
+    index, rows, _ = streaming_build("hashing", str(tmp_path / "chunks"), str(tmp_path / "content.bin"), "sq8",
+                                     nlist=None, train_size=2, batch_size=2)
+    assert index.ntotal == len(rows) == len(CHUNKS)
+    assert capsys.readouterr().out.count("Training IndexScalarQuantizer") == 1
+
+
+class FakeSentenceTransformer:
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.kwargs = kwargs
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    monkeypatch.setattr(query_encoder, "SentenceTransformer", FakeSentenceTransformer)
+
+
+def test_float32_loads_the_model(loaded):
+    model, kind = load_query_encoder("all-MiniLM-L6-v2", "float32", "vectorstore", {})
+    assert (model.name, model.kwargs, kind) == ("all-MiniLM-L6-v2", {}, "float32")
+
+
+def test_onnx_int8_loads_the_export_of_the_vectorstore(loaded):
+    info = {"query_encoder": {"kind": "onnx-int8", "path": QUERY_ENCODER_DIR,
+                              "file_name": "onnx/model_qint8_avx2.onnx"}}
+    model, kind = load_query_encoder("all-MiniLM-L6-v2", "onnx-int8", "vectorstore", info)
+    assert kind == "onnx-int8"
+    assert model.name == os.path.join("vectorstore", QUERY_ENCODER_DIR)
+    assert model.kwargs == {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_qint8_avx2.onnx"}}
+
+
+@pytest.mark.parametrize("vectorstore_dir, info", [
+    ("vectorstore", {}),
+    (None, {"query_encoder": {"kind": "onnx-int8", "path": QUERY_ENCODER_DIR, "file_name": "model.onnx"}}),
+])
+def test_onnx_int8_without_an_export_falls_back_to_float32(loaded, capsys, vectorstore_dir, info):
+    model, kind = load_query_encoder("all-MiniLM-L6-v2", "onnx-int8", vectorstore_dir, info)
+    assert (model.name, model.kwargs, kind) == ("all-MiniLM-L6-v2", {}, "float32")
+    assert "--quantize-encoder" in capsys.readouterr().err
+
+
+def test_unknown_encoder_kinds_are_rejected(loaded):
+    with pytest.raises(ValueError, match="onnx-int8"):
+        load_query_encoder("all-MiniLM-L6-v2", "int4")
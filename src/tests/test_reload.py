@@ -0,0 +1,106 @@
+"""Hot swapping the retrieval engine (src/rag_pipeline.py reload_engine)"""
+import gc
+import json
+import os
+import socket
+import subprocess
+import sys
+import weakref
+import pytest
+
+from src import rag_pipeline
+from src.retriever import BUILD_MARKER_FILE, INDEX_INFO_FILE, build_in_progress
+
+
+@pytest.fixture
+def pipeline(monkeypatch, vectorstore, load_encoder):
+    monkeypatch.setattr(rag_pipeline, "vectorstore_dir", vectorstore)
+    monkeypatch.setattr(rag_pipeline, "_engine", None)
+    monkeypatch.setattr(rag_pipeline, "_retriever", None)
+    monkeypatch.setattr(rag_pipeline, "_qa_chain", None)
+    yield rag_pipeline
+    engine = rag_pipeline.current_engine()
+    if engine is not None:
+        engine.close()
+
+
+def test_superseded_engines_are_collectable(pipeline):
+    first = pipeline.load_engine()
+    batcher = first.batcher
+    refs = [weakref.ref(first)]
+    del first
+    for _ in range(2):
+        refs.append(weakref.ref(pipeline.reload_engine()))
+    gc.collect()
+    assert [ref() is None for ref in refs] == [True, True, False]
+    # The encoder and its batcher are reused by the new engine
+    assert pipeline.current_engine().batcher is batcher
+    assert pipeline.current_engine().search("fire damage spell", top_k=1)
+
+
+def test_model_change_stops_the_old_batcher(pipeline, vectorstore):
+    old = pipeline.load_engine()
+    info_path = os.path.join(vectorstore, INDEX_INFO_FILE)
+    with open(info_path, encoding="utf-8") as f:
+        info = json.load(f)
+    info["model_name"] = "another-model"
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+    new = pipeline.reload_engine()
+    assert new.batcher is not old.batcher
+    assert old.batcher.closed and not old.batcher._thread.is_alive()
+    # Requests still holding the old engine encode without the batcher
+    assert old.search("Karlach", top_k=1)[0]["title"] == "Karlach"
+
+
+def write_marker(vectorstore, **marker):
+    with open(os.path.join(vectorstore, BUILD_MARKER_FILE), "w", encoding="utf-8") as f:
+        json.dump(marker, f)
+
+
+def test_reload_is_refused_while_a_build_is_running(pipeline, vectorstore):
+    old = pipeline.load_engine()
+    write_marker(vectorstore, host=socket.gethostname(), pid=os.getpid())
+    with pytest.raises(RuntimeError, match="being rebuilt"):
+        pipeline.reload_engine()
+    # A build in another container cannot be checked and counts until it is done
+    write_marker(vectorstore, host="embed-container", pid=1)
+    with pytest.raises(RuntimeError, match="being rebuilt"):
+        pipeline.reload_engine()
+    assert pipeline.current_engine() is old
+
+    os.remove(os.path.join(vectorstore, BUILD_MARKER_FILE))
+    assert pipeline.reload_engine() is not old
+
+
+def test_stale_build_marker_of_a_dead_process_is_ignored(pipeline, vectorstore):
+    finished = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True, check=True)
+    write_marker(vectorstore, host=socket.gethostname(), pid=int(finished.stdout))
+    assert not build_in_progress(vectorstore)
+    old = pipeline.load_engine()
+    assert pipeline.reload_engine() is not old
+
+
+def test_embed_holds_the_build_marker_until_done(tmp_path, vectorstore, encoder):
+    from src.vectorizer import embed_and_store
+
+    seen = []
+    encode = encoder.encode
+
+    def encode_and_check(texts, **kwargs):
+        seen.append(build_in_progress(vectorstore))
+        return encode(texts, **kwargs)
+
+    encoder.encode = encode_and_check
+    chunk_dir = str(tmp_path / "chunks")
+    with open(os.path.join(chunk_dir, "Gale_chunk_0.json"), "w", encoding="utf-8") as f:
+        json.dump({"title": "Gale", "url": "https://bg3.wiki/wiki/Gale", "tags": ["Companions"],
+                   "chunk_id": "Gale_chunk_0", "content": "Gale is a wizard of Waterdeep."}, f)
+    embed_and_store(chunk_dir, vectorstore, model_name="hashing", model=encoder)
+    assert seen == [True]
+    assert not os.path.exists(os.path.join(vectorstore, BUILD_MARKER_FILE))
+    # Also removed when there was nothing to do
+    embed_and_store(chunk_dir, vectorstore, model_name="hashing", model=encoder)
+    assert not os.path.exists(os.path.join(vectorstore, BUILD_MARKER_FILE))
@@ -0,0 +1,53 @@
+"""RetrievalEngine search over a small vectorstore (src/retriever.py)"""
+import asyncio
+import pytest
+
+
+@pytest.mark.parametrize("hybrid", [True, False])
+@pytest.mark.parametrize("top_k", [0, -1])
+def test_non_positive_top_k_returns_one_hit(engine, hybrid, top_k):
+    assert len(engine.search("fire damage", top_k=top_k, hybrid=hybrid)) == 1
+    assert [len(hits) for hits in engine.search_batch(["fire", "Karlach"], top_k=top_k, hybrid=hybrid)] == [1, 1]
+
+
+def test_explicit_batches_are_encoded_in_one_call(engine, encoder):
+    assert engine.batcher is not None
+    queries = [f"question {i}" for i in range(engine.batcher.max_batch_size + 8)]
+    encoder.calls.clear()
+    engine.search_batch(queries, top_k=1)
+    assert encoder.calls == [queries]
+
+    encoder.calls.clear()
+    more = [f"other question {i}" for i in range(engine.batcher.max_batch_size + 8)]
+    assert asyncio.run(engine.aencode_queries(more)).shape == (len(more), encoder.dim)
+    assert encoder.calls == [more]
+    assert engine.batcher.stats()["items"] == 0
+
+
+@pytest.mark.parametrize("hybrid", [True, False])
+def test_tag_filters_keep_only_matching_chunks(engine, hybrid):
+    hits = engine.search("fire damage", top_k=5, hybrid=hybrid, tags=["companions"])
+    assert {hit["title"] for hit in hits} == {"Shadowheart", "Karlach"}
+    hits = engine.search("fire damage", top_k=5, hybrid=hybrid, tags=["Items", "Locations"])
+    assert {hit["title"] for hit in hits} == {"Everburn Blade", "Grymforge"}
+    assert engine.search("fire damage", top_k=5, hybrid=hybrid, tags=["Unknown"]) == []
+
+
+def test_tag_filters_apply_to_every_query_of_a_batch(engine):
+    results = engine.search_batch(["fire damage", "Karlach", "Underdark forge"], top_k=3, tags=["Spells"])
+    assert all(hit["title"] == "Fireball" for hits in results for hit in hits)
+    assert [len(hits) for hits in results] == [2, 2, 2]
+
+
+def test_encodes_racing_a_batcher_close_fall_back_to_the_model(engine, encoder):
+    submit = engine.batcher.submit
+
+    def close_then_submit(text):
+        # reload_engine() closing the batcher right after the caller chose it
+        engine.batcher.close()
+        return submit(text)
+
+    engine.batcher.submit = close_then_submit
+    assert engine.encode_queries(["closing sync"]).shape == (1, encoder.dim)
+    assert asyncio.run(engine.aencode_queries(["closing async"])).shape == (1, encoder.dim)
+    assert encoder.calls[-2:] == [["closing sync"], ["closing async"]]
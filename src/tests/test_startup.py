@@ -0,0 +1,88 @@
+"""Startup stage tracking (src/startup.py)"""
+import asyncio
+import pytest
+
+from src import startup as startup_module
+from src.startup import StartupStages
+
+
+def test_stages_record_status_and_errors():
+    stages = StartupStages()
+    stages.pending("engine", "database")
+
+    def fail():
+        raise RuntimeError("unreachable")
+
+    async def run():
+        assert await stages.run("engine", lambda: 42) == 42
+        with pytest.raises(RuntimeError):
+            await stages.run("database", fail)
+
+    asyncio.run(run())
+    report = stages.report()
+    assert report["stages"]["engine"]["status"] == "done"
+    assert report["stages"]["database"] == dict(report["stages"]["database"], status="failed", error="unreachable")
+    assert report["failed"] and not report["ready"]
+
+
+def test_health_and_readiness_endpoints(api):
+    _, client = api
+    assert client.get("/readyz").status_code == 200
+    stages = client.get("/healthz").json()["stages"]
+    assert stages["engine"]["status"] == stages["database"]["status"] == "done"
+
+
+def flaky(failures):
+    calls = []
+
+    def stage():
+        calls.append(len(calls))
+        if len(calls) <= failures:
+            raise RuntimeError(f"attempt {len(calls)}")
+        return "loaded"
+    return stage, calls
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+    monkeypatch.setattr(startup_module.asyncio, "sleep", sleep)
+    return delays
+
+
+def test_failed_stages_are_retried_with_backoff(sleeps):
+    stages = StartupStages(retries=3, retry_delay=2, max_retry_delay=5)
+    stage, calls = flaky(3)
+    assert asyncio.run(stages.run("engine", stage)) == "loaded"
+    assert len(calls) == 4 and sleeps == [2, 4, 5]
+    report = stages.report()
+    assert report["stages"]["engine"] == dict(report["stages"]["engine"], status="done", attempts=4)
+    assert "error" not in report["stages"]["engine"] and not report["failed"]
+
+
+def test_stages_fail_once_their_retries_are_used_up(sleeps):
+    stages = StartupStages(retries=2, retry_delay=1)
+    stage, calls = flaky(10)
+    with pytest.raises(RuntimeError, match="attempt 3"):
+        asyncio.run(stages.run("database", stage))
+    assert len(calls) == 3 and sleeps == [1, 2]
+    assert stages.report()["stages"]["database"]["status"] == "failed" and stages.failed
+
+
+def test_liveness_fails_after_a_stage_gave_up(api, monkeypatch):
+    module, client = api
+    assert client.get("/healthz").status_code == 200
+    monkeypatch.setattr(module, "startup", StartupStages(retries=1, retry_delay=0.01))
+    monkeypatch.setattr(module, "init_database", lambda: None)
+    stage, calls = flaky(10)
+    monkeypatch.setattr(module, "load_engine", stage)
+    asyncio.run(module.load_resources())
+    assert len(calls) == 2
+    response = client.get("/healthz")
+    assert response.status_code == 503
+    assert response.json()["stages"]["engine"] == dict(response.json()["stages"]["engine"], status="failed",
+                                                       attempts=2, error="attempt 2")
+    assert client.get("/readyz").status_code == 503
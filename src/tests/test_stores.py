@@ -0,0 +1,77 @@
+"""Packed content store, columnar metadata and tag bitmaps"""
+import numpy as np
+import faiss
+import pytest
+
+from src.content_store import ContentStore, write_content_store, load_content_store
+from src.metadata_store import (write_metadata_store, load_metadata_store, tag_bitmaps, write_tag_index,
+                                load_tag_index, rows_in_bitmap)
+
+ROWS = [
+    {"title": "Fireball", "url": "u0", "tags": ["Spells"], "chunk_id": "Fireball_chunk_0"},
+    None,  # freed by an incremental re-embed
+    {"title": "Karlach", "url": "u2", "tags": ["Companions", "Tieflings"], "chunk_id": "Karlach_chunk_0"},
+    {"title": "Wyll", "url": "u3", "tags": ["companions"], "chunk_id": "Wyll_chunk_0"},
+] + [{"title": f"Page {i}", "url": f"u{i}", "tags": [], "chunk_id": f"Page_{i}_chunk_0"} for i in range(4, 11)]
+
+
+def test_content_store_round_trip(tmp_path):
+    path = str(tmp_path / "content.bin")
+    texts = ["Fireball deals fire damage.", "", None, "Ünïcödé ✓"]
+    write_content_store(path, texts)
+    store = ContentStore(path)
+    try:
+        assert len(store) == 4
+        assert [store.get(row) for row in range(4)] == ["Fireball deals fire damage.", "", "", "Ünïcödé ✓"]
+        assert store.get(4) is None and store.get(-1) is None
+        assert list(store.row_lengths()) == [27, 0, 0, len("Ünïcödé ✓".encode("utf-8"))]
+    finally:
+        store.close()
+
+
+def test_content_store_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a content store")
+    with pytest.raises(ValueError):
+        ContentStore(str(path))
+    assert load_content_store(str(tmp_path)) is None
+
+
+def test_metadata_store_matches_the_rows(tmp_path):
+    assert load_metadata_store(str(tmp_path)) is None
+    write_metadata_store(str(tmp_path), ROWS)
+    store = load_metadata_store(str(tmp_path))
+    try:
+        assert list(store) == ROWS
+        assert store.live_rows() == len(ROWS) - 1
+        with pytest.raises(IndexError):
+            store[len(ROWS)]
+    finally:
+        store.close()
+
+
+def test_tag_bitmaps_use_the_faiss_bit_layout():
+    tags, bitmaps = tag_bitmaps(ROWS)
+    assert tags == ["Companions", "Spells", "Tieflings", "companions"]
+    assert bitmaps.shape == (4, 2)
+    # IDSelectorBitmap must select exactly the rows tag_bitmaps set
+    bitmap = np.ascontiguousarray(bitmaps[tags.index("Companions")])
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    assert [row for row in range(len(ROWS)) if selector.is_member(row)] == [2]
+    assert list(rows_in_bitmap(bitmap, [-1, 0, 2, 3, 99])) == [False, False, True, False, False]
+
+
+def test_tag_index_lookup_is_case_insensitive_or(tmp_path):
+    write_tag_index(str(tmp_path), ROWS)
+    index = load_tag_index(str(tmp_path))
+    selected = lambda tags: list(np.flatnonzero(rows_in_bitmap(index.bitmap(tags), np.arange(len(ROWS)))))
+    # "Companions" and "companions" are different tags in the data; a lookup matches both
+    assert selected(["COMPANIONS"]) == [2, 3]
+    assert selected(["spells", "tieflings"]) == [0, 2]
+    assert selected(["Unknown"]) == []
+
+
+def test_tag_index_is_built_in_memory_for_old_vectorstores(tmp_path):
+    assert load_tag_index(str(tmp_path)) is None
+    index = load_tag_index(str(tmp_path), ROWS)
+    assert list(np.flatnonzero(rows_in_bitmap(index.bitmap(["Spells"]), np.arange(len(ROWS))))) == [0]
@@ -0,0 +1,212 @@
+"""Incremental re-embedding of src/vectorizer.py embed_and_store"""
+import json
+import os
+import numpy as np
+import faiss
+import pytest
+
+from src.content_store import ContentStore, load_content_store
+from src.metadata_store import load_metadata_store, load_tag_index
+from src.retriever import read_index_info
+from src.vectorizer import (
+    INDEX_FILE, MANIFEST_FILE, METADATA_FILE, embed_and_store, encode_streaming, iter_chunks, length_sorted_batches,
+    streaming_build,
+)
+
+from helpers import CHUNKS, write_chunks
+
+
+def write_chunk(chunk_dir, chunk_id, content, title=None, tags=("Test",)):
+    title = title or chunk_id.rsplit("_chunk_", 1)[0]
+    doc = {"title": title, "url": f"https://bg3.wiki/wiki/{title}", "tags": list(tags),
+           "chunk_id": chunk_id, "content": content}
+    with open(os.path.join(chunk_dir, f"{chunk_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+
+
+def assert_aligned(vectorstore_dir, chunk_dir, encoder):
+    """Every chunk is one FAISS id whose vector, content, metadata and manifest entry agree"""
+    chunks = {meta["chunk_id"]: (doc, meta) for doc, meta in iter_chunks(chunk_dir)}
+    index = faiss.read_index(os.path.join(vectorstore_dir, INDEX_FILE))
+    with open(os.path.join(vectorstore_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(os.path.join(vectorstore_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+        json_rows = json.load(f)
+    contents = load_content_store(vectorstore_dir)
+    metadatas = load_metadata_store(vectorstore_dir)
+    tag_index = load_tag_index(vectorstore_dir)
+    try:
+        assert index.ntotal == len(chunks) == metadatas.live_rows()
+        assert set(manifest["chunks"]) == set(chunks)
+        assert len(contents) == len(metadatas) == len(json_rows) == manifest["next_id"]
+        ids = [manifest["chunks"][cid]["id"] for cid in chunks]
+        assert len(set(ids)) == len(ids)
+        texts = [chunks[cid][0] for cid in chunks]
+        _, found = index.search(encoder.encode(texts), 1)
+        for cid, row, hit in zip(chunks, ids, found[:, 0]):
+            doc, meta = chunks[cid]
+            assert hit == row, cid
+            assert contents.get(row) == doc
+            assert metadatas[row] == json_rows[row] == meta
+        live = set(ids)
+        for row in range(len(metadatas)):
+            if row not in live:
+                assert metadatas[row] is None and json_rows[row] is None and contents.get(row) == ""
+        for tag in {tag for _, meta in chunks.values() for tag in meta["tags"]}:
+            expected = {row for row, cid in zip(ids, chunks) if tag in chunks[cid][1]["tags"]}
+            bitmap = np.unpackbits(tag_index.bitmap([tag]), bitorder="little")
+            assert set(np.flatnonzero(bitmap).tolist()) == expected, tag
+    finally:
+        contents.close()
+        metadatas.close()
+    return manifest
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    chunk_dir, vectorstore_dir = str(tmp_path / "chunks"), str(tmp_path / "vectorstore")
+    write_chunks(chunk_dir)
+    return chunk_dir, vectorstore_dir
+
+
+def edit_chunks(chunk_dir):
+    """Change one chunk, remove two, re-tag one and add three"""
+    write_chunk(chunk_dir, "Karlach_chunk_0", "Karlach is a tiefling barbarian from Avernus.", "Karlach",
+                ["Companions"])
+    os.remove(os.path.join(chunk_dir, "Grymforge_chunk_0.json"))
+    os.remove(os.path.join(chunk_dir, "Fireball_chunk_1.json"))
+    write_chunk(chunk_dir, "Shadowheart_chunk_0", "Shadowheart is a half-elf cleric of Shar and an origin companion.",
+                "Shadowheart", ["Companions", "Clerics"])
+    write_chunk(chunk_dir, "Astarion_chunk_0", "Astarion is a vampire spawn rogue.")
+    write_chunk(chunk_dir, "Gale_chunk_0", "Gale is a wizard of Waterdeep.")
+    write_chunk(chunk_dir, "Lae'zel_chunk_0", "Lae'zel is a githyanki fighter.")
+
+
+def test_incremental_update_keeps_rows_aligned(dirs, encoder):
+    chunk_dir, vectorstore_dir = dirs
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", model=encoder)
+    before = assert_aligned(vectorstore_dir, chunk_dir, encoder)
+
+    edit_chunks(chunk_dir)
+    encoder.calls.clear()
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", model=encoder)
+    # Only the changed and new chunks were encoded
+    assert sorted(text for call in encoder.calls for text in call) == sorted([
+        "Karlach is a tiefling barbarian from Avernus.", "Astarion is a vampire spawn rogue.",
+        "Gale is a wizard of Waterdeep.", "Lae'zel is a githyanki fighter.",
+    ])
+    after = assert_aligned(vectorstore_dir, chunk_dir, encoder)
+    # Unchanged and changed chunks keep their id; two new chunks reuse the freed ones
+    for cid in ("Karlach_chunk_0", "Shadowheart_chunk_0", "Fireball_chunk_0", "Everburn_Blade_chunk_0"):
+        assert after["chunks"][cid]["id"] == before["chunks"][cid]["id"]
+    freed = {before["chunks"][cid]["id"] for cid in ("Grymforge_chunk_0", "Fireball_chunk_1")}
+    new_ids = {after["chunks"][cid]["id"] for cid in ("Astarion_chunk_0", "Gale_chunk_0", "Lae'zel_chunk_0")}
+    assert freed < new_ids
+    assert after["next_id"] == before["next_id"] + 1
+
+
+def test_removing_without_adding_leaves_free_rows(dirs, encoder):
+    chunk_dir, vectorstore_dir = dirs
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", model=encoder)
+    os.remove(os.path.join(chunk_dir, "Grymforge_chunk_0.json"))
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", model=encoder)
+    manifest = assert_aligned(vectorstore_dir, chunk_dir, encoder)
+    assert manifest["next_id"] == 6 and len(manifest["chunks"]) == 5
+
+
+def test_unchanged_chunks_leave_the_vectorstore_as_is(dirs, encoder):
+    chunk_dir, vectorstore_dir = dirs
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", model=encoder)
+    version = read_index_info(vectorstore_dir)["version"]
+    mtime = os.stat(os.path.join(vectorstore_dir, INDEX_FILE)).st_mtime_ns
+    encoder.calls.clear()
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", model=encoder)
+    assert encoder.calls == []
+    assert read_index_info(vectorstore_dir)["version"] == version
+    assert os.stat(os.path.join(vectorstore_dir, INDEX_FILE)).st_mtime_ns == mtime
+
+
+def test_hnsw_removal_falls_back_to_a_full_rebuild(dirs, encoder):
+    chunk_dir, vectorstore_dir = dirs
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", index_type="hnsw", model=encoder,
+                    eval_queries=0)
+    assert_aligned(vectorstore_dir, chunk_dir, encoder)
+
+    # Adding only is applied in place
+    write_chunk(chunk_dir, "Astarion_chunk_0", "Astarion is a vampire spawn rogue.")
+    encoder.calls.clear()
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", index_type="hnsw", model=encoder,
+                    eval_queries=0)
+    assert encoder.calls == [["Astarion is a vampire spawn rogue."]]
+    assert_aligned(vectorstore_dir, chunk_dir, encoder)
+
+    edit_chunks(chunk_dir)
+    encoder.calls.clear()
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", index_type="hnsw", model=encoder,
+                    eval_queries=0)
+    # Every chunk was encoded again, into a compact index without free rows
+    encoded = sum(len(call) for call in encoder.calls)
+    manifest = assert_aligned(vectorstore_dir, chunk_dir, encoder)
+    assert encoded == len(manifest["chunks"]) == manifest["next_id"]
+
+
+@pytest.fixture
+def streamed(monkeypatch, encoder):
+    """Make streaming builds (workers=1) load ``encoder``"""
+    monkeypatch.setattr("src.vectorizer.SentenceTransformer", lambda *args, **kwargs: encoder)
+    return encoder
+
+
+def test_batches_are_length_sorted_within_a_window():
+    items = [(row, "x" * length) for row, length in enumerate([5, 1, 4, 2, 3, 9, 8, 7])]
+    batches = list(length_sorted_batches(iter(items), batch_size=2, window_batches=2))
+    assert [[row for row, _ in batch] for batch in batches] == [[1, 3], [2, 0], [4, 7], [6, 5]]
+
+
+def test_encode_streaming_yields_every_row_once(streamed):
+    items = [(row, content) for row, (_, _, content) in enumerate(CHUNKS)]
+    batches = list(encode_streaming("hashing", iter(items), batch_size=4))
+    assert [len(rows) for rows, _ in batches] == [4, 2]
+    rows = np.concatenate([rows for rows, _ in batches])
+    assert sorted(rows.tolist()) == list(range(len(CHUNKS)))
+    embeddings = np.concatenate([embeddings for _, embeddings in batches])
+    assert embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings, streamed.encode([items[row][1] for row in rows]))
+
+
+@pytest.mark.parametrize("index_type, train_size", [("flat", None), ("ivf_flat", 4), ("ivf_flat", 100)])
+def test_streaming_build_adds_every_chunk_under_its_row(tmp_path, streamed, index_type, train_size):
+    chunk_dir = str(tmp_path / "chunks")
+    write_chunks(chunk_dir)
+    content_path = str(tmp_path / "content.bin")
+    # IVF indexes buffer batches until the training sample is full, or to the end
+    index, rows, chunks = streaming_build("hashing", chunk_dir, content_path, index_type, nlist=1,
+                                          train_size=train_size, batch_size=2)
+    assert index.is_trained and index.ntotal == len(rows) == len(chunks) == len(CHUNKS)
+    contents = ContentStore(content_path)
+    try:
+        _, found = index.search(streamed.encode([contents.get(row) for row in range(len(rows))]), 1)
+        assert found[:, 0].tolist() == list(range(len(rows)))
+        for chunk_id, entry in chunks.items():
+            assert rows[entry["id"]]["chunk_id"] == chunk_id
+    finally:
+        contents.close()
+
+
+def test_streaming_embed_writes_an_aligned_vectorstore(dirs, streamed):
+    chunk_dir, vectorstore_dir = dirs
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", incremental=False, streaming=True,
+                    batch_size=4)
+    assert_aligned(vectorstore_dir, chunk_dir, streamed)
+
+
+def test_streaming_without_full_reports_the_incremental_update(dirs, streamed, capsys):
+    chunk_dir, vectorstore_dir = dirs
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", streaming=True)
+    assert "incremental" not in capsys.readouterr().out
+    write_chunk(chunk_dir, "Astarion_chunk_0", "Astarion is a vampire spawn rogue.")
+    streamed.calls.clear()
+    embed_and_store(chunk_dir, vectorstore_dir, model_name="hashing", streaming=True)
+    assert "--streaming only applies to full rebuilds" in capsys.readouterr().out
+    assert streamed.calls == [["Astarion is a vampire spawn rogue."]]
+    assert_aligned(vectorstore_dir, chunk_dir, streamed)
@@ -1,34 +1,437 @@
 import os
 import json
+import shutil
+import uuid
+import hashlib
+import time
+import socket
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from datetime import datetime
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
+from src.embedder import iter_chunk_docs, count_chunk_docs
+from src.content_store import ContentStore, ContentStoreWriter, write_content_store, CONTENT_STORE_FILE
+from src.lexical import build_lexical_index, lexical_path
+from src.metadata_store import write_metadata_store, write_tag_index
+from src.query_encoder import export_int8_encoder, QUERY_ENCODER_DIR
+from src.faiss_index import (
+    base_index, build_index, create_index, default_train_size, describe_index, evaluate_index, format_report,
+    supports_removal, train_index
+)
 
-def embed_and_store(input_dir, vectorstore_dir, model_name="sentence-transformers/all-MiniLM-L6-v2"):
-    os.makedirs(vectorstore_dir, exist_ok=True)
-    model = SentenceTransformer(model_name)
-    docs, metadatas = [], []
-    for fname in os.listdir(input_dir):
-        if not fname.endswith('.json'):
-            continue
-        with open(os.path.join(input_dir, fname), 'r', encoding='utf-8') as f:
-            doc = json.load(f)
-        docs.append(doc["content"])
-        metadatas.append({
+INDEX_FILE = "bg3_faiss.index"
+METADATA_FILE = "bg3_metadata.json"
+INDEX_INFO_FILE = "bg3_index_info.json"
+# chunk_id -> content hash -> FAISS id, used for incremental re-embedding
+MANIFEST_FILE = "bg3_manifest.json"
+# Present while embed_and_store rewrites the vectorstore; the API refuses to
+# reload until it is gone (see retriever.build_in_progress)
+BUILD_MARKER_FILE = "bg3_build.lock"
+
+def sweep_settings(index):
+    """Query-time knob values to report for an index (nprobe for IVF, efSearch for HNSW)"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return [{"nprobe": n} for n in (1, 4, 8, 16, 32, 64) if n <= ivf.nlist]
+    if isinstance(base_index(index), faiss.IndexHNSW):
+        return [{"ef_search": ef} for ef in (16, 32, 64, 128, 256)]
+    return [{}]
+
+def report_index(index, embeddings, k=10, n_queries=200):
+    """Print recall@k against the flat baseline and p50/p99 latency per knob setting"""
+    reports = []
+    print(f"Evaluating {type(base_index(index)).__name__} against exact search:")
+    for settings in sweep_settings(index):
+        report = evaluate_index(index, embeddings, k=k, n_queries=n_queries, **settings)
+        print(f"  {format_report(report)}")
+        reports.append(report)
+    return reports
+
+def iter_chunks(input_dir):
+    """Lazily yield (content, metadata) for every chunk file or JSONL shard line in ``input_dir``"""
+    for doc in iter_chunk_docs(input_dir):
+        yield doc["content"], {
             "title": doc["title"],
             "url": doc["url"],
             "tags": doc["tags"],
             "chunk_id": doc["chunk_id"]
-        })
-    embeddings = model.encode(docs, show_progress_bar=True)
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(np.array(embeddings).astype('float32'))
-    faiss.write_index(index, os.path.join(vectorstore_dir, "bg3_faiss.index"))
-    with open(os.path.join(vectorstore_dir, "bg3_metadata.json"), "w", encoding="utf-8") as f:
-        json.dump(metadatas, f, ensure_ascii=False, indent=2)
+        }
+
+def count_chunks(input_dir):
+    """Number of chunks in ``input_dir`` without parsing them"""
+    return count_chunk_docs(input_dir)
+
+def load_chunks(input_dir):
+    """Read chunk files into parallel lists of contents and metadata dicts"""
+    docs, metadatas = [], []
+    for doc, meta in iter_chunks(input_dir):
+        docs.append(doc)
+        metadatas.append(meta)
+    return docs, metadatas
+
+def length_sorted_batches(items, batch_size, window_batches=32):
+    """
+    Group (row, text) items into batches of similar text length.
+
+    Items are buffered ``batch_size * window_batches`` at a time and sorted by
+    length inside that window, which cuts tokenizer padding without reading
+    the whole corpus into memory.
+    """
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= batch_size * window_batches:
+            window.sort(key=lambda item: len(item[1]))
+            for start in range(0, len(window), batch_size):
+                yield window[start:start + batch_size]
+            window = []
+    window.sort(key=lambda item: len(item[1]))
+    for start in range(0, len(window), batch_size):
+        yield window[start:start + batch_size]
+
+# Per-process encoder used by the multi-process pool
+_worker_model = None
+
+def _init_encoder_worker(model_name, threads):
+    global _worker_model
+    import torch
+    # Split the CPU between workers instead of letting each one grab every core
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+def _encode_in_worker(rows, texts):
+    embeddings = _worker_model.encode(list(texts), batch_size=len(texts), show_progress_bar=False)
+    return rows, np.asarray(embeddings, dtype='float32')
+
+def encode_streaming(model_name, items, batch_size=64, workers=1):
+    """
+    Encode (row, text) items in length-sorted batches.
+
+    Yields (rows, embeddings) per batch as soon as it is encoded. With more
+    than one worker, batches are spread over a pool of CPU processes and
+    results arrive in completion order; at most two batches per worker are
+    in flight, so memory stays bounded.
+    """
+    batches = length_sorted_batches(items, batch_size)
+    if workers <= 1:
+        model = SentenceTransformer(model_name)
+        for batch in batches:
+            rows, texts = zip(*batch)
+            yield np.array(rows, dtype="int64"), np.asarray(
+                model.encode(list(texts), batch_size=batch_size, show_progress_bar=False), dtype='float32')
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_encoder_worker, initargs=(model_name, threads)) as pool:
+        pending = set()
+        for batch in batches:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rows, embeddings = future.result()
+                    yield np.array(rows, dtype="int64"), embeddings
+            rows, texts = zip(*batch)
+            pending.add(pool.submit(_encode_in_worker, rows, texts))
+        for future in as_completed(pending):
+            rows, embeddings = future.result()
+            yield np.array(rows, dtype="int64"), embeddings
+
+def content_hash(text):
+    """Stable hash of a chunk's text, used to detect changed chunks"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_manifest(vectorstore_dir):
+    """Return the chunk manifest of an existing vectorstore, or None"""
+    path = os.path.join(vectorstore_dir, MANIFEST_FILE)
+    if not os.path.exists(path) or not os.path.exists(os.path.join(vectorstore_dir, INDEX_FILE)):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def full_build(model, docs, metadatas, index_type, nlist, train_size, eval_k, eval_queries, **index_kwargs):
+    """Encode every chunk and build a fresh index whose ids are the row numbers"""
+    embeddings = np.asarray(model.encode(docs, show_progress_bar=True), dtype='float32')
+    index = build_index(embeddings, index_type=index_type, nlist=nlist, train_size=train_size, **index_kwargs)
+    evaluation = report_index(index, embeddings, k=eval_k, n_queries=eval_queries) if eval_queries else []
+    chunks = {
+        meta["chunk_id"]: {"hash": content_hash(doc), "id": row}
+        for row, (doc, meta) in enumerate(zip(docs, metadatas))
+    }
+    return index, list(metadatas), list(docs), chunks, evaluation
+
+def streaming_build(model_name, input_dir, content_path, index_type, nlist, train_size,
+                    batch_size=64, workers=1, log_every=10.0, **index_kwargs):
+    """
+    Build a fresh index while streaming chunks from disk.
+
+    Chunk text goes straight to the packed content store as it is read and
+    each encoded batch is appended to the index as soon as it finishes, so
+    memory is bounded by the batch window rather than the corpus. IVF indexes
+    buffer embeddings only until their training sample is full.
+    """
+    rows, chunks = [], {}
+
+    def items():
+        for doc, meta in iter_chunks(input_dir):
+            row = writer.append(doc)
+            rows.append(meta)
+            chunks[meta["chunk_id"]] = {"hash": content_hash(doc), "id": row}
+            yield row, doc
+
+    n_hint = count_chunks(input_dir)
+    index, pending, train_target = None, [], 0
+    encoded, last_log = 0, 0.0
+    start = time.perf_counter()
+    with ContentStoreWriter(content_path) as writer:
+        for ids, embeddings in encode_streaming(model_name, items(), batch_size=batch_size, workers=workers):
+            if index is None:
+                index = create_index(embeddings.shape[1], index_type, nlist=nlist, n_hint=n_hint, **index_kwargs)
+                train_target = train_size or default_train_size(index)
+            if not index.is_trained:
+                pending.append((ids, embeddings))
+                if sum(len(p[0]) for p in pending) >= train_target:
+                    train_index(index, np.concatenate([p[1] for p in pending]), train_size=train_size)
+            if index.is_trained:
+                for batch_ids, batch_embeddings in pending or [(ids, embeddings)]:
+                    index.add_with_ids(batch_embeddings, batch_ids)
+                pending = []
+            encoded += len(ids)
+            elapsed = time.perf_counter() - start
+            if elapsed - last_log >= log_every:
+                print(f"Encoded {encoded}/{n_hint} chunks ({encoded / elapsed:.1f} chunks/sec)")
+                last_log = elapsed
+        if index is not None and not index.is_trained:
+            train_index(index, np.concatenate([p[1] for p in pending]), train_size=train_size)
+            for batch_ids, batch_embeddings in pending:
+                index.add_with_ids(batch_embeddings, batch_ids)
+    elapsed = time.perf_counter() - start
+    print(f"Encoded {encoded} chunks in {elapsed:.1f}s ({encoded / max(elapsed, 1e-9):.1f} chunks/sec, "
+          f"{workers} worker(s), batch size {batch_size})")
+    if index is None:
+        raise ValueError(f"No chunks found in {input_dir}")
+    return index, rows, chunks
+
+def incremental_update(model, vectorstore_dir, manifest, docs, metadatas):
+    """
+    Apply only the differences between the chunk files and the manifest.
+
+    Changed chunks keep their FAISS id and are re-encoded in place; removed
+    chunks free their id for reuse by new chunks. Returns None when the index
+    type cannot remove vectors and a removal is needed, so the caller can fall
+    back to a full build.
+
+    Only the FAISS index is updated in place. The metadata, content, tag and
+    BM25 files are packed by row offset, so the caller rewrites them whole
+    from the returned rows and contents; the returned count of updated rows
+    (0 when nothing changed) lets it skip the writes altogether.
+    """
+    index = faiss.read_index(os.path.join(vectorstore_dir, INDEX_FILE))
+    with open(os.path.join(vectorstore_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    old_chunks = manifest["chunks"]
+    current = {meta["chunk_id"]: (doc, meta) for doc, meta in zip(docs, metadatas)}
+
+    stale = [cid for cid in old_chunks if cid not in current]
+    changed = [cid for cid, (doc, _) in current.items()
+               if cid in old_chunks and old_chunks[cid]["hash"] != content_hash(doc)]
+    added = [cid for cid in current if cid not in old_chunks]
+    print(f"Manifest diff: {len(added)} new, {len(changed)} changed, {len(stale)} removed, "
+          f"{len(current) - len(added) - len(changed)} unchanged chunks.")
+
+    remove_ids = [old_chunks[cid]["id"] for cid in stale + changed]
+    if remove_ids:
+        if not supports_removal(index):
+            print(f"{type(base_index(index)).__name__} does not support removing vectors; rebuilding.")
+            return None
+        index.remove_ids(np.array(remove_ids, dtype="int64"))
+
+    chunks = {cid: entry for cid, entry in old_chunks.items() if cid not in stale}
+    free_ids = sorted(old_chunks[cid]["id"] for cid in stale)
+    next_id = manifest.get("next_id", len(rows))
+    for cid in added:
+        if free_ids:
+            chunk_row = free_ids.pop(0)
+        else:
+            chunk_row = next_id
+            next_id += 1
+        chunks[cid] = {"id": chunk_row}
+
+    encode_ids = changed + added
+    if encode_ids:
+        embeddings = np.asarray(model.encode([current[cid][0] for cid in encode_ids], show_progress_bar=True),
+                                dtype='float32')
+        index.add_with_ids(embeddings, np.array([chunks[cid]["id"] for cid in encode_ids], dtype="int64"))
+
+    # Rows whose chunk was added, changed, removed or re-tagged
+    rows.extend([None] * (next_id - len(rows)))
+    contents = [""] * next_id
+    updated = 0
+    for row in free_ids:
+        rows[row] = None
+        updated += 1
+    for cid, (doc, meta) in current.items():
+        chunk_row = chunks[cid]["id"]
+        chunks[cid]["hash"] = content_hash(doc)
+        contents[chunk_row] = doc
+        if rows[chunk_row] != meta:
+            rows[chunk_row] = meta
+            updated += 1
+    # Changed chunks keep their metadata row but count as an update
+    updated += len(changed)
+    print(f"Encoded {len(encode_ids)} chunks, updated {updated} rows; index has {index.ntotal} vectors.")
+    return index, rows, contents, chunks, next_id, updated
+
+@contextmanager
+def build_marker(vectorstore_dir):
+    """Hold the build marker file of ``vectorstore_dir`` for the duration of a build"""
+    path = os.path.join(vectorstore_dir, BUILD_MARKER_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"host": socket.gethostname(), "pid": os.getpid(),
+                   "started_at": datetime.now().isoformat()}, f)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def lexical_texts(rows, store):
+    """Title and content of every row for the BM25 index (None for freed rows)"""
+    for row, meta in enumerate(rows):
+        yield None if meta is None else f"{meta.get('title') or ''}\n{store.get(row) or ''}"
+
+def query_encoder_export(vectorstore_dir, model_name, quantize_encoder, quantization=None):
+    """
+    Export the int8 query encoder if asked, or keep a previous export of
+    the same model. Returns its index info entry, or None.
+    """
+    encoder_dir = os.path.join(vectorstore_dir, QUERY_ENCODER_DIR)
+    if not quantize_encoder:
+        info_path = os.path.join(vectorstore_dir, INDEX_INFO_FILE)
+        if os.path.exists(info_path):
+            with open(info_path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+            if previous.get("model_name") == model_name and os.path.isdir(encoder_dir):
+                return previous.get("query_encoder")
+        return None
+    if os.path.isdir(encoder_dir):
+        shutil.rmtree(encoder_dir)
+    file_name = export_int8_encoder(model_name, encoder_dir, quantization)
+    return {"kind": "onnx-int8", "path": QUERY_ENCODER_DIR, "file_name": file_name}
+
+def embed_and_store(input_dir, vectorstore_dir, model_name="sentence-transformers/all-MiniLM-L6-v2",
+                    index_type="flat", nlist=None, train_size=None, eval_k=10, eval_queries=200,
+                    incremental=True, streaming=False, batch_size=64, workers=1, quantize_encoder=False,
+                    quantization=None, lexical=True, model=None, **index_kwargs):
+    """
+    Embed chunk files and write the vectorstore.
+
+    With ``incremental`` set and a manifest from a previous run built with the
+    same model and index type, only new or changed chunks are encoded, and a
+    run that finds no changes leaves the vectorstore (and its version) as it
+    is. Any change still rewrites the metadata, content, tag and BM25 files
+    whole: they are packed by row offset and cannot be patched per row.
+    Otherwise every chunk is encoded and the index is rebuilt from scratch;
+    ``streaming`` does that rebuild with bounded memory and ``workers``
+    encoder processes (the recall/latency report is skipped in that mode).
+
+    ``index_type`` "sq8" or "fp16" stores scalar-quantized vectors. With
+    ``quantize_encoder`` an int8 ONNX export of the model is written for the
+    API's QUERY_ENCODER=onnx-int8 (``quantization`` selects the CPU preset).
+    With ``lexical`` a BM25 index over titles and chunk text is built for
+    hybrid retrieval.
+
+    ``model`` is an already-loaded encoder (anything with
+    SentenceTransformer's ``encode``) used instead of loading ``model_name``,
+    which is then only recorded in the manifest. Streaming builds load the
+    model in their worker processes and do not accept it.
+    """
+    if model is not None and streaming:
+        raise ValueError("A preloaded model cannot be used with streaming builds")
+    os.makedirs(vectorstore_dir, exist_ok=True)
+    # The files below are rewritten one by one, and the info file (with the
+    # new version) last; the marker tells a running API not to load them
+    # until the whole set is consistent
+    with build_marker(vectorstore_dir):
+        content_path = os.path.join(vectorstore_dir, CONTENT_STORE_FILE)
+
+        manifest = load_manifest(vectorstore_dir) if incremental else None
+        if manifest is not None and (manifest.get("model_name") != model_name or manifest.get("index_type") != index_type):
+            print("Existing vectorstore was built with a different model or index type; rebuilding.")
+            manifest = None
+
+        update = None
+        if manifest:
+            docs, metadatas = load_chunks(input_dir)
+            update = incremental_update(model or SentenceTransformer(model_name), vectorstore_dir, manifest, docs,
+                                        metadatas)
+        evaluation = []
+        if update is not None:
+            if streaming:
+                print("Applying an incremental update; --streaming only applies to full rebuilds (pass --full).")
+            index, rows, contents, chunks, next_id, updated = update
+            lexical_missing = lexical and not os.path.exists(lexical_path(vectorstore_dir, "json"))
+            if not updated and not quantize_encoder and not lexical_missing:
+                print("Vectorstore is up to date.")
+                return
+        elif streaming:
+            index, rows, chunks = streaming_build(model_name, input_dir, content_path, index_type, nlist, train_size,
+                                                  batch_size=batch_size, workers=workers, **index_kwargs)
+            contents, next_id = None, len(rows)
+        else:
+            docs, metadatas = load_chunks(input_dir)
+            index, rows, contents, chunks, evaluation = full_build(
+                model or SentenceTransformer(model_name), docs, metadatas, index_type, nlist, train_size, eval_k,
+                eval_queries, **index_kwargs)
+            next_id = len(rows)
+
+        # Written to a new file and swapped in: a running API may have the old
+        # index memory-mapped, and must keep seeing it until it reloads
+        index_path = os.path.join(vectorstore_dir, INDEX_FILE)
+        faiss.write_index(index, f"{index_path}.tmp")
+        os.replace(f"{index_path}.tmp", index_path)
+        with open(os.path.join(vectorstore_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        # Columnar copy of the metadata that the API memory-maps
+        write_metadata_store(vectorstore_dir, rows)
+        # Tag -> row bitmaps for filtered search
+        write_tag_index(vectorstore_dir, rows)
+        if contents is not None:
+            # Chunk text packed in FAISS id order so the API can slice it from a mmap
+            write_content_store(content_path, contents)
+        if lexical:
+            # Rebuilt from the packed store on every run; cheap next to encoding
+            store = ContentStore(content_path)
+            try:
+                build_lexical_index(vectorstore_dir, lexical_texts(rows, store))
+            finally:
+                store.close()
+        with open(os.path.join(vectorstore_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "model_name": model_name,
+                "index_type": index_type,
+                "next_id": next_id,
+                "chunks": chunks,
+            }, f, ensure_ascii=False)
+        info = {
+            "version": f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}",
+            "model_name": model_name,
+            "index_type": index_type,
+            "index": describe_index(index),
+            "evaluation": evaluation,
+        }
+        query_encoder = query_encoder_export(vectorstore_dir, model_name, quantize_encoder, quantization)
+        if query_encoder is not None:
+            info["query_encoder"] = query_encoder
+        with open(os.path.join(vectorstore_dir, INDEX_INFO_FILE), "w", encoding="utf-8") as f:
+            json.dump(info, f, indent=2)
 
 if __name__ == "__main__":
     input_dir = "data/chunked_json"
     vectorstore_dir = "embeddings/bg3_vectorstore"
-    embed_and_store(input_dir, vectorstore_dir)
\ No newline at end of file
+    embed_and_store(input_dir, vectorstore_dir)